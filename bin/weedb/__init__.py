@@ -89,6 +89,15 @@ class Connection(object):
         """Returns a list of the column names in the specified table.
         Raises exception of type weedb.OperationalError if the table does not exist."""
         raise NotImplementedError
+        
+    def indexesOf(self, table):
+        """Returns a list of the indexes on the specified table. Each is a
+        2-way tuple (index_name, column_names), where column_names is a list
+        of the indexed columns, in order.
+        
+        Example:
+        ('archive_outTemp', ['dateTime', 'outTemp'])"""
+        raise NotImplementedError
             
     def begin(self):
         raise NotImplementedError
@@ -99,6 +108,25 @@ class Connection(object):
     def rollback(self):
         self.connection.rollback()
         
+    def dataVersion(self):
+        """Return a value that changes whenever another connection commits a
+        change to the database, or None if the database cannot tell."""
+        return None
+        
+    def ping(self):
+        """Return True if the connection to the database still works,
+        otherwise False."""
+        try:
+            cursor = self.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+        
     def close(self):
         try:
             self.connection.close()
@@ -126,12 +154,20 @@ class Transaction(object):
         return self.cursor
     
     def __exit__(self, etyp, einst, etb):
-        if etyp is None:
-            self.connection.commit()
-        else:
-            self.connection.rollback()
         try:
-            self.cursor.close()
-        except:
-            pass
+            if etyp is None:
+                try:
+                    self.connection.commit()
+                except:
+                    # Do not leave a transaction open if it could not be
+                    # committed:
+                    self.connection.rollback()
+                    raise
+            else:
+                self.connection.rollback()
+        finally:
+            try:
+                self.cursor.close()
+            except:
+                pass
 
@@ -154,6 +154,33 @@ class Connection(weedb.Connection):
         column_list = [row[1] for row in self.genSchemaOf(table)]
         return column_list
     
+    def indexesOf(self, table):
+        """Return a list of the indexes on the specified table, including the
+        primary key.
+        
+        If the table does not exist, an exception of type weedb.OperationalError is raised."""
+        
+        index_list = list()
+        index_dict = dict()
+        try:
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute("""SHOW INDEX FROM %s;""" % table)
+            except _mysql_exceptions.ProgrammingError, e:
+                raise weedb.OperationalError(e)
+            while True:
+                row = cursor.fetchone()
+                if row is None: break
+                # Each row is (Table, Non_unique, Key_name, Seq_in_index, Column_name, ...)
+                index_name = str(row[2])
+                if index_name not in index_dict:
+                    index_dict[index_name] = list()
+                    index_list.append((index_name, index_dict[index_name]))
+                index_dict[index_name].append((int(row[3]), str(row[4])))
+        finally:
+            cursor.close()
+        return [(index_name, [col[1] for col in sorted(columns)]) for (index_name, columns) in index_list]
+    
     def begin(self):
         """Begin a transaction."""
         self.query("START TRANSACTION")
@@ -207,6 +234,26 @@ class Cursor(object):
             raise weedb.OperationalError(e)
         return self
         
+    def executemany(self, sql_string, sql_tuple_list):
+        """Execute a SQL statement once for each tuple of values.
+        
+        For INSERT statements, MySQLdb sends all the values in a single
+        multi-row statement.
+        
+        sql_string: A SQL statement to be executed. It should use ? as
+        a placeholder.
+        
+        sql_tuple_list: An iterable of tuples with the values to be used in
+        the placeholders."""
+        
+        mysql_string = sql_string.replace('?','%s')
+        
+        try:
+            self.cursor.executemany(mysql_string, [tuple(sql_tuple) for sql_tuple in sql_tuple_list])
+        except (_mysql_exceptions.OperationalError, _mysql_exceptions.ProgrammingError), e:
+            raise weedb.OperationalError(e)
+        return self
+        
     def fetchone(self):
         # Get a result from the MySQL cursor, then run it through the massage
         # filter below
@@ -0,0 +1,189 @@
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""A pool of database connections, which can be shared between threads.
+
+A connection is checked out by one thread at a time. When it is released, it
+goes back into the pool, where it can be used again by any thread, rather than
+opening a new connection. This saves the cost of a connection (which, for
+MySQL, includes a network round trip and a login) each time a report or a
+RESTful upload runs.
+
+Example:
+    connection = weedb.pool.default_pool.checkout(db_dict)
+    try:
+        ... use the connection ...
+    finally:
+        weedb.pool.default_pool.release(connection)
+"""
+
+from __future__ import with_statement
+import sys
+import syslog
+import threading
+import time
+
+import weedb
+
+class ConnectionPool(object):
+    """A pool of weedb connections, keyed by their database dictionary."""
+
+    def __init__(self, max_size=4, max_idle=300, timeout=60):
+        """Initialize an instance of ConnectionPool.
+
+        max_size: The maximum number of connections, in use or idle, that
+        can be open to any one database.
+
+        max_idle: Idle connections are closed after this many seconds.
+
+        timeout: How long to wait, in seconds, for a connection when max_size
+        of them are already in use."""
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout  = timeout
+        self._cond     = threading.Condition()
+        # Idle connections, key database key, value a list of 2-way tuples
+        # (connection, time of release), with the most recent at the end:
+        self._idle     = dict()
+        # Number of open connections, in use or idle. Key is database key:
+        self._nopen    = dict()
+        # Connections that are checked out. Key is id(connection), value
+        # a 2-way tuple (database key, name of the thread using it):
+        self._in_use   = dict()
+
+    def configure(self, max_size=None, max_idle=None, timeout=None):
+        """Change the limits of the pool. An argument of None leaves the
+        limit unchanged."""
+        with self._cond:
+            if max_size is not None:
+                self.max_size = int(max_size)
+            if max_idle is not None:
+                self.max_idle = float(max_idle)
+            if timeout is not None:
+                self.timeout = float(timeout)
+            self._cond.notifyAll()
+
+    def checkout(self, db_dict):
+        """Get a connection to a database, for the exclusive use of the
+        calling thread, until it is released.
+
+        db_dict: The database dictionary.
+
+        An idle connection is checked that it still works before it is
+        returned. If there is no idle connection, a new one is opened. If
+        max_size connections are in use, wait for one to be released.
+
+        Raises weedb.OperationalError if the database cannot be opened, or
+        if no connection becomes free in time."""
+        key = _key(db_dict)
+        deadline = time.time() + self.timeout
+        with self._cond:
+            self._evict(time.time())
+            while True:
+                if self._idle.get(key):
+                    connection = self._idle[key].pop()[0]
+                    break
+                if self._nopen.get(key, 0) < self.max_size:
+                    # Reserve a place for a new connection:
+                    self._nopen[key] = self._nopen.get(key, 0) + 1
+                    connection = None
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise weedb.OperationalError("Timed out waiting for a free connection to database '%s'" %
+                                                 (db_dict['database'],))
+                self._cond.wait(remaining)
+
+        # Health check the idle connection. This is done outside the lock,
+        # because it may involve a round trip to a server.
+        if connection is not None and not connection.ping():
+            syslog.syslog(syslog.LOG_INFO, "pool: discarding broken connection to database '%s'" %
+                          (db_dict['database'],))
+            connection.close()
+            connection = None
+
+        if connection is None:
+            try:
+                connection = _connect(db_dict)
+            except:
+                # Give back the reserved place:
+                with self._cond:
+                    self._nopen[key] -= 1
+                    self._cond.notify()
+                raise
+
+        with self._cond:
+            self._in_use[id(connection)] = (key, threading.currentThread().getName())
+        return connection
+
+    def release(self, connection, discard=False):
+        """Return a connection to the pool.
+
+        connection: A connection obtained from checkout(). Releasing a
+        connection that is not checked out does nothing.
+
+        discard: True to close the connection, rather than keep it for reuse.
+        Use this if the connection may be in a bad state."""
+        with self._cond:
+            try:
+                (key, _thread_name) = self._in_use.pop(id(connection))
+            except KeyError:
+                return
+            if discard or self.max_idle <= 0:
+                connection.close()
+                self._nopen[key] -= 1
+            else:
+                self._idle.setdefault(key, []).append((connection, time.time()))
+            self._cond.notify()
+
+    def closeAll(self):
+        """Close all idle connections. Connections still in use are not
+        affected."""
+        with self._cond:
+            for key in self._idle:
+                for (connection, _release_ts) in self._idle[key]:
+                    connection.close()
+                    self._nopen[key] -= 1
+            self._idle.clear()
+            self._cond.notifyAll()
+
+    def stats(self):
+        """Return a 2-way tuple: the number of connections in use, and the
+        number that are idle."""
+        with self._cond:
+            return (len(self._in_use), sum(len(v) for v in self._idle.itervalues()))
+
+    def _evict(self, now):
+        """Close the connections that have been idle too long. The lock must
+        be held."""
+        for key in self._idle:
+            # The connections were released in order, so the ones idle the
+            # longest are at the front:
+            while self._idle[key] and now - self._idle[key][0][1] > self.max_idle:
+                (connection, _release_ts) = self._idle[key].pop(0)
+                connection.close()
+                self._nopen[key] -= 1
+                self._cond.notify()
+
+# The pool used by weewx:
+default_pool = ConnectionPool()
+
+def _key(db_dict):
+    """Form a hashable key from a database dictionary."""
+    # Look each value up by key, so a ConfigObj section gets interpolated:
+    return tuple(sorted((k, str(db_dict[k])) for k in db_dict.keys()))
+
+def _connect(db_dict):
+    """Open a connection for use in a pool. A driver can add options for
+    connections that will be used by more than one thread with the module
+    attribute 'pool_options'."""
+    _db_dict = dict((k, db_dict[k]) for k in db_dict.keys())
+    __import__(_db_dict['driver'])
+    _db_dict.update(getattr(sys.modules[_db_dict['driver']], 'pool_options', {}))
+    return weedb.connect(_db_dict)
@@ -11,6 +11,9 @@
 
 from __future__ import with_statement
 import os.path
+import re
+import syslog
+import time
 
 # Import sqlite3. If it does not support the 'with' statement, then
 # import pysqlite2, which might...
@@ -22,6 +25,18 @@ if not hasattr(sqlite3.Connection, "__exit__"):  # @UndefinedVariable
 import weedb
 from weeutil.weeutil import to_bool, to_int
 
+# Pragmas that can be set from the database dictionary. They are applied, in
+# this order, to every new connection.
+pragma_options = ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store')
+
+# Options used for connections in a weedb.pool.ConnectionPool. They can be
+# used by any thread, although by only one at a time:
+pool_options = {'check_same_thread' : False}
+
+# Pragma values are put directly into the SQL, so they must look like a
+# simple word or number:
+_pragma_value_re = re.compile(r'^-?\w+$')
+
 def connect(database='', root='', driver='', **argv):
     """Factory function, to keep things compatible with DBAPI. """
     return Connection(database=database, root=root, **argv)
@@ -49,6 +64,13 @@ def drop(database='', root='', driver='', **argv):
         os.remove(file_path)
     except OSError:
         raise weedb.NoDatabase("""Attempt to drop non-existent database %s""" % (file_path,))
+    # Remove any write-ahead log left behind, so it cannot be applied to a
+    # new database of the same name:
+    for suffix in ('-wal', '-shm'):
+        try:
+            os.remove(file_path + suffix)
+        except OSError:
+            pass
     
 class Connection(weedb.Connection):
     """A wrapper around a sqlite3 connection object."""
@@ -63,6 +85,13 @@ class Connection(weedb.Connection):
             fileroot: An optional path to be prefixed to parameter 'file'. If not given,
             nothing will be prefixed.
             
+            journal_mode, synchronous, cache_size, mmap_size, temp_store: If
+            given, the sqlite pragma of the same name is set to this value.
+            
+            commit_retries, retry_delay, retry_max_delay: How many times a
+            commit is retried if the database is locked, and the initial and
+            maximum delay between tries, in seconds. Defaults are 5, 0.1, 2.0.
+            
         If the operation fails, an exception of type weedb.OperationalError will be raised.
         """
                 
@@ -71,13 +100,85 @@ class Connection(weedb.Connection):
             raise weedb.OperationalError("Attempt to open a non-existent database %s" % database)
         timeout = to_int(argv.get('timeout', 5))
         isolation_level = argv.get('isolation_level')
+        # The number of compiled statements sqlite keeps for reuse:
+        cached_statements = to_int(argv.get('cached_statements', 250))
+        check_same_thread = to_bool(argv.get('check_same_thread', True))
         try:
-            connection = sqlite3.connect(self.file_path, timeout=timeout, isolation_level=isolation_level)
+            connection = sqlite3.connect(self.file_path, timeout=timeout, isolation_level=isolation_level,
+                                         cached_statements=cached_statements, check_same_thread=check_same_thread)
         except sqlite3.OperationalError:
             # The Pysqlite driver does not include the database file path.
             # Include it in case it might be useful.
             raise weedb.OperationalError("Unable to open database '%s'" % (self.file_path,))
         weedb.Connection.__init__(self, connection, database, 'sqlite')
+        # Remember which file was opened. See ping().
+        self._file_id = _file_id(self.file_path)
+
+        # How many times to retry a commit that fails because the database is
+        # busy, and the initial and maximum delay (in seconds) between tries:
+        self.commit_retries   = to_int(argv.get('commit_retries', 5))
+        self.retry_delay      = float(argv.get('retry_delay', 0.1))
+        self.retry_max_delay  = float(argv.get('retry_max_delay', 2.0))
+
+        for pragma in pragma_options:
+            if argv.get(pragma) is not None:
+                self.setPragma(pragma, argv[pragma])
+
+    def setPragma(self, pragma, value):
+        """Set a sqlite pragma on this connection.
+        
+        pragma: The name of the pragma, such as 'journal_mode'.
+        
+        value: Its value, such as 'WAL'.
+        
+        Raises weedb.OperationalError if the value is not acceptable."""
+        value = str(value).strip()
+        if not _pragma_value_re.match(value):
+            raise weedb.OperationalError("Bad value '%s' for pragma %s on database '%s'" % (value, pragma, self.file_path))
+        try:
+            result = self.connection.execute("PRAGMA %s = %s;" % (pragma, value)).fetchone()
+        except sqlite3.OperationalError, e:
+            raise weedb.OperationalError(e)
+        # Pragma journal_mode returns the new mode. It differs from the one
+        # asked for if it could not be set:
+        if pragma == 'journal_mode' and result is not None and str(result[0]).lower() != value.lower():
+            syslog.syslog(syslog.LOG_NOTICE, "sqlite: unable to set journal mode '%s' on database '%s'. Using '%s'." %
+                          (value, self.file_path, result[0]))
+
+    def getPragma(self, pragma):
+        """Return the value of a sqlite pragma on this connection."""
+        _row = self.connection.execute("PRAGMA %s;" % (pragma,)).fetchone()
+        return _row[0] if _row is not None else None
+
+    def dataVersion(self):
+        """Return the sqlite data version. It changes whenever another
+        connection commits a change to the database."""
+        _row = self.connection.execute("PRAGMA data_version;").fetchone()
+        return _row[0] if _row is not None else None
+
+    def ping(self):
+        """Return True if the connection still works, and the database file
+        has not been removed or replaced since it was opened."""
+        return _file_id(self.file_path) == self._file_id and weedb.Connection.ping(self)
+
+    def commit(self):
+        """Commit the current transaction.
+        
+        If the database is locked by another connection, the commit is
+        retried, with a delay that doubles after each try, up to a limit. The
+        transaction stays open between tries."""
+        delay = self.retry_delay
+        for count in range(self.commit_retries + 1):
+            try:
+                self.connection.commit()
+                return
+            except sqlite3.OperationalError, e:
+                if not _is_busy(e) or count >= self.commit_retries:
+                    raise weedb.OperationalError(e)
+                syslog.syslog(syslog.LOG_DEBUG, "sqlite: database '%s' is busy (%s). Retrying commit in %.2f seconds." %
+                              (self.file_path, e, delay))
+                time.sleep(delay)
+                delay = min(delay * 2, self.retry_max_delay)
 
     def cursor(self):
         """Return a cursor object."""
@@ -122,6 +223,18 @@ class Connection(weedb.Connection):
             raise weedb.OperationalError("No such table %s" % table)
         return column_list
 
+    def indexesOf(self, table):
+        """Return a list of the indexes on the specified table, including
+        those sqlite made itself for UNIQUE constraints."""
+        
+        index_list = list()
+        for row in self.connection.execute("""PRAGMA index_list(%s);""" % table):
+            index_name = str(row[1])
+            # Each row of index_info is (seqno, cid, column_name):
+            columns = sorted(self.connection.execute("""PRAGMA index_info(%s);""" % index_name))
+            index_list.append((index_name, [str(col[2]) for col in columns]))
+        return index_list
+
     def begin(self):
         self.connection.execute("BEGIN TRANSACTION")
         
@@ -138,4 +251,25 @@ class Cursor(sqlite3.Cursor):
             return sqlite3.Cursor.execute(self, *args, **kwargs)
         except sqlite3.OperationalError, e:
             # Convert to a weedb exception
-            raise weedb.OperationalError(e)
\ No newline at end of file
+            raise weedb.OperationalError(e)
+
+    def executemany(self, *args, **kwargs):
+        try:
+            return sqlite3.Cursor.executemany(self, *args, **kwargs)
+        except sqlite3.OperationalError, e:
+            # Convert to a weedb exception
+            raise weedb.OperationalError(e)
+
+def _is_busy(e):
+    """Return True if the sqlite exception e was caused by another connection
+    holding a lock on the database (SQLITE_BUSY or SQLITE_LOCKED)."""
+    msg = str(e).lower()
+    return 'locked' in msg or 'busy' in msg
+
+def _file_id(file_path):
+    """Return something that identifies a file, or None if it does not exist."""
+    try:
+        _stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (_stat.st_dev, _stat.st_ino)
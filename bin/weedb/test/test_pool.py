@@ -0,0 +1,113 @@
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""Test the weedb connection pool"""
+
+from __future__ import with_statement
+import threading
+import time
+import unittest
+
+import weedb
+import weedb.pool
+
+sqlite_db_dict = {'database': '/tmp/test_pool.sdb', 'driver':'weedb.sqlite', 'timeout': '2'}
+
+class TestPool(unittest.TestCase):
+    
+    def setUp(self):
+        try:
+            weedb.drop(sqlite_db_dict)
+        except:
+            pass
+        weedb.create(sqlite_db_dict)
+        _connect = weedb.connect(sqlite_db_dict)
+        with weedb.Transaction(_connect) as _cursor:
+            _cursor.execute("CREATE TABLE test1 (dateTime INTEGER NOT NULL UNIQUE PRIMARY KEY, x REAL);")
+            _cursor.execute("INSERT INTO test1 VALUES (1, 10.0)")
+        _connect.close()
+        self.pool = weedb.pool.ConnectionPool(max_size=2, max_idle=60, timeout=0.2)
+
+    def tearDown(self):
+        self.pool.closeAll()
+        try:
+            weedb.drop(sqlite_db_dict)
+        except:
+            pass
+        
+    def test_reuse(self):
+        _connect1 = self.pool.checkout(sqlite_db_dict)
+        self.pool.release(_connect1)
+        self.assertEqual(self.pool.stats(), (0, 1))
+        # The idle connection should be handed out again, even to another
+        # thread, and be usable there:
+        _result = []
+        def borrow():
+            _connect = self.pool.checkout(sqlite_db_dict)
+            _cursor = _connect.cursor()
+            _cursor.execute("SELECT x FROM test1 WHERE dateTime = 1")
+            _result.append((_connect, _cursor.fetchone()[0]))
+            _cursor.close()
+            self.pool.release(_connect)
+        _thread = threading.Thread(target=borrow)
+        _thread.start()
+        _thread.join()
+        self.assertTrue(_result[0][0] is _connect1)
+        self.assertEqual(_result[0][1], 10.0)
+        # Releasing twice does no harm:
+        self.pool.release(_connect1)
+        self.assertEqual(self.pool.stats(), (0, 1))
+        
+    def test_max_size(self):
+        _connect1 = self.pool.checkout(sqlite_db_dict)
+        _connect2 = self.pool.checkout(sqlite_db_dict)
+        self.assertFalse(_connect1 is _connect2)
+        self.assertEqual(self.pool.stats(), (2, 0))
+        # The pool is full. This should time out:
+        self.assertRaises(weedb.OperationalError, self.pool.checkout, sqlite_db_dict)
+        # Release one a little later. The waiting checkout should get it:
+        _timer = threading.Timer(0.05, self.pool.release, (_connect2,))
+        _timer.start()
+        _connect3 = self.pool.checkout(sqlite_db_dict)
+        _timer.join()
+        self.assertTrue(_connect3 is _connect2)
+        self.pool.release(_connect1)
+        self.pool.release(_connect3, discard=True)
+        self.assertEqual(self.pool.stats(), (0, 1))
+        
+    def test_health_check(self):
+        _connect1 = self.pool.checkout(sqlite_db_dict)
+        self.pool.release(_connect1)
+        # Replace the database file. The idle connection no longer refers to
+        # it, so a new one must be opened:
+        weedb.drop(sqlite_db_dict)
+        weedb.create(sqlite_db_dict)
+        self.assertFalse(_connect1.ping())
+        _connect2 = self.pool.checkout(sqlite_db_dict)
+        self.assertFalse(_connect2 is _connect1)
+        self.assertEqual(_connect2.tables(), [])
+        self.pool.release(_connect2)
+        self.assertEqual(self.pool.stats(), (0, 1))
+
+    def test_idle_eviction(self):
+        self.pool.configure(max_idle=0.05)
+        _connect1 = self.pool.checkout(sqlite_db_dict)
+        self.pool.release(_connect1)
+        time.sleep(0.1)
+        _connect2 = self.pool.checkout(sqlite_db_dict)
+        self.assertFalse(_connect2 is _connect1)
+        self.assertEqual(self.pool.stats(), (1, 0))
+        self.pool.release(_connect2)
+
+def suite():
+    tests = ['test_reuse', 'test_max_size', 'test_health_check', 'test_idle_eviction']
+    return unittest.TestSuite(map(TestPool, tests))
+    
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -10,6 +10,8 @@
 """Test the weedb package"""
 
 from __future__ import with_statement
+import threading
+import time
 import unittest
 
 import weedb
@@ -86,6 +88,15 @@ class Common(unittest.TestCase):
             self.assertEqual(schema[icol], col)
         _connect.close()
         
+    def test_indexes(self):
+        self.populate_db()
+        _connect = weedb.connect(self.db_dict)
+        _connect.execute("CREATE INDEX test1_min ON test1 (dateTime, min)")
+        # The databases may also list indexes of their own for the primary key:
+        self.assertTrue(('test1_min', ['dateTime', 'min']) in _connect.indexesOf('test1'))
+        self.assertFalse('test1_min' in [_index[0] for _index in _connect.indexesOf('test2')])
+        _connect.close()
+        
     def test_bad_table(self):
         self.populate_db()
         _connect = weedb.connect(self.db_dict)
@@ -141,6 +152,55 @@ class TestSqlite(Common):
         self.db_dict = sqlite_db_dict
         super(TestSqlite, self).__init__(*args, **kwargs)
         
+    def test_pragmas(self):
+        weedb.create(self.db_dict)
+        _db_dict = dict(self.db_dict, journal_mode='WAL', synchronous='NORMAL', cache_size='-4000', temp_store='MEMORY')
+        _connect = weedb.connect(_db_dict)
+        self.assertEqual(_connect.getPragma('journal_mode'), 'wal')
+        self.assertEqual(_connect.getPragma('synchronous'), 1)
+        self.assertEqual(_connect.getPragma('cache_size'), -4000)
+        self.assertEqual(_connect.getPragma('temp_store'), 2)
+        _connect.close()
+        # Values that could smuggle in more SQL are refused:
+        self.assertRaises(weedb.OperationalError, weedb.connect, dict(self.db_dict, synchronous='OFF; DROP TABLE test1'))
+        
+    def test_busy_commit(self):
+        self.populate_db()
+        # Do not wait on locks inside sqlite, so that the retries get used:
+        _db_dict = dict(self.db_dict, timeout='0', retry_delay='0.05')
+        
+        def hold_lock(locked, hold_time):
+            # Hold a shared lock on the database for a while:
+            _reader = weedb.connect(_db_dict)
+            _reader.begin()
+            _reader.connection.execute("SELECT * FROM test1").fetchone()
+            locked.set()
+            time.sleep(hold_time)
+            _reader.rollback()
+            _reader.close()
+        
+        def insert_while_locked(connect, hold_time, dateTime):
+            _locked = threading.Event()
+            _thread = threading.Thread(target=hold_lock, args=(_locked, hold_time))
+            _thread.start()
+            _locked.wait()
+            try:
+                with weedb.Transaction(connect) as _cursor:
+                    _cursor.execute("INSERT INTO test1 (dateTime, min, mintime) VALUES (?, ?, ?)", (dateTime, 0, 0))
+            finally:
+                _thread.join()
+
+        _connect = weedb.connect(_db_dict)
+        # The commit should succeed once the lock is released:
+        insert_while_locked(_connect, 0.3, 100)
+        self.assertEqual(_connect.connection.execute("SELECT COUNT(*) FROM test1").fetchone()[0], 21)
+        
+        # If the lock is held too long, the retries eventually give up:
+        _connect.commit_retries = 2
+        self.assertRaises(weedb.OperationalError, insert_while_locked, _connect, 1.0, 101)
+        self.assertEqual(_connect.connection.execute("SELECT COUNT(*) FROM test1").fetchone()[0], 21)
+        _connect.close()
+
 class TestMySQL(Common):
     
     def __init__(self, *args, **kwargs):
@@ -150,8 +210,9 @@ class TestMySQL(Common):
     
 def suite():
     tests = ['test_drop', 'test_double_create', 'test_no_db', 'test_no_tables', 
-             'test_create', 'test_bad_table', 'test_select', 'test_bad_select']
-    return unittest.TestSuite(map(TestSqlite, tests) + map(TestMySQL, tests))
+             'test_create', 'test_indexes', 'test_bad_table', 'test_select', 'test_bad_select']
+    sqlite_tests = ['test_pragmas', 'test_busy_commit']
+    return unittest.TestSuite(map(TestSqlite, tests + sqlite_tests) + map(TestMySQL, tests))
     
 if __name__ == '__main__':
     unittest.TextTestRunner(verbosity=2).run(suite())
\ No newline at end of file
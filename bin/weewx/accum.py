@@ -23,7 +23,11 @@ class ScalarStats(object):
     """Accumulates statistics (min, max, average, etc.) for a scalar value.
     
     Property 'last' is the last non-None value seen. Property 'lasttime' is
-    the time it was seen. """
+    the time it was seen.
+    
+    Attribute 'dirty' is True if the stats-tuple has changed since the
+    instance was initialized from a stats-tuple, or since it was last
+    cleared. An instance initialized without a stats-tuple starts out dirty."""
     
     default_init = (None, None, None, None, 0.0, 0)
     
@@ -33,6 +37,7 @@ class ScalarStats(object):
          self.sum, self.count) = stats_tuple if stats_tuple else ScalarStats.default_init
         self.last     = None
         self.lasttime = None
+        self.dirty    = not stats_tuple
          
     def getStatsTuple(self):
         """Return a stats-tuple. That is, a tuple containing the gathered statistics.
@@ -45,10 +50,12 @@ class ScalarStats(object):
             if self.min is None or x_stats.min < self.min:
                 self.min     = x_stats.min
                 self.mintime = x_stats.mintime
+                self.dirty   = True
         if x_stats.max is not None:
             if self.max is None or x_stats.max > self.max:
                 self.max     = x_stats.max
                 self.maxtime = x_stats.maxtime
+                self.dirty   = True
         if x_stats.lasttime is not None:
             if self.lasttime is None or x_stats.lasttime >= self.lasttime:
                 self.lasttime = x_stats.lasttime
@@ -56,8 +63,10 @@ class ScalarStats(object):
 
     def mergeSum(self, x_stats):
         """Merge the sum and count of another accumulator into myself."""
-        self.sum   += x_stats.sum
-        self.count += x_stats.count
+        if x_stats.count:
+            self.sum   += x_stats.sum
+            self.count += x_stats.count
+            self.dirty  = True
 
     def addHiLo(self, val, ts):
         """Include a scalar value in my highs and lows.
@@ -68,9 +77,11 @@ class ScalarStats(object):
             if self.min is None or val < self.min:
                 self.min     = val
                 self.mintime = ts
+                self.dirty   = True
             if self.max is None or val > self.max:
                 self.max     = val
                 self.maxtime = ts
+                self.dirty   = True
             if self.lasttime is None or ts >= self.lasttime:
                 self.last    = val
                 self.lasttime= ts
@@ -80,6 +91,7 @@ class ScalarStats(object):
         if val is not None:
             self.sum   += val
             self.count += 1
+            self.dirty  = True
         
     @property
     def avg(self):
@@ -89,7 +101,9 @@ class VecStats(object):
     """Accumulates statistics for a vector value.
     
     Property 'last' is the last non-None value seen. It is a two-way tuple (mag, dir).
-    Property 'lasttime' is the time it was seen. """
+    Property 'lasttime' is the time it was seen.
+    
+    Attribute 'dirty' has the same meaning as in ScalarStats. """
 
     default_init = (None, None, None, None, 0.0, 0, None, 0.0, 0.0, 0.0, 0)
     
@@ -101,6 +115,7 @@ class VecStats(object):
          self.squaresum, self.squarecount) = stats_tuple if stats_tuple else VecStats.default_init
         self.last     = (None, None)
         self.lasttime = None
+        self.dirty    = not stats_tuple
 
     def getStatsTuple(self):
         """Return a stats-tuple. That is, a tuple containing the gathered statistics."""
@@ -113,11 +128,13 @@ class VecStats(object):
             if self.min is None or x_stats.min < self.min:
                 self.min     = x_stats.min
                 self.mintime = x_stats.mintime
+                self.dirty   = True
         if x_stats.max is not None:
             if self.max is None or x_stats.max > self.max:
                 self.max     = x_stats.max
                 self.maxtime = x_stats.maxtime
                 self.max_dir = x_stats.max_dir
+                self.dirty   = True
         if x_stats.lasttime is not None:
             if self.lasttime is None or x_stats.lasttime >= self.lasttime:
                 self.lasttime = x_stats.lasttime
@@ -125,12 +142,14 @@ class VecStats(object):
 
     def mergeSum(self, x_stats):
         """Merge the sum and count of another accumulator into myself."""
-        self.sum         += x_stats.sum
-        self.count       += x_stats.count
-        self.xsum        += x_stats.xsum
-        self.ysum        += x_stats.ysum
-        self.squaresum   += x_stats.squaresum
-        self.squarecount += x_stats.squarecount
+        if x_stats.count:
+            self.sum         += x_stats.sum
+            self.count       += x_stats.count
+            self.xsum        += x_stats.xsum
+            self.ysum        += x_stats.ysum
+            self.squaresum   += x_stats.squaresum
+            self.squarecount += x_stats.squarecount
+            self.dirty        = True
         
     def addHiLo(self, val, ts):
         """Include a vector value in my highs and lows.
@@ -142,10 +161,12 @@ class VecStats(object):
             if self.min is None or speed < self.min:
                 self.min = speed
                 self.mintime = ts
+                self.dirty = True
             if self.max is None or speed > self.max:
                 self.max = speed
                 self.maxtime = ts
                 self.max_dir = dirN
+                self.dirty = True
             if self.lasttime is None or ts >= self.lasttime:
                 self.last    = (speed, dirN)
                 self.lasttime= ts
@@ -159,6 +180,7 @@ class VecStats(object):
             self.sum         += speed
             self.count       += 1
             self.squaresum   += speed**2
+            self.dirty        = True
             if dirN is not None :
                 self.xsum += speed * math.cos(math.radians(90.0 - dirN))
                 self.ysum += speed * math.sin(math.radians(90.0 - dirN))
@@ -210,10 +232,11 @@ class BaseAccum(dict):
         if not self.timespan.includesArchiveTime(record['dateTime']):
             raise OutOfSpan, "Attempt to add out-of-interval record"
 
+        _ts = record['dateTime']
         # For each type...
-        for obs_type in record:
+        for (obs_type, value) in record.iteritems():
             # ... add to myself
-            self._add_value(record[obs_type], obs_type, record['dateTime'], add_hilo)
+            self._add_value(value, obs_type, _ts, add_hilo)
                 
     def updateHiLo(self, accumulator):
         """Merge the high/low stats of another accumulator into me."""
@@ -226,6 +249,17 @@ class BaseAccum(dict):
             self._init_type(obs_type)
             self[obs_type].mergeHiLo(accumulator[obs_type])
                     
+    def getDirtyTypes(self):
+        """Return a list of the observation types whose statistics have
+        changed. See the attribute 'dirty' of ScalarStats."""
+        return [obs_type for obs_type in self if self[obs_type].dirty]
+    
+    def clearDirty(self):
+        """Mark the statistics of all observation types as unchanged. This is
+        typically done after they have been saved."""
+        for obs_type in self:
+            self[obs_type].dirty = False
+
     def getRecord(self):
         """Extract a record out of the results in the accumulator."""
         
@@ -294,15 +328,16 @@ class WXAccum(BaseAccum):
 
         # This is pretty much like the loop in my superclass's version, except
         # that wind is treated as a vector.
-        for obs_type in record:
+        _ts = record['dateTime']
+        for (obs_type, value) in record.iteritems():
             if obs_type in ['windDir', 'windGust', 'windGustDir']:
                 continue
             elif obs_type == 'windSpeed':
-                self._add_value((record['windSpeed'], record.get('windDir')), 'wind', record['dateTime'], add_hilo)
+                self._add_value((value, record.get('windDir')), 'wind', _ts, add_hilo)
                 if add_hilo:
-                    self['wind'].addHiLo((record.get('windGust'), record.get('windGustDir')), record['dateTime'])
+                    self['wind'].addHiLo((record.get('windGust'), record.get('windGustDir')), _ts)
             else:
-                self._add_value(record[obs_type], obs_type, record['dateTime'], add_hilo)
+                self._add_value(value, obs_type, _ts, add_hilo)
             
     def getRecord(self):
         """Extract a record out of the results in the accumulator.
@@ -341,3 +376,83 @@ class WXAccum(BaseAccum):
         else:
             # Otherwise, pass on to my base class
             return BaseAccum._init_type(self, obs_type)
+
+#===============================================================================
+#                                class TierAccum
+#===============================================================================
+
+class TierVecStats(object):
+    """Accumulates the sums of the x- and y-components, and the extremes, of a
+    wind vector. A value counts if its magnitude is known, and its direction
+    is also known, unless the magnitude is zero."""
+    
+    def __init__(self):
+        self.xsum     = 0.0
+        self.ysum     = 0.0
+        self.count    = 0
+        self.min      = None
+        self.mindir   = None
+        self.max      = None
+        self.maxdir   = None
+        self.lasttime = None
+
+    def add(self, mag, direction, ts):
+        if mag is None or (mag != 0.0 and direction is None):
+            return
+        if mag > 0.0:
+            self.xsum += mag * math.cos(math.radians(90.0 - direction))
+            self.ysum += mag * math.sin(math.radians(90.0 - direction))
+        self.count += 1
+        # Ties go to the first value seen:
+        if self.min is None or mag < self.min:
+            self.min    = mag
+            self.mindir = direction
+        if self.max is None or mag > self.max:
+            self.max    = mag
+            self.maxdir = direction
+        self.lasttime = ts
+
+class TierAccum(BaseAccum):
+    """Accumulates the archive records of one hour, or one day, for a tier
+    table of the archive. Each type gets the min, max, sum, and count kept by
+    ScalarStats. The wind vector types also get a TierVecStats."""
+    
+    # The wind vector types, and the types that hold their magnitude and
+    # direction:
+    windvec_types = {'windvec'     : ('windSpeed', 'windDir'),
+                     'windgustvec' : ('windGust',  'windGustDir')}
+    
+    def __init__(self, timespan):
+        super(TierAccum, self).__init__(timespan)
+        self.lasttime  = None
+        self.vec_stats = {}
+        
+    def addRecord(self, record, add_hilo=True):
+        BaseAccum.addRecord(self, record, add_hilo)
+        _ts = record['dateTime']
+        if self.lasttime is None or _ts > self.lasttime:
+            self.lasttime = _ts
+        for (vec_type, (mag_type, dir_type)) in TierAccum.windvec_types.iteritems():
+            if mag_type in record and dir_type in record:
+                if vec_type not in self.vec_stats:
+                    self.vec_stats[vec_type] = TierVecStats()
+                self.vec_stats[vec_type].add(record[mag_type], record[dir_type], _ts)
+
+    def getRecord(self):
+        """Return a record for the tier table. Its timestamp is the end of
+        the timespan. Each type 'x' has columns 'x_min', 'x_max', 'x_sum', and
+        'x_count'. Each wind vector type 'v' has columns 'v_xsum', 'v_ysum',
+        'v_count', 'v_min', 'v_mindir', 'v_max', 'v_maxdir', and
+        'v_lasttime'."""
+        record = {'dateTime' : self.timespan.stop,
+                  'usUnits'  : self.unit_system,
+                  'lastTime' : self.lasttime}
+        for obs_type in self:
+            record[obs_type + '_min']   = self[obs_type].min
+            record[obs_type + '_max']   = self[obs_type].max
+            record[obs_type + '_sum']   = self[obs_type].sum
+            record[obs_type + '_count'] = self[obs_type].count
+        for (vec_type, vec_stats) in self.vec_stats.iteritems():
+            for stat in ('xsum', 'ysum', 'count', 'min', 'mindir', 'max', 'maxdir', 'lasttime'):
+                record['%s_%s' % (vec_type, stat)] = getattr(vec_stats, stat)
+        return record
@@ -9,11 +9,24 @@
 #
 """Classes and functions for interfacing with a weewx archive."""
 from __future__ import with_statement
+import bisect
+import itertools
 import math
+import operator
 import os.path
 import syslog
+import threading
+import time
+
+# If the user has installed NumPy, use it to calculate wind vector aggregates.
+# Otherwise, fall back to pure Python:
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from weewx.units import ValueTuple
+import weewx.accum
 import weewx.units
 import weeutil.weeutil
 import weedb
@@ -32,7 +45,13 @@ class Archive(object):
     
     sqlkeys: A list of the SQL keys that the database supports.
     
-    std_unit_system: The unit system used by the database."""
+    std_unit_system: The unit system used by the database.
+    
+    db_dict: The database dictionary the database was opened with, or None if
+    it is not known.
+    
+    pool: The weedb.pool.ConnectionPool the connection was borrowed from, or
+    None if it was not. If set, close() returns the connection to the pool."""
     
     def __init__(self, connection, table='archive'):
         """Initialize an object of type weewx.Archive. 
@@ -46,6 +65,31 @@ class Archive(object):
         """
         self.connection = connection
         self.table = table
+        # The database dictionary, if opened with open(). This allows others,
+        # such as other processes, to open their own connection.
+        self.db_dict = None
+        self.pool = None
+        # The timestamps of the first and last records, and the version of the
+        # database they were fetched from. See _getBounds().
+        self._bounds = None
+        self._bounds_version = None
+        # Key used to count the writes to this archive, and to find its cache
+        # of recent records. Use the full path of a sqlite database, if known.
+        self._write_key = (getattr(connection, 'file_path', connection.database), table)
+        # The persistent cache of columns used for plots, if any. See
+        # weewx.vectorcache:
+        self.vector_cache = None
+        # The tier tables that exist, as a list of 2-way tuples (table name,
+        # bucket length), from the finest to the coarsest. See _getTiers():
+        self._tiers = None
+        # The reads of deleted records that could not be served from the tier
+        # tables, and have been logged. See _checkRetained():
+        self._logged_reads = set()
+        # The indexes on the table, as returned by _getIndexes():
+        self._indexes = None
+        # Cache of SQL insert statements, keyed by the set of types in a record,
+        # or by the layout of a RecordView:
+        self._insert_cache = dict()
         try:
             self.sqlkeys = self._getTypes()
         except weedb.OperationalError, e:
@@ -59,7 +103,7 @@ class Archive(object):
         self.std_unit_system = _row[0] if _row is not None else None
 
     @staticmethod
-    def open(archive_db_dict, table='archive'):
+    def open(archive_db_dict, table='archive', pool=None):
         """Open an Archive database.
         
         An exception of type weedb.OperationalError will be raised if the
@@ -68,11 +112,25 @@ class Archive(object):
         An exception of type StandardError will be raised if the database
         exists, but has not been initialized.
         
+        pool: If given, an instance of weedb.pool.ConnectionPool to borrow the
+        connection from. It is given back when the archive is closed.
+        
         Returns:
         An instance of Archive."""
         
-        _connect = weedb.connect(archive_db_dict)
-        return Archive(_connect, table)
+        if pool is None:
+            _connect = weedb.connect(archive_db_dict)
+        else:
+            _connect = pool.checkout(archive_db_dict)
+        try:
+            archive = Archive(_connect, table)
+        except:
+            if pool is not None:
+                pool.release(_connect, discard=True)
+            raise
+        archive.db_dict = archive_db_dict
+        archive.pool = pool
+        return archive
     
     @staticmethod
     def open_with_create(archive_db_dict, archiveSchema, table='archive'):
@@ -96,14 +154,26 @@ class Archive(object):
             pass
 
         _connect = Archive._create_table(archive_db_dict, archiveSchema, table)        
-        return Archive(_connect, table)
+        archive = Archive(_connect, table)
+        archive.db_dict = archive_db_dict
+        return archive
     
     @property
     def database(self):
         return self.connection.database
+
+    @property
+    def write_key(self):
+        """A 2-way tuple (database, table) that is the same for every Archive
+        object in this process that uses this database and table. The
+        database is the full path of a sqlite database, if known."""
+        return self._write_key
     
     def close(self):
-        self.connection.close()
+        if self.pool is not None:
+            self.pool.release(self.connection)
+        else:
+            self.connection.close()
 
     def __enter__(self):
         return self
@@ -116,80 +186,252 @@ class Archive(object):
         
         returns: Time of the last good archive record as an epoch time, or
         None if there are no records."""
-        _row = self.getSql("SELECT MAX(dateTime) FROM %s" % self.table)
-        return _row[0] if _row else None
+        return self._getBounds()[1]
     
     def firstGoodStamp(self):
         """Retrieves earliest timestamp in the archive.
         
         returns: Time of the first good archive record as an epoch time, or
         None if there are no records."""
-        _row = self.getSql("SELECT MIN(dateTime) FROM %s" % self.table)
-        return _row[0] if _row else None
+        return self._getBounds()[0]
+
+    def retainedFrom(self):
+        """Retrieves the time of the first archive record, if older records
+        have been deleted after they were rolled up. See rollUp().
+        
+        returns: Time of the first archive record as an epoch time, or None if
+        no records have been deleted."""
+        _first_ts = self.firstGoodStamp()
+        _tiers = self._getTiers()
+        if _first_ts is None or not _tiers:
+            return None
+        # Unless records were deleted, the first bucket of a tier ends at, or
+        # after, the first record:
+        _row = self.getSql("SELECT MIN(dateTime) FROM %s" % _tiers[0][0])
+        if not _row or _row[0] is None or _row[0] >= _first_ts:
+            return None
+        return _first_ts
+
+    def _getBounds(self):
+        """Return the timestamps of the first and last records as a 2-way
+        tuple.
+        
+        They are cached, and only fetched again if the database has been
+        written to through some other connection. See _getVersion()."""
+        _version = self._getVersion()
+        if self._bounds is None or _version != self._bounds_version:
+            _first = self.getSql("SELECT MIN(dateTime) FROM %s" % self.table)
+            _last  = self.getSql("SELECT MAX(dateTime) FROM %s" % self.table)
+            self._bounds = (_first[0] if _first else None, _last[0] if _last else None)
+            self._bounds_version = _version
+        return self._bounds
+
+    def _getVersion(self):
+        """Return a value that changes whenever records are added by some
+        other Archive object in this process, or, if the database driver can
+        tell, by any other connection to the database."""
+        return (self._getWriteCount(), self.connection.dataVersion())
+
+    def _getWriteCount(self):
+        """Return the number of times records have been added to this archive
+        by this process."""
+        return _write_counts.get(self._write_key, 0)
+
+    def getUnorderedCount(self):
+        """Return the number of times this process has changed this archive
+        other than by adding records after the last one: by adding records
+        out of order, or deleting them."""
+        return _unordered_counts.get(self._write_key, 0)
 
-    def addRecord(self, record_obj, log_level=syslog.LOG_NOTICE):
+    def _wroteRecords(self, first_ts, last_ts, cache_ok):
+        """Note that records with timestamps from first_ts to last_ts have
+        been added, and update the cached bounds.
+        
+        cache_ok: True if the cached bounds were good before the write, and
+        all the records were added. Otherwise, the cache is thrown away."""
+        if first_ts is None:
+            # Nothing was written.
+            return
+        _countWrite(self._write_key, cache_ok and (self._bounds[1] is None or first_ts > self._bounds[1]))
+        _recent = _recent_records.get(self._write_key)
+        if _recent is not None:
+            _recent.update(self, first_ts)
+        if cache_ok:
+            (_first, _last) = self._bounds
+            self._bounds = (first_ts if _first is None else min(_first, first_ts),
+                            last_ts  if _last  is None else max(_last,  last_ts))
+            self._bounds_version = self._getVersion()
+        else:
+            self._bounds = None
+
+    def addRecord(self, record_obj, log_level=syslog.LOG_NOTICE, chunk_size=1000):
         """Commit a single record or a collection of records to the archive.
         
         record_obj: Either a data record, or an iterable that can return data
         records. Each data record must look like a dictionary, where the keys
         are the SQL types and the values are the values to be stored in the
-        database."""
+        database.
+        
+        log_level: The syslog priority used to log successful additions.
         
+        chunk_size: If record_obj is an iterable, records are inserted in
+        chunks of up to this many records. [Optional. Default is 1000]"""
+        
+        # Whether the cached first and last timestamps can be updated as the
+        # records go in, rather than fetched again. They also tell whether the
+        # records go after the last one. See _wroteRecords():
+        self._getBounds()
+        cache_ok = self._bounds is not None and self._getVersion() == self._bounds_version
+
         # Determine if record_obj is just a single dictionary instance
-        # (in which case it will have method 'keys'). If so, wrap it in
-        # something iterable (a list):
-        record_list = [record_obj] if hasattr(record_obj, 'keys') else record_obj
+        # (in which case it will have method 'keys'):
+        if hasattr(record_obj, 'keys'):
+            with weedb.Transaction(self.connection) as cursor:
+                (sql_insert_stmt, value_list) = self._prepareInsert(record_obj)
+                try:
+                    cursor.execute(sql_insert_stmt, value_list)
+                    syslog.syslog(log_level, "archive: added record %s to database '%s'; table '%s'" % 
+                                  (weeutil.weeutil.timestamp_to_string(record_obj['dateTime']), 
+                                   os.path.basename(self.connection.database),
+                                   self.table))
+                except Exception, e:
+                    cache_ok = False
+                    syslog.syslog(syslog.LOG_ERR, "archive: unable to add record %s to database '%s': %s" %
+                                  (weeutil.weeutil.timestamp_to_string(record_obj['dateTime']), 
+                                   os.path.basename(self.connection.database),
+                                   e))
+            self._wroteRecords(record_obj['dateTime'], record_obj['dateTime'], cache_ok)
+            return
 
+        # It's an iterable. Gather records with the same set of types into
+        # chunks, then insert each chunk with a single executemany.
+        first_ts = last_ts = None
         with weedb.Transaction(self.connection) as cursor:
+            chunk_stmt = None
+            chunk = list()
+            for record in record_obj:
+                (sql_insert_stmt, value_list) = self._prepareInsert(record)
+                if chunk and (sql_insert_stmt is not chunk_stmt or len(chunk) >= chunk_size):
+                    cache_ok &= self._addChunk(cursor, chunk_stmt, chunk, log_level)
+                    chunk = list()
+                chunk_stmt = sql_insert_stmt
+                chunk.append(value_list)
+                # The first element of value_list is always the timestamp:
+                if first_ts is None or value_list[0] < first_ts:
+                    first_ts = value_list[0]
+                if last_ts is None or value_list[0] > last_ts:
+                    last_ts = value_list[0]
+            if chunk:
+                cache_ok &= self._addChunk(cursor, chunk_stmt, chunk, log_level)
+        self._wroteRecords(first_ts, last_ts, cache_ok)
 
-            for record in record_list:
-    
-                if record['dateTime'] is None:
-                    syslog.syslog(syslog.LOG_ERR, "archive: archive record with null time encountered")
-                    raise weewx.ViolatedPrecondition("Archive record with null time encountered.")
+    def _prepareInsert(self, record):
+        """Check a record, then return the SQL insert statement and the list of
+        values needed to add it to the database.
+        
+        returns: A 2-way tuple (sql_insert_stmt, value_list). The first
+        element of value_list is always the timestamp."""
 
-                # Check to make sure the incoming record is in the same unit
-                # system as the records already in the database:
-                if self.std_unit_system:
-                    if record['usUnits'] != self.std_unit_system:
-                        raise ValueError("Unit system of incoming record (0x%x) "\
-                                         "differs from the archive database (0x%x)" % 
-                                         (record['usUnits'], self.std_unit_system))
-                else:
-                    # This is the first record. Remember the unit system to
-                    # check against subsequent records:
-                    self.std_unit_system = record['usUnits']
-
-                # Only data types that appear in the database schema can be
-                # inserted. To find them, form the intersection between the
-                # set of all record keys and the set of all sql keys
-                record_key_set = set(record.keys())
-                insert_key_set = record_key_set.intersection(self.sqlkeys)
-                # Convert to an ordered list:
-                key_list = list(insert_key_set)
-                # Get the values in the same order:
-                value_list = [record[k] for k in key_list]
-                
-                # This will a string of sql types, separated by commas. Because
-                # some of the weewx sql keys (notably 'interval') are reserved
-                # words in MySQL, put them in backquotes.
-                k_str = ','.join(["`%s`" % k for k in key_list])
-                # This will be a string with the correct number of placeholder
-                # question marks:
-                q_str = ','.join('?' * len(key_list))
-                # Form the SQL insert statement:
-                sql_insert_stmt = "INSERT INTO %s (%s) VALUES (%s)" % (self.table, k_str, q_str) 
+        if record['dateTime'] is None:
+            syslog.syslog(syslog.LOG_ERR, "archive: archive record with null time encountered")
+            raise weewx.ViolatedPrecondition("Archive record with null time encountered.")
+
+        # Check to make sure the incoming record is in the same unit
+        # system as the records already in the database:
+        if self.std_unit_system:
+            if record['usUnits'] != self.std_unit_system:
+                raise ValueError("Unit system of incoming record (0x%x) "\
+                                 "differs from the archive database (0x%x)" % 
+                                 (record['usUnits'], self.std_unit_system))
+        else:
+            # This is the first record. Remember the unit system to
+            # check against subsequent records:
+            self.std_unit_system = record['usUnits']
+
+        if isinstance(record, RecordView):
+            # For a view, the columns to be inserted are picked out of the
+            # underlying row by a getter, formed once for each layout.
+            try:
+                (sql_insert_stmt, getter) = self._insert_cache[record.layout]
+            except KeyError:
+                (key_list, sql_insert_stmt) = self._getInsertStmt(record.layout.key_set)
+                getter = operator.itemgetter(*[record.layout.index[k] for k in key_list])
+                if len(key_list) == 1:
+                    getter = lambda row, _getter=getter : (_getter(row),)
+                self._insert_cache[record.layout] = (sql_insert_stmt, getter)
+            return (sql_insert_stmt, getter(record.row))
+
+        (key_list, sql_insert_stmt) = self._getInsertStmt(frozenset(record.keys()))
+
+        # Get the values in the same order:
+        value_list = [record[k] for k in key_list]
+        return (sql_insert_stmt, value_list)
+
+    def _getInsertStmt(self, record_key_set):
+        """Return the list of keys to be inserted, and the SQL insert
+        statement, for a record with the given set of keys.
+        
+        The statement depends only on the set of types in the record, so it
+        is formed only once for each distinct set."""
+        try:
+            (key_list, sql_insert_stmt) = self._insert_cache[record_key_set]
+        except KeyError:
+            # Only data types that appear in the database schema can be
+            # inserted. To find them, form the intersection between the
+            # set of all record keys and the set of all sql keys
+            insert_key_set = record_key_set.intersection(self.sqlkeys)
+            # Convert to an ordered list, with the timestamp first:
+            key_list = ['dateTime'] + [k for k in insert_key_set if k != 'dateTime']
+            # This will a string of sql types, separated by commas. Because
+            # some of the weewx sql keys (notably 'interval') are reserved
+            # words in MySQL, put them in backquotes.
+            k_str = ','.join(["`%s`" % k for k in key_list])
+            # This will be a string with the correct number of placeholder
+            # question marks:
+            q_str = ','.join('?' * len(key_list))
+            # Form the SQL insert statement:
+            sql_insert_stmt = "INSERT INTO %s (%s) VALUES (%s)" % (self.table, k_str, q_str)
+            self._insert_cache[record_key_set] = (key_list, sql_insert_stmt)
+        return (key_list, sql_insert_stmt)
+
+    def _addChunk(self, cursor, sql_insert_stmt, chunk, log_level):
+        """Insert a chunk of records that share the same insert statement.
+        
+        If the chunk cannot be inserted as a whole (for example, because one
+        of the records already exists), it is rolled back and the records are
+        inserted one at a time, so that only the offending records are lost.
+        
+        returns: True if all the records were added, otherwise False."""
+        
+        t1 = time.time()
+        cursor.execute("SAVEPOINT weewx_chunk")
+        try:
+            cursor.executemany(sql_insert_stmt, chunk)
+        except Exception:
+            cursor.execute("ROLLBACK TO SAVEPOINT weewx_chunk")
+            nadded = 0
+            for value_list in chunk:
                 try:
                     cursor.execute(sql_insert_stmt, value_list)
-                    syslog.syslog(log_level, "archive: added record %s to database '%s'; table '%s'" % 
-                                  (weeutil.weeutil.timestamp_to_string(record['dateTime']), 
-                                   os.path.basename(self.connection.database),
-                                   self.table))
+                    nadded += 1
                 except Exception, e:
                     syslog.syslog(syslog.LOG_ERR, "archive: unable to add record %s to database '%s': %s" %
-                                  (weeutil.weeutil.timestamp_to_string(record['dateTime']), 
+                                  (weeutil.weeutil.timestamp_to_string(value_list[0]), 
                                    os.path.basename(self.connection.database),
                                    e))
+        else:
+            nadded = len(chunk)
+        cursor.execute("RELEASE SAVEPOINT weewx_chunk")
+        t2 = time.time()
+        
+        syslog.syslog(log_level, "archive: added %d records from %s to %s to database '%s'; table '%s' "\
+                      "in %0.2f seconds (%0.0f records/second)" %
+                      (nadded, 
+                       weeutil.weeutil.timestamp_to_string(chunk[0][0]),
+                       weeutil.weeutil.timestamp_to_string(chunk[-1][0]),
+                       os.path.basename(self.connection.database),
+                       self.table, t2 - t1, len(chunk) / max(t2 - t1, 1.0e-6)))
+        return nadded == len(chunk)
 
     def genBatchRows(self, startstamp=None, stopstamp=None):
         """Generator function that yields raw rows from the archive database
@@ -202,6 +444,12 @@ class Archive(object):
         end at last archive record.
         
         yields: A list with the data records"""
+        _recent_rows = self._getRecentRows(startstamp, stopstamp if stopstamp is not None else float('inf'))
+        if _recent_rows is not None:
+            for _row in _recent_rows:
+                yield _row
+            return
+
         _cursor = self.connection.cursor()
         try:
             if startstamp is None:
@@ -239,38 +487,230 @@ class Archive(object):
         
         for _row in self.genBatchRows(startstamp, stopstamp):            
             yield dict(zip(self.sqlkeys, _row)) if _row else None
+
+    def genBatchViews(self, startstamp=None, stopstamp=None):
+        """Generator function that yields lightweight, read-only views of the
+        records with timestamps within an interval.
+        
+        This is like genBatchRecords(), except that no dictionary is built for
+        each row. Instead, each row is wrapped in a RecordView, which shares a
+        single column index with all the other rows. Use it when streaming
+        through many records that are only read, then thrown away. Use
+        genBatchRecords() if the records are to be modified or kept.
+        
+        startstamp: Exclusive start of the interval in epoch time. If 'None',
+        then start at earliest archive record.
+        
+        stopstamp: Inclusive end of the interval in epoch time. If 'None', then
+        end at last archive record.
+        
+        yields: A RecordView for each record."""
+        
+        _layout = RecordLayout(self.sqlkeys)
+        for _row in self.genBatchRows(startstamp, stopstamp):
+            yield RecordView(_layout, _row)
+        
+    def cacheRecentRecords(self, max_size):
+        """Keep the most recent records of this archive in memory, where they
+        can be read by any Archive object in this process that uses the same
+        database and table. Reads that fall entirely within the cached records
+        do not touch the database.
+        
+        The cache is updated as records are added through any Archive object
+        in this process. Records added by other processes are not seen.
+        
+        max_size: The number of records to keep. Zero to stop caching."""
+        with _recent_records_lock:
+            if max_size:
+                _recent = RecentRecords(self.sqlkeys, max_size)
+                _recent.load(self)
+                _recent_records[self._write_key] = _recent
+            else:
+                _recent_records.pop(self._write_key, None)
+
+    def _getRecentRows(self, startstamp, stopstamp, include_start=False):
+        """Return the rows with timestamps in an interval from the cache of
+        recent records, or None if the cache does not cover it.
+        
+        startstamp: Exclusive start of the interval, unless include_start is
+        True.
         
+        stopstamp: Inclusive end of the interval.
+        
+        returns: A list of rows, each in the same order as sqlkeys."""
+        _recent = _recent_records.get(self._write_key)
+        if _recent is None or startstamp is None or _recent.keys != self.sqlkeys:
+            return None
+        return _recent.getRows(startstamp, stopstamp, include_start)
+
+    def getRecentColumns(self, columns, startstamp, stopstamp, include_start=False):
+        """Return some columns of the records in an interval from the cache
+        of recent records (see cacheRecentRecords()), or None if the cache
+        does not cover the interval.
+        
+        columns: The columns, as a string separated by commas (e.g.,
+        'windSpeed, windDir'). If they are not all simple types of the
+        archive, None is returned.
+        
+        startstamp: Exclusive start of the interval, unless include_start is
+        True.
+        
+        stopstamp: Inclusive end of the interval.
+        
+        returns: A list of tuples, one for each record in time order, holding
+        dateTime, the columns, then usUnits."""
+        _names = ['dateTime'] + [c.strip() for c in columns.split(',')] + ['usUnits']
+        if not all(_name in self.sqlkeys for _name in _names):
+            return None
+        _rows = self._getRecentRows(startstamp, stopstamp, include_start)
+        if _rows is None:
+            return None
+        _getter = operator.itemgetter(*[self.sqlkeys.index(_name) for _name in _names])
+        return [_getter(_row) for _row in _rows]
+
+    def _genColumns(self, sql_columns, startstamp, stopstamp, include_start=False):
+        """Generator function that yields rows that look like (dateTime,
+        <sql_columns>, usUnits), in time order, from the cache of recent
+        records if it covers the interval, otherwise from the vector cache,
+        if there is one, otherwise from the database.
+        
+        startstamp: Exclusive start of the interval, unless include_start is
+        True.
+        
+        stopstamp: Inclusive end of the interval."""
+        _recent_rows = self.getRecentColumns(sql_columns, startstamp, stopstamp, include_start)
+        if _recent_rows is not None:
+            for _rec in _recent_rows:
+                yield _rec
+            return
+        if self.vector_cache is not None:
+            _cached_rows = self.vector_cache.getColumns(self, sql_columns, startstamp, stopstamp, include_start)
+            if _cached_rows is not None:
+                for _rec in _cached_rows:
+                    yield _rec
+                return
+        (sql_str, _unit_system) = self._planColumns(sql_columns, startstamp, stopstamp, include_start)
+        if _unit_system is not None:
+            for _rec in self.genSql(sql_str, (startstamp, stopstamp)):
+                yield tuple(_rec) + (_unit_system,)
+        else:
+            for _rec in self.genSql(sql_str, (startstamp, stopstamp)):
+                yield _rec
+
+    def _planColumns(self, sql_columns, startstamp, stopstamp, include_start=False):
+        """Return the SQL statement that _genColumns() uses to scan the
+        database, as a 2-way tuple (sql_str, unit_system).
+        
+        If there is a covering index for sql_columns, and the unit system
+        does not change within the interval, the statement leaves out
+        usUnits, so that only the index is read. Then unit_system is the unit
+        system of all the rows. Otherwise, it is None, and the statement
+        reads usUnits as the last column."""
+        _op = '>=' if include_start else '>'
+        if self._isCovered(sql_columns):
+            _unit_system = self._getUnitSystem(startstamp, stopstamp)
+            if _unit_system is not None:
+                return ("SELECT dateTime, %s FROM %s WHERE dateTime %s ? AND dateTime <= ? "\
+                        "ORDER BY dateTime ASC" % (sql_columns, self.table, _op), _unit_system)
+        return ("SELECT dateTime, %s, usUnits FROM %s WHERE dateTime %s ? AND dateTime <= ? "\
+                "ORDER BY dateTime ASC" % (sql_columns, self.table, _op), None)
+
+    def _isCovered(self, sql_columns):
+        """Return True if there is an index that leads with dateTime and holds
+        all the columns in sql_columns, a string separated by commas."""
+        _names = set(_name.strip() for _name in sql_columns.split(','))
+        return any(_names.issubset(_columns) for _columns in self._getIndexes()[0])
+
+    def _getUnitSystem(self, startstamp, stopstamp):
+        """Return the unit system of all the records with timestamps from
+        startstamp to stopstamp, inclusive. Returns None if it changes within
+        that time, or if there is no index on usUnits to find out cheaply.
+        
+        Each query is answered from the index on usUnits with a probe or two,
+        rather than with a scan of the records."""
+        if not self._getIndexes()[1]:
+            return None
+        _min = self.getSql("SELECT MIN(usUnits) FROM %s" % self.table)
+        _max = self.getSql("SELECT MAX(usUnits) FROM %s" % self.table)
+        if _min is None or _min[0] is None:
+            return None
+        if _min[0] == _max[0]:
+            # The usual case: the whole archive uses the same unit system.
+            return _min[0]
+        _first = self.getSql("SELECT usUnits FROM %s WHERE dateTime >= ? AND dateTime <= ? LIMIT 1" % self.table,
+                             (startstamp, stopstamp))
+        if _first is None:
+            return None
+        # Look for any other unit system in the time range. The unary plus
+        # keeps sqlite from using the primary key, so it uses the index on
+        # usUnits instead.
+        for _op in ('<', '>'):
+            if self.getSql("SELECT usUnits FROM %s WHERE usUnits %s ? AND +dateTime >= ? AND +dateTime <= ? LIMIT 1" %
+                           (self.table, _op), (_first[0], startstamp, stopstamp)) is not None:
+                return None
+        return _first[0]
+
     def getRecord(self, timestamp, max_delta=None):
         """Get a single archive record with a given epoch time stamp.
         
         timestamp: The epoch time of the desired record.
         
-        max_delta: The largest difference in time that is acceptable. 
-        [Optional. The default is no difference]
+        max_delta: The largest difference in time that is acceptable. The
+        record closest in time is returned. If two are equally close, the
+        earlier one is returned. [Optional. The default is no difference]
         
-        returns: a record dictionary or None if the record does not exist."""
+        returns: a record dictionary or None if the record does not exist. This
+        includes records deleted by the retention policy of rollUp()."""
+
+        _recent_rows = self._getRecentRows(timestamp - (max_delta or 0), timestamp + (max_delta or 0), True)
+        if _recent_rows is not None:
+            _row = _nearestRow(_recent_rows, self.sqlkeys.index('dateTime'), timestamp)
+            return dict(zip(self.sqlkeys, _row)) if _row else None
 
         _cursor = self.connection.cursor()
         try:
             if max_delta:
-                time_start_ts = timestamp - max_delta
-                time_stop_ts  = timestamp + max_delta
-                _cursor.execute("SELECT * FROM %s WHERE dateTime>=? AND dateTime<=? "\
-                                "ORDER BY ABS(dateTime-?) ASC LIMIT 1" % (self.table,),
-                                (time_start_ts, time_stop_ts, timestamp))
+                _row = self._getNearestRow(_cursor, timestamp, max_delta)
             else:
                 _cursor.execute("SELECT * FROM %s WHERE dateTime=?" %
                                 (self.table,), (timestamp,))
-            _row = _cursor.fetchone()
+                _row = _cursor.fetchone()
             return dict(zip(self.sqlkeys, _row)) if _row else None
         finally:
             _cursor.close()
 
+    def _getNearestRow(self, cursor, timestamp, max_delta):
+        """Return the row closest in time to timestamp, within max_delta, or
+        None if there is none.
+        
+        Rather than sorting all the rows in the window by distance, this
+        makes two probes on the dateTime index: the last row at or before the
+        timestamp, and the first row after it. The closer of the two wins."""
+        
+        _ts_index = self.sqlkeys.index('dateTime')
+        cursor.execute("SELECT * FROM %s WHERE dateTime<=? AND dateTime>=? "\
+                       "ORDER BY dateTime DESC LIMIT 1" % (self.table,),
+                       (timestamp, timestamp - max_delta))
+        _before = cursor.fetchone()
+        if _before is not None and _before[_ts_index] == timestamp:
+            return _before
+        cursor.execute("SELECT * FROM %s WHERE dateTime>? AND dateTime<=? "\
+                       "ORDER BY dateTime ASC LIMIT 1" % (self.table,),
+                       (timestamp, timestamp + max_delta))
+        _after = cursor.fetchone()
+        if _after is None:
+            return _before
+        if _before is None or _after[_ts_index] - timestamp < timestamp - _before[_ts_index]:
+            return _after
+        return _before
+
     def updateValue(self, timestamp, obs_type, new_value):
         """Update (replace) a single value in the database."""
         
         self.connection.execute("UPDATE %s SET %s=? WHERE dateTime=?" % 
                                 (self.table, obs_type), (new_value, timestamp))
+        if self.vector_cache is not None:
+            self.vector_cache.drop(obs_type)
 
     def getSql(self, sql, sqlargs=()):
         """Executes an arbitrary SQL statement on the database.
@@ -369,35 +809,84 @@ class Archive(object):
         data_vec = list()
         std_unit_system = None
 
+        if not aggregate_type:
+            # Records deleted by the retention policy are stood in for by the
+            # hourly averages:
+            (time_vec, data_vec, std_unit_system, startstamp) = \
+                self._getRetiredAverages(sql_type, startstamp, stopstamp)
+        elif aggregate_interval and aggregate_type.lower() in _tier_reducers:
+            # Use a tier table for the aggregation intervals that have been
+            # rolled up, then carry on with the rest.
+            _tier = self._getTierSpans(['%s_%s' % (sql_type, _stat) for _stat in ('min', 'max', 'sum', 'count')],
+                                       startstamp, stopstamp, aggregate_interval)
+            if _tier is not None:
+                (_table, _spans, startstamp) = _tier
+                _reduce = _tier_reducers[aggregate_type.lower()]
+                sql_str = "SELECT dateTime, lastTime, usUnits, `%s_min`, `%s_max`, `%s_sum`, `%s_count` FROM %s "\
+                    "WHERE dateTime > ? AND dateTime <= ? ORDER BY dateTime ASC" % ((sql_type,) * 4 + (_table,))
+                for (_span, _rows) in _genSpanGroups(_spans, self.genSql(sql_str, (_spans[0].start, _spans[-1].stop))):
+                    for _rec in _rows:
+                        std_unit_system = _checkUnitSystem(std_unit_system, _rec[2])
+                    time_vec.append(max(_rec[1] for _rec in _rows))
+                    data_vec.append(_reduce(_rows))
+        if aggregate_type:
+            self._checkRetained(sql_type, startstamp, aggregate_type)
+
+        if self.vector_cache is not None:
+            _vectors = self._getCachedVectors(sql_type, startstamp, stopstamp, aggregate_interval, aggregate_type)
+            if _vectors is not None:
+                time_vec.extend(_vectors[0])
+                data_vec.extend(_vectors[1])
+                if _vectors[2] is not None:
+                    std_unit_system = _checkUnitSystem(std_unit_system, _vectors[2])
+                (time_type, time_group) = weewx.units.getStandardUnitType(std_unit_system, 'dateTime')
+                (data_type, data_group) = weewx.units.getStandardUnitType(std_unit_system, sql_type, aggregate_type)
+                return (ValueTuple(time_vec, time_type, time_group), ValueTuple(data_vec, data_type, data_group))
+
         _cursor=self.connection.cursor()
         try:
     
             if aggregate_type :
                 if not aggregate_interval:
                     raise weewx.ViolatedPrecondition("Aggregation interval missing")
-                sql_str = "SELECT MAX(dateTime), %s(%s), usUnits FROM %s "\
-                    "WHERE dateTime > ? AND dateTime <= ?" % (aggregate_type, sql_type, self.table)
-                for stamp in weeutil.weeutil.intervalgen(startstamp, stopstamp, aggregate_interval):
-                    _cursor.execute(sql_str, stamp)
-                    _rec = _cursor.fetchone()
-                    # Don't accumulate any results where there wasn't a record
-                    # (signified by a null result)
-                    if _rec:
-                        # Also, there may be records, but there may not be any
-                        # non-Null results.
-                        if _rec[0] is not None:
+                _reduce = _aggregate_reducers.get(aggregate_type.lower())
+                if _reduce is not None:
+                    # A common aggregate. Fetch the whole window in one ordered
+                    # scan, then reduce each aggregation interval in Python.
+                    for (_span, _rows) in self._genIntervalRows(sql_type, startstamp, stopstamp, aggregate_interval):
+                        for _rec in _rows:
                             if std_unit_system:
                                 if std_unit_system != _rec[2]:
                                     raise weewx.UnsupportedFeature("Unit type cannot change "\
                                                                    "within a time interval.")
                             else:
                                 std_unit_system = _rec[2]
-                            time_vec.append(_rec[0])
-                            data_vec.append(_rec[1])
+                        time_vec.append(_rows[-1][0])
+                        data_vec.append(_reduce([_rec[1] for _rec in _rows]))
+                else:
+                    # An aggregate we do not know how to do in Python. Let the
+                    # database do it, one aggregation interval at a time.
+                    sql_str = "SELECT MAX(dateTime), %s(%s), usUnits FROM %s "\
+                        "WHERE dateTime > ? AND dateTime <= ?" % (aggregate_type, sql_type, self.table)
+                    for stamp in weeutil.weeutil.intervalgen(startstamp, stopstamp, aggregate_interval):
+                        _cursor.execute(sql_str, stamp)
+                        _rec = _cursor.fetchone()
+                        # Don't accumulate any results where there wasn't a record
+                        # (signified by a null result)
+                        if _rec:
+                            # Also, there may be records, but there may not be any
+                            # non-Null results.
+                            if _rec[0] is not None:
+                                if std_unit_system:
+                                    if std_unit_system != _rec[2]:
+                                        raise weewx.UnsupportedFeature("Unit type cannot change "\
+                                                                       "within a time interval.")
+                                else:
+                                    std_unit_system = _rec[2]
+                                time_vec.append(_rec[0])
+                                data_vec.append(_rec[1])
             else:
-                sql_str = "SELECT dateTime, %s, usUnits FROM %s "\
-                            "WHERE dateTime >= ? AND dateTime <= ?" % (sql_type, self.table)
-                for _rec in _cursor.execute(sql_str, (startstamp, stopstamp)):
+                for _rec in self._genColumns(sql_type, startstamp, stopstamp, True):
                     time_vec.append(_rec[0])
                     data_vec.append(_rec[1])
                     if std_unit_system:
@@ -413,6 +902,47 @@ class Archive(object):
         (data_type, data_group) = weewx.units.getStandardUnitType(std_unit_system, sql_type, aggregate_type)
         return (ValueTuple(time_vec, time_type, time_group), ValueTuple(data_vec, data_type, data_group))
 
+    def _getCachedVectors(self, sql_type, startstamp, stopstamp, aggregate_interval, aggregate_type):
+        """Get the vectors for getSqlVectors() from the vector cache.
+        
+        The cached columns are sliced, rather than read row by row. Each
+        aggregation interval is found with a binary search on the time
+        column.
+        
+        returns: A 3-way tuple (time_vec, data_vec, std_unit_system), or None
+        if the vector cache cannot be used."""
+        if aggregate_type:
+            _reduce = _aggregate_reducers.get(aggregate_type.lower())
+            if not aggregate_interval or _reduce is None:
+                return None
+            spans = list(weeutil.weeutil.intervalgen(startstamp, stopstamp, aggregate_interval))
+            if not spans:
+                return ([], [], None)
+            _vectors = self.vector_cache.getVectors(self, sql_type, spans[0].start, spans[-1].stop)
+        else:
+            _vectors = self.vector_cache.getVectors(self, sql_type, startstamp, stopstamp, True)
+        if _vectors is None:
+            return None
+
+        (_times, _values, _units) = _vectors
+        _unit_systems = set(_units)
+        if len(_unit_systems) > 1:
+            raise weewx.UnsupportedFeature("Unit type cannot change within a time interval.")
+        std_unit_system = _unit_systems.pop() if _unit_systems else None
+        if not aggregate_type:
+            return (_times, _values, std_unit_system)
+
+        time_vec = list()
+        data_vec = list()
+        _istop = 0
+        for span in spans:
+            _istart = bisect.bisect_right(_times, span.start, _istop)
+            _istop  = bisect.bisect_right(_times, span.stop, _istart)
+            if _istop > _istart:
+                time_vec.append(_times[_istop - 1])
+                data_vec.append(_reduce(_values[_istart:_istop]))
+        return (time_vec, data_vec, std_unit_system)
+
     def getSqlVectorsExtended(self, ext_type, startstamp, stopstamp, 
                               aggregate_interval = None, 
                               aggregate_type = None):
@@ -469,128 +999,457 @@ class Archive(object):
         data_vec = list()
         std_unit_system = None
         
-        _cursor=self.connection.cursor()
-        try:
-    
-            # Is aggregation requested?
-            if aggregate_type:
-                if not aggregate_interval:
-                    raise weewx.ViolatedPrecondition, "Aggregation interval missing"
-                # Aggregation is requested.
-                # The aggregation should happen over the x- and y-components.
-                # Because they do not appear in the database (only the
-                # magnitude and direction do) we cannot do the aggregation
-                # in the SQL statement. We'll have to do it in Python.
-                # Do we know how to do it?
-                if aggregate_type not in ('sum', 'count', 'avg', 'max', 'min'):
-                    raise weewx.ViolatedPrecondition, "Aggregation type missing or unknown"
-                
-                # This SQL select string will select the proper wind types
-                sql_str = 'SELECT dateTime, %s, usUnits FROM %s WHERE dateTime > ? AND dateTime <= ?' % \
-                    (windvec_types[ext_type], self.table)
-                # Go through each aggregation interval, calculating the
-                # aggregation.
-                for stamp in weeutil.weeutil.intervalgen(startstamp, stopstamp, aggregate_interval):
-    
-                    _mag_extreme = _dir_at_extreme = None
-                    _xsum = _ysum = 0.0
-                    _count = 0
-                    _last_time = None
-    
-                    for _rec in _cursor.execute(sql_str, stamp):
-                        (_mag, _dir) = _rec[1:3]
-    
-                        if _mag is None:
-                            continue
-    
-                        # A good direction is necessary unless the mag is zero:
-                        if _mag == 0.0  or _dir is not None:
-                            _count += 1
-                            _last_time  = _rec[0]
-                            if std_unit_system:
-                                if std_unit_system != _rec[3]:
-                                    raise weewx.UnsupportedFeature("Unit type cannot change "\
-                                                                   "within a time interval.")
-                            else:
-                                std_unit_system = _rec[3]
-                            
-                            # Pick the kind of aggregation:
-                            if aggregate_type == 'min':
-                                if _mag_extreme is None or _mag < _mag_extreme:
-                                    _mag_extreme = _mag
-                                    _dir_at_extreme = _dir
-                            elif aggregate_type == 'max':
-                                if _mag_extreme is None or _mag > _mag_extreme:
-                                    _mag_extreme = _mag
-                                    _dir_at_extreme = _dir
-                            else:
-                                # No need to do the arithmetic if mag is zero.
-                                # We also need a good direction
-                                if _mag > 0.0 and _dir is not None:
-                                    _xsum += _mag * math.cos(math.radians(90.0 - _dir))
-                                    _ysum += _mag * math.sin(math.radians(90.0 - _dir))
-                    # We've gone through the whole interval. Were there any
-                    # good data?
-                    if _count:
-                        # Record the time of the last good data point:
-                        time_vec.append(_last_time)
-                        # Form the requested aggregation:
-                        if aggregate_type in ('min', 'max'):
-                            if _dir_at_extreme is None:
-                                # The only way direction can be zero with a
-                                # non-zero count is if all wind velocities
-                                # were zero
-                                if weewx.debug:
-                                    assert(_mag_extreme <= 1.0e-6)
-                                x_extreme = y_extreme = 0.0
-                            else:
-                                x_extreme = _mag_extreme * math.cos(math.radians(90.0 - _dir_at_extreme))
-                                y_extreme = _mag_extreme * math.sin(math.radians(90.0 - _dir_at_extreme))
-                            data_vec.append(complex(x_extreme, y_extreme))
-                        elif aggregate_type == 'sum':
-                            data_vec.append(complex(_xsum, _ysum))
-                        elif aggregate_type == 'count':
-                            data_vec.append(_count)
-                        else:
-                            # Must be 'avg'
-                            data_vec.append(complex(_xsum/_count, _ysum/_count))
-            else:
-                # No aggregation desired. It's a lot simpler. Go get the
-                # data in the requested time period
-                # This SQL select string will select the proper wind types
-                sql_str = 'SELECT dateTime, %s, usUnits FROM %s WHERE dateTime >= ? AND dateTime <= ?' % \
-                        (windvec_types[ext_type], self.table)
-                
-                for _rec in _cursor.execute(sql_str, (startstamp, stopstamp)):
-                    # Record the time:
-                    time_vec.append(_rec[0])
-                    if std_unit_system:
-                        if std_unit_system != _rec[3]:
-                            raise weewx.UnsupportedFeature("Unit type cannot change "\
-                                                           "within a time interval.")
-                    else:
-                        std_unit_system = _rec[3]
-                    # Break the mag and dir down into x- and y-components.
-                    (_mag, _dir) = _rec[1:3]
-                    if _mag is None or _dir is None:
-                        data_vec.append(None)
-                    else:
-                        x = _mag * math.cos(math.radians(90.0 - _dir))
-                        y = _mag * math.sin(math.radians(90.0 - _dir))
-                        if weewx.debug:
-                            # There seem to be some little rounding errors that
-                            # are driving my debugging crazy. Zero them out
-                            if abs(x) < 1.0e-6 : x = 0.0
-                            if abs(y) < 1.0e-6 : y = 0.0
-                        data_vec.append(complex(x,y))
-        finally:
-            _cursor.close()
+        # Is aggregation requested?
+        if aggregate_type:
+            if not aggregate_interval:
+                raise weewx.ViolatedPrecondition, "Aggregation interval missing"
+            # Aggregation is requested.
+            # The aggregation should happen over the x- and y-components.
+            # Because they do not appear in the database (only the
+            # magnitude and direction do) we cannot do the aggregation
+            # in the SQL statement. We'll have to do it in Python.
+            # Do we know how to do it?
+            if aggregate_type not in ('sum', 'count', 'avg', 'max', 'min'):
+                raise weewx.ViolatedPrecondition, "Aggregation type missing or unknown"
+            
+            # Use a tier table for the aggregation intervals that have been
+            # rolled up:
+            _tier = self._getTierSpans(['%s_%s' % (ext_type, _stat) for (_stat, _sql_type) in _tier_vec_columns],
+                                       startstamp, stopstamp, aggregate_interval)
+            if _tier is not None:
+                (_table, _spans, startstamp) = _tier
+                (time_vec, data_vec, std_unit_system) = self._getTierWindVecAggregates(ext_type, _table, _spans,
+                                                                                       aggregate_type)
+            self._checkRetained(ext_type, startstamp, aggregate_type)
+            
+            # Fetch the rest of the window in one scan, then reduce each
+            # aggregation interval.
+            (_time_vec, _data_vec, _std_unit_system) = self._getWindVecAggregates(windvec_types[ext_type],
+                                                                                  startstamp, stopstamp,
+                                                                                  aggregate_interval, aggregate_type)
+            time_vec.extend(_time_vec)
+            data_vec.extend(_data_vec)
+            if _std_unit_system is not None:
+                std_unit_system = _checkUnitSystem(std_unit_system, _std_unit_system)
+        else:
+            # No aggregation desired. It's a lot simpler. Records deleted by
+            # the retention policy are stood in for by the hourly averages.
+            # Then go get the data in the requested time period
+            (time_vec, data_vec, std_unit_system, startstamp) = \
+                self._getRetiredAverages(ext_type, startstamp, stopstamp)
+            for _rec in self._genColumns(windvec_types[ext_type], startstamp, stopstamp, True):
+                # Record the time:
+                time_vec.append(_rec[0])
+                if std_unit_system:
+                    if std_unit_system != _rec[3]:
+                        raise weewx.UnsupportedFeature("Unit type cannot change "\
+                                                       "within a time interval.")
+                else:
+                    std_unit_system = _rec[3]
+                # Break the mag and dir down into x- and y-components.
+                (_mag, _dir) = _rec[1:3]
+                if _mag is None or _dir is None:
+                    data_vec.append(None)
+                else:
+                    x = _mag * math.cos(math.radians(90.0 - _dir))
+                    y = _mag * math.sin(math.radians(90.0 - _dir))
+                    if weewx.debug:
+                        # There seem to be some little rounding errors that
+                        # are driving my debugging crazy. Zero them out
+                        if abs(x) < 1.0e-6 : x = 0.0
+                        if abs(y) < 1.0e-6 : y = 0.0
+                    data_vec.append(complex(x,y))
 
         (time_type, time_group) = weewx.units.getStandardUnitType(std_unit_system, 'dateTime')
         (data_type, data_group) = weewx.units.getStandardUnitType(std_unit_system, ext_type, aggregate_type)
         return (weewx.units.ValueTuple(time_vec, time_type, time_group),
                 weewx.units.ValueTuple(data_vec, data_type, data_group))
 
+    def _genIntervalRows(self, sql_columns, startstamp, stopstamp, aggregate_interval):
+        """Generator function that groups the rows of a single ordered scan
+        into aggregation intervals.
+        
+        The intervals are those generated by weeutil.weeutil.intervalgen, so
+        they fall on the same local time boundaries, even across DST changes.
+        
+        sql_columns: A string with the SQL columns to be retrieved, separated
+        by commas (e.g., 'windSpeed, windDir').
+        
+        startstamp: The start of the first interval (exclusive).
+        
+        stopstamp: The end of the last interval (inclusive).
+        
+        aggregate_interval: The length of an aggregation interval in seconds.
+        
+        yields: A 2-way tuple (timespan, rows) for each interval that holds at
+        least one record. The rows are in time order and look like
+        (dateTime, <sql_columns>, usUnits)."""
+        
+        spans = list(weeutil.weeutil.intervalgen(startstamp, stopstamp, aggregate_interval))
+        if not spans:
+            return
+        for _group in _genSpanGroups(spans, self._genColumns(sql_columns, spans[0].start, spans[-1].stop)):
+            yield _group
+
+    def _getWindVecAggregates(self, sql_columns, startstamp, stopstamp, aggregate_interval, aggregate_type):
+        """Calculate the aggregates of a wind vector type.
+        
+        The magnitudes and directions of the whole time window are loaded
+        into flat arrays, then each aggregation interval is reduced in bulk.
+        
+        sql_columns: The SQL columns holding the magnitude and direction
+        (e.g., 'windSpeed, windDir').
+        
+        aggregate_type: One of 'sum', 'count', 'avg', 'max', or 'min'.
+        
+        returns: a 3-way tuple (time_vec, data_vec, std_unit_system)"""
+        
+        time_vec = list()
+        mag_vec  = list()
+        dir_vec  = list()
+        # Holds (start, stop) indices into mag_vec and dir_vec for each
+        # aggregation interval:
+        bounds   = list()
+        std_unit_system = None
+        
+        for (_span, _rows) in self._genIntervalRows(sql_columns, startstamp, stopstamp, aggregate_interval):
+            _istart = len(mag_vec)
+            for (_time, _mag, _dir, _units) in _rows:
+                # A good direction is necessary unless the mag is zero:
+                if _mag is not None and (_mag == 0.0 or _dir is not None):
+                    if std_unit_system:
+                        if std_unit_system != _units:
+                            raise weewx.UnsupportedFeature("Unit type cannot change "\
+                                                           "within a time interval.")
+                    else:
+                        std_unit_system = _units
+                    _last_time = _time
+                    mag_vec.append(_mag)
+                    dir_vec.append(_dir)
+            # Were there any good data? If so, record the time of the last
+            # good data point.
+            if len(mag_vec) > _istart:
+                time_vec.append(_last_time)
+                bounds.append((_istart, len(mag_vec)))
+
+        if aggregate_type == 'count':
+            data_vec = [_istop - _istart for (_istart, _istop) in bounds]
+        elif numpy is not None and aggregate_type in ('min', 'max'):
+            data_vec = _reduce_windvec_numpy(mag_vec, dir_vec, bounds, aggregate_type)
+        else:
+            data_vec = _reduce_windvec(mag_vec, dir_vec, bounds, aggregate_type)
+
+        return (time_vec, data_vec, std_unit_system)
+
+    def rollUp(self, retention_days=None):
+        """Roll archive records up into the tier tables, then apply a
+        retention policy.
+        
+        There is a tier table for each of rollup_tiers. Each row of one holds
+        the statistics of an hour, or a day, of local time, as kept by
+        weewx.accum.TierAccum: the min, max, sum, and count of each type, and
+        the sums and extremes of the wind vectors. getSqlVectors() and
+        getSqlVectorsExtended() read them, rather than the archive records,
+        for aggregation intervals that line up with their hours or days.
+        
+        Only the complete hours and days after the last one already rolled up
+        are added, so this is cheap to call after every new record. The tier
+        tables are created if they do not exist.
+        
+        retention_days: If given, archive records more than this many days
+        older than the last record are deleted, once they have been rolled up
+        into every tier. [Optional. Default is to keep all records]"""
+        
+        _last_ts = self.lastGoodStamp()
+        if _last_ts is None:
+            return
+        _rolled_to = [self._rollUpTier(_table, _length, _columns, _last_ts)
+                      for (_table, _length, _columns) in self._getTiers(create=True)]
+        if retention_days and None not in _rolled_to:
+            self._deleteRecords(min([_last_ts - int(retention_days) * 86400] + _rolled_to))
+
+    def _getTiers(self, create=False):
+        """Return the tier tables as a list of 3-way tuples (table name,
+        bucket length, list of columns), from the finest to the coarsest.
+        
+        create: True to create the tables that do not exist."""
+        if self._tiers is None or (create and len(self._tiers) < len(rollup_tiers)):
+            _tables = self.connection.tables()
+            self._tiers = []
+            for (_suffix, _length) in rollup_tiers:
+                _table = '%s_%s' % (self.table, _suffix)
+                if _table not in _tables:
+                    if not create:
+                        continue
+                    self._createTier(_table)
+                self._tiers.append((_table, _length, self.connection.columnsOf(_table)))
+        return self._tiers
+
+    def _createTier(self, table):
+        """Create a tier table, with columns for the types of this archive."""
+        _schema = [('dateTime', 'INTEGER NOT NULL UNIQUE PRIMARY KEY'),
+                   ('usUnits',  'INTEGER NOT NULL'),
+                   ('lastTime', 'INTEGER NOT NULL')]
+        for _obs_type in self.sqlkeys:
+            if _obs_type not in ('dateTime', 'usUnits', 'interval'):
+                _schema += [('%s_min' % _obs_type, 'REAL'), ('%s_max'   % _obs_type, 'REAL'),
+                            ('%s_sum' % _obs_type, 'REAL'), ('%s_count' % _obs_type, 'INTEGER')]
+        for (_vec_type, (_mag_type, _dir_type)) in sorted(weewx.accum.TierAccum.windvec_types.iteritems()):
+            if _mag_type in self.sqlkeys and _dir_type in self.sqlkeys:
+                _schema += [('%s_%s' % (_vec_type, _stat), _sql_type) for (_stat, _sql_type) in _tier_vec_columns]
+        _sqltypestr = ', '.join(["`%s` %s" % _type for _type in _schema])
+        with weedb.Transaction(self.connection) as _cursor:
+            _cursor.execute("CREATE TABLE %s (%s);" % (table, _sqltypestr))
+        syslog.syslog(syslog.LOG_NOTICE, "archive: Created tier table '%s' in database '%s'" % 
+                      (table, os.path.basename(self.connection.database)))
+
+    def _rollUpTier(self, table, length, columns, last_ts):
+        """Roll the complete buckets of records after the last one in a tier
+        table up into it.
+        
+        returns: The timestamp of the last bucket in the table, or None if it
+        is empty."""
+        _row = self.getSql("SELECT MAX(dateTime) FROM %s" % table)
+        _rolled_to = _row[0] if _row else None
+        if _rolled_to is None:
+            _first_ts = self.firstGoodStamp()
+        else:
+            _row = self.getSql("SELECT MIN(dateTime) FROM %s WHERE dateTime > ?" % self.table, (_rolled_to,))
+            _first_ts = _row[0] if _row else None
+        if _first_ts is None:
+            return _rolled_to
+        # Only the buckets that are complete:
+        spans = [span for span in weeutil.weeutil.intervalgen(_startOfTierBucket(_first_ts, length), last_ts, length)
+                 if _isTierBoundary(span.stop, length)]
+        if not spans:
+            return _rolled_to
+
+        _ts_index = self.sqlkeys.index('dateTime')
+        _layout = RecordLayout(self.sqlkeys)
+        _gen = ((_row[_ts_index], _row) for _row in self.genBatchRows(spans[0].start, spans[-1].stop))
+        _records = []
+        try:
+            for (_span, _rows) in _genSpanGroups(spans, _gen):
+                _accum = weewx.accum.TierAccum(_span)
+                for (_ts, _row) in _rows:
+                    _accum.addRecord(RecordView(_layout, _row))
+                _records.append(_accum.getRecord())
+        except ValueError, e:
+            # Most likely, the unit system changed within a bucket.
+            syslog.syslog(syslog.LOG_ERR, "archive: Unable to roll up records into table '%s': %s" % (table, e))
+            return _rolled_to
+        if not _records:
+            return _rolled_to
+
+        sql_insert_stmt = "INSERT INTO %s (%s) VALUES (%s)" % \
+            (table, ', '.join(['`%s`' % _column for _column in columns]), ', '.join('?' * len(columns)))
+        with weedb.Transaction(self.connection) as _cursor:
+            for _record in _records:
+                _cursor.execute(sql_insert_stmt, [_record.get(_column) for _column in columns])
+        syslog.syslog(syslog.LOG_DEBUG, "archive: Rolled %d buckets up into table '%s'" % (len(_records), table))
+        return _records[-1]['dateTime']
+
+    def _deleteRecords(self, cutoff_ts):
+        """Delete the records at or before a time, once they have been rolled
+        up into the tier tables."""
+        _row = self.getSql("SELECT COUNT(*) FROM %s WHERE dateTime <= ?" % self.table, (cutoff_ts,))
+        if not _row or not _row[0]:
+            return
+        with weedb.Transaction(self.connection) as _cursor:
+            _cursor.execute("DELETE FROM %s WHERE dateTime <= ?" % self.table, (cutoff_ts,))
+        _countWrite(self._write_key)
+        self._bounds = None
+        _recent = _recent_records.get(self._write_key)
+        if _recent is not None and _recent.covered_from <= cutoff_ts:
+            _recent.load(self)
+        syslog.syslog(syslog.LOG_INFO, "archive: Deleted %d records up to %s. They are kept in the tier tables." %
+                      (_row[0], weeutil.weeutil.timestamp_to_string(cutoff_ts)))
+
+    def _getRetiredAverages(self, obs_type, startstamp, stopstamp):
+        """Get the hourly averages of a type from the finest tier table, for
+        the part of a time span before the first archive record, if older
+        records have been deleted. For the wind vector types, the averages are
+        the average vectors, as complex numbers.
+        
+        returns: A 4-way tuple (time_vec, data_vec, std_unit_system,
+        startstamp). The time vector holds the time of the last record of
+        each hour. The archive records take over at startstamp."""
+        _retained_ts = self.retainedFrom()
+        if _retained_ts is None or startstamp >= _retained_ts:
+            return ([], [], None, startstamp)
+        (_table, _length, _columns) = self._getTiers()[0]
+        if obs_type in weewx.accum.TierAccum.windvec_types:
+            _stats = ('xsum', 'ysum', 'count')
+        else:
+            _stats = ('sum', 'count')
+        _stat_columns = ['%s_%s' % (obs_type, _stat) for _stat in _stats]
+        if not all(_column in _columns for _column in _stat_columns):
+            return ([], [], None, max(startstamp, _retained_ts))
+        time_vec = list()
+        data_vec = list()
+        std_unit_system = None
+        sql_str = "SELECT lastTime, usUnits, %s FROM %s WHERE lastTime >= ? AND lastTime <= ? AND lastTime < ? "\
+            "ORDER BY dateTime ASC" % (', '.join(['`%s`' % _column for _column in _stat_columns]), _table)
+        for _rec in self.genSql(sql_str, (startstamp, stopstamp, _retained_ts)):
+            std_unit_system = _checkUnitSystem(std_unit_system, _rec[1])
+            time_vec.append(_rec[0])
+            _count = _rec[-1]
+            if not _count:
+                data_vec.append(None)
+            elif len(_stats) == 3:
+                data_vec.append(complex(_rec[2] / _count, _rec[3] / _count))
+            else:
+                data_vec.append(_rec[2] / _count)
+        return (time_vec, data_vec, std_unit_system, max(startstamp, _retained_ts))
+
+    def _checkRetained(self, obs_type, startstamp, aggregate_type):
+        """Log, once, a read of aggregates that starts before the first
+        archive record, if older records have been deleted. The part of the
+        read that could not be served from the tier tables is missing."""
+        _retained_ts = self.retainedFrom()
+        if _retained_ts is None or startstamp >= _retained_ts or (obs_type, aggregate_type) in self._logged_reads:
+            return
+        self._logged_reads.add((obs_type, aggregate_type))
+        syslog.syslog(syslog.LOG_ERR, "archive: Aggregate '%s' of '%s' is missing before %s. The records have been "
+                      "deleted, and it cannot be calculated from the tier tables" %
+                      (aggregate_type, obs_type, weeutil.weeutil.timestamp_to_string(_retained_ts)))
+
+    def _getTierSpans(self, columns, startstamp, stopstamp, aggregate_interval):
+        """Find the coarsest tier table that can be used for aggregation.
+        
+        A tier can be used if it has all the given columns, and the start and
+        end of every aggregation interval fall on the boundaries of its
+        buckets.
+        
+        returns: A 3-way tuple (table, spans, tail_start), where spans are
+        the aggregation intervals that have been completely rolled up. The
+        rest, starting at tail_start, must come from the archive. Or None if
+        no tier can be used."""
+        _tiers = self._getTiers()
+        if not _tiers:
+            return None
+        spans = list(weeutil.weeutil.intervalgen(startstamp, stopstamp, aggregate_interval))
+        if not spans:
+            return None
+        _boundaries = set([span.start for span in spans] + [span.stop for span in spans])
+        for (_table, _length, _columns) in reversed(_tiers):
+            if _length <= aggregate_interval and all(_column in _columns for _column in columns) \
+                    and all(_isTierBoundary(_ts, _length) for _ts in _boundaries):
+                break
+        else:
+            return None
+        _row = self.getSql("SELECT MAX(dateTime) FROM %s" % _table)
+        if not _row or _row[0] is None:
+            return None
+        _ndone = bisect.bisect_right([span.stop for span in spans], _row[0])
+        if not _ndone:
+            return None
+        return (_table, spans[:_ndone], spans[_ndone].start if _ndone < len(spans) else stopstamp)
+
+    def _getTierWindVecAggregates(self, ext_type, table, spans, aggregate_type):
+        """Calculate the aggregates of a wind vector type from a tier table.
+        
+        returns: a 3-way tuple (time_vec, data_vec, std_unit_system)"""
+        time_vec = list()
+        data_vec = list()
+        std_unit_system = None
+        # The rows look like (dateTime, usUnits, xsum, ysum, count, min,
+        # mindir, max, maxdir, lasttime):
+        sql_str = "SELECT dateTime, usUnits, %s FROM %s WHERE dateTime > ? AND dateTime <= ? ORDER BY dateTime ASC" % \
+            (', '.join(['`%s_%s`' % (ext_type, _stat) for (_stat, _sql_type) in _tier_vec_columns]), table)
+        for (_span, _rows) in _genSpanGroups(spans, self.genSql(sql_str, (spans[0].start, spans[-1].stop))):
+            _good = [_rec for _rec in _rows if _rec[4]]
+            if not _good:
+                continue
+            for _rec in _good:
+                std_unit_system = _checkUnitSystem(std_unit_system, _rec[1])
+            time_vec.append(max(_rec[9] for _rec in _good))
+            _count = sum(_rec[4] for _rec in _good)
+            if aggregate_type == 'count':
+                data_vec.append(_count)
+            elif aggregate_type in ('sum', 'avg'):
+                _xsum = sum(_rec[2] for _rec in _good)
+                _ysum = sum(_rec[3] for _rec in _good)
+                if aggregate_type == 'sum':
+                    data_vec.append(complex(_xsum, _ysum))
+                else:
+                    data_vec.append(complex(_xsum / _count, _ysum / _count))
+            else:
+                # Both min() and max() return the first extreme value, if
+                # there is more than one.
+                if aggregate_type == 'min':
+                    (_mag, _dir) = min(_good, key=operator.itemgetter(5))[5:7]
+                else:
+                    (_mag, _dir) = max(_good, key=operator.itemgetter(7))[7:9]
+                data_vec.append(complex(0.0, 0.0) if _dir is None else _windvec_component(_mag, _dir))
+        return (time_vec, data_vec, std_unit_system)
+
+    def createIndexes(self, obs_types):
+        """Create covering indexes for observation types that are plotted
+        often, as well as an index on the unit system.
+        
+        The only index on an archive table is its primary key, dateTime, so a
+        scan of one type over a time range reads whole records. A scan that
+        reads only the columns of an index on (dateTime, <type>) reads the
+        index instead, which is much smaller. That scan cannot read usUnits,
+        so the index on (usUnits, dateTime) lets _getUnitSystem() tell
+        whether the unit system is the same over the whole time range.
+        
+        obs_types: An iterable of the observation types to index. The special
+        types 'windvec' and 'windgustvec' index the magnitude and direction
+        together.
+        
+        returns: A list of the names of the indexes created. Indexes that
+        already exist are left alone."""
+        _existing = set(_index[0] for _index in self.connection.indexesOf(self.table))
+        _new = [('usUnits', ('usUnits', 'dateTime'))]
+        for _obs_type in obs_types:
+            _columns = _index_columns.get(_obs_type, (_obs_type,))
+            for _column in _columns:
+                if _column not in self.sqlkeys or _column in ('dateTime', 'usUnits'):
+                    raise weewx.ViolatedPrecondition("Cannot index type %s" % _obs_type)
+            _new.append((_obs_type, ('dateTime',) + _columns))
+        _created = []
+        for (_name, _columns) in _new:
+            _index_name = '%s_idx_%s' % (self.table, _name)
+            if _index_name in _existing:
+                continue
+            self.connection.execute("CREATE INDEX %s ON %s (%s)" %
+                                    (_index_name, self.table, ', '.join(['`%s`' % _col for _col in _columns])))
+            syslog.syslog(syslog.LOG_INFO, "archive: Created index %s on %s" % (_index_name, ', '.join(_columns)))
+            _existing.add(_index_name)
+            _created.append(_index_name)
+        self._indexes = None
+        return _created
+
+    def dropIndexes(self):
+        """Drop all the indexes created by createIndexes().
+        
+        returns: A list of the names of the indexes dropped."""
+        _dropped = []
+        for (_index_name, _columns) in self.connection.indexesOf(self.table):
+            if not _index_name.startswith('%s_idx_' % self.table):
+                continue
+            if self.connection.dbtype == 'mysql':
+                self.connection.execute("DROP INDEX %s ON %s" % (_index_name, self.table))
+            else:
+                self.connection.execute("DROP INDEX %s" % _index_name)
+            syslog.syslog(syslog.LOG_INFO, "archive: Dropped index %s" % _index_name)
+            _dropped.append(_index_name)
+        self._indexes = None
+        return _dropped
+
+    def _getIndexes(self):
+        """Return the indexes on the table that queries can plan around, as a
+        2-way tuple. The first member is a list holding a set of the columns
+        of each index that leads with dateTime. The second is True if there is
+        an index that leads with usUnits."""
+        if self._indexes is None:
+            _indexes = self.connection.indexesOf(self.table)
+            self._indexes = ([set(_columns) for (_name, _columns) in _indexes if _columns[0] == 'dateTime'],
+                             any(_columns[0] == 'usUnits' for (_name, _columns) in _indexes))
+        return self._indexes
+
     @staticmethod
     def _create_table(archive_db_dict, archiveSchema, table):
         """Create a SQL table using a given archive schema.
@@ -642,6 +1501,409 @@ class Archive(object):
         column_list = self.connection.columnsOf(self.table)
         return column_list
 
+#==============================================================================
+#                       Counting writes to archives
+#==============================================================================
+
+# The number of times records have been added to each archive by this
+# process. Key is a 2-way tuple (database, table). These let an Archive object
+# find out if another one has written to the same archive.
+_write_counts = {}
+# The number of those writes that did more than add records after the last
+# one. See Archive.getUnorderedCount():
+_unordered_counts = {}
+_write_counts_lock = threading.Lock()
+
+def _countWrite(write_key, ordered=False):
+    """Count a write to an archive. ordered is True if it only added records
+    after the last one."""
+    with _write_counts_lock:
+        _write_counts[write_key] = _write_counts.get(write_key, 0) + 1
+        if not ordered:
+            _unordered_counts[write_key] = _unordered_counts.get(write_key, 0) + 1
+
+#==============================================================================
+#                       class RecentRecords
+#==============================================================================
+
+# The caches of recent records, keyed the same way as _write_counts. See
+# Archive.cacheRecentRecords().
+_recent_records = {}
+_recent_records_lock = threading.Lock()
+
+class RecentRecords(object):
+    """The most recent rows of an archive, held in memory in time order.
+    
+    The rows cover every record in the archive from covered_from on, as long
+    as all records are added by this process. They are refreshed from the
+    database after each write, so they hold exactly what a query would
+    return."""
+
+    def __init__(self, keys, max_size):
+        self.keys     = list(keys)
+        self.max_size = int(max_size)
+        self.times    = []
+        self.rows     = []
+        # Timestamp from which all records are held. Before any records have
+        # been seen, the cache covers nothing:
+        self.covered_from = None
+        self._lock    = threading.Lock()
+        self._ts_index = self.keys.index('dateTime')
+
+    def load(self, archive):
+        """Fill the cache with the newest max_size records of an archive."""
+        _rows = list(archive.genSql("SELECT * FROM %s ORDER BY dateTime DESC LIMIT %d" %
+                                    (archive.table, self.max_size)))
+        _rows.reverse()
+        with self._lock:
+            self.rows  = _rows
+            self.times = [_row[self._ts_index] for _row in _rows]
+            if len(_rows) < self.max_size:
+                # This is the whole archive.
+                self.covered_from = float('-inf')
+            else:
+                self.covered_from = self.times[0]
+
+    def update(self, archive, first_ts):
+        """Bring in the records with timestamps from first_ts on, which have
+        just been written to the archive."""
+        if self.covered_from is None or first_ts < self.covered_from:
+            # Records went in before the start of the cache. Start over.
+            self.load(archive)
+            return
+        _new_rows = list(archive.genSql("SELECT * FROM %s WHERE dateTime >= ? ORDER BY dateTime ASC" %
+                                        (archive.table,), (first_ts,)))
+        with self._lock:
+            _i = bisect.bisect_left(self.times, first_ts)
+            del self.times[_i:]
+            del self.rows[_i:]
+            self.rows.extend(_new_rows)
+            self.times.extend(_row[self._ts_index] for _row in _new_rows)
+            _excess = len(self.rows) - self.max_size
+            if _excess > 0:
+                del self.times[:_excess]
+                del self.rows[:_excess]
+                self.covered_from = self.times[0]
+
+    def getRows(self, startstamp, stopstamp, include_start=False):
+        """Return the rows with timestamps in an interval, or None if the
+        cache does not cover the whole interval.
+        
+        startstamp: Exclusive start of the interval, unless include_start is
+        True."""
+        with self._lock:
+            if self.covered_from is None or startstamp < self.covered_from:
+                return None
+            if include_start:
+                _i = bisect.bisect_left(self.times, startstamp)
+            else:
+                _i = bisect.bisect_right(self.times, startstamp)
+            return self.rows[_i:bisect.bisect_right(self.times, stopstamp)]
+
+def _nearestRow(rows, ts_index, timestamp):
+    """Return the row in a list of rows in time order that is closest to
+    timestamp, or None if the list is empty. A tie goes to the earlier row,
+    as with Archive._getNearestRow()."""
+    _best = None
+    for _row in rows:
+        if _best is None or abs(_row[ts_index] - timestamp) < abs(_best[ts_index] - timestamp):
+            _best = _row
+    return _best
+
+#==============================================================================
+#                       classes RecordLayout and RecordView
+#==============================================================================
+
+class RecordLayout(object):
+    """The column layout of a set of rows. It is shared by all the
+    RecordViews of those rows."""
+    
+    __slots__ = ('keys', 'index', 'key_set')
+    
+    def __init__(self, keys):
+        self.keys    = tuple(keys)
+        self.index   = dict((k, i) for (i, k) in enumerate(self.keys))
+        self.key_set = frozenset(self.keys)
+
+class RecordView(object):
+    """A read-only, dictionary-like view of a database row.
+    
+    Keyed access looks up the column in the shared layout, so no dictionary
+    is built for each row. It supports enough of the dictionary interface
+    (keys, iteration, membership, get, items) to be used anywhere a data
+    record is only read.
+    
+    Example:
+    >>> layout = RecordLayout(['dateTime', 'usUnits', 'outTemp'])
+    >>> rec = RecordView(layout, (194758100, 1, 68.0))
+    >>> print rec['outTemp'], rec.get('barometer'), 'usUnits' in rec
+    68.0 None True
+    >>> print sorted(dict(rec).items())
+    [('dateTime', 194758100), ('outTemp', 68.0), ('usUnits', 1)]
+    """
+    
+    __slots__ = ('layout', 'row')
+    
+    def __init__(self, layout, row):
+        self.layout = layout
+        self.row    = row
+        
+    def __getitem__(self, key):
+        return self.row[self.layout.index[key]]
+    
+    def get(self, key, default=None):
+        try:
+            return self.row[self.layout.index[key]]
+        except KeyError:
+            return default
+    
+    def __contains__(self, key):
+        return key in self.layout.index
+    
+    has_key = __contains__
+    
+    def __iter__(self):
+        return iter(self.layout.keys)
+    
+    def __len__(self):
+        return len(self.layout.keys)
+    
+    def keys(self):
+        return list(self.layout.keys)
+    
+    def values(self):
+        return list(self.row)
+    
+    def items(self):
+        return zip(self.layout.keys, self.row)
+    
+    def iteritems(self):
+        return itertools.izip(self.layout.keys, self.row)
+    
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+#==============================================================================
+#                       Covering indexes
+#==============================================================================
+
+# The columns indexed together for the special types that can be given to
+# Archive.createIndexes(). Any other type is indexed by itself.
+_index_columns = {'windvec'     : ('windSpeed', 'windDir'),
+                  'windgustvec' : ('windGust', 'windGustDir')}
+
+#==============================================================================
+#                       Tier tables
+#==============================================================================
+
+# The tier tables that archive records are rolled up into, from the finest to
+# the coarsest. Each is a 2-way tuple (suffix of the table name, length of a
+# bucket in seconds). See Archive.rollUp().
+rollup_tiers = (('hourly', 3600), ('daily', 86400))
+
+# The statistics kept in a tier table for each wind vector type, and their SQL
+# types. See weewx.accum.TierAccum.
+_tier_vec_columns = (('xsum', 'REAL'), ('ysum', 'REAL'), ('count', 'INTEGER'),
+                     ('min', 'REAL'), ('mindir', 'REAL'), ('max', 'REAL'), ('maxdir', 'REAL'),
+                     ('lasttime', 'INTEGER'))
+
+def _startOfTierBucket(time_ts, length):
+    """Return the start of the tier bucket that holds a record with a given
+    timestamp. A bucket is an hour, or a day, of local time."""
+    if length == 86400:
+        return weeutil.weeutil.archiveDaySpan(time_ts).start
+    return weeutil.weeutil.startOfInterval(time_ts, length)
+
+def _isTierBoundary(time_ts, length):
+    """Return True if a timestamp is on the boundary between two tier
+    buckets."""
+    if length == 86400:
+        return weeutil.weeutil.startOfDay(time_ts) == time_ts
+    return weeutil.weeutil.startOfInterval(time_ts, length, grace=0) == time_ts
+
+def _checkUnitSystem(std_unit_system, unit_system):
+    """Return the unit system of a time interval, given the one found so far
+    (or None), and that of one more row."""
+    if std_unit_system is not None and unit_system != std_unit_system:
+        raise weewx.UnsupportedFeature("Unit type cannot change within a time interval.")
+    return unit_system
+
+# Aggregates calculated from the rows of a tier table. Each row looks like
+# (dateTime, lastTime, usUnits, min, max, sum, count). They give the same
+# results as the aggregates of the archive records below, except for
+# rounding.
+
+def _tier_sum(rows):
+    _good = [_rec[5] for _rec in rows if _rec[6]]
+    return sum(_good) if _good else None
+
+def _tier_count(rows):
+    return sum(_rec[6] for _rec in rows)
+
+def _tier_avg(rows):
+    _count = _tier_count(rows)
+    return float(sum(_rec[5] for _rec in rows if _rec[6])) / _count if _count else None
+
+def _tier_min(rows):
+    _good = [_rec[3] for _rec in rows if _rec[3] is not None]
+    return min(_good) if _good else None
+
+def _tier_max(rows):
+    _good = [_rec[4] for _rec in rows if _rec[4] is not None]
+    return max(_good) if _good else None
+
+_tier_reducers = {'sum'   : _tier_sum,
+                  'count' : _tier_count,
+                  'avg'   : _tier_avg,
+                  'min'   : _tier_min,
+                  'max'   : _tier_max}
+
+#==============================================================================
+#                   Grouping rows into aggregation intervals
+#==============================================================================
+
+def _genSpanGroups(spans, rows):
+    """Generator function that groups rows into time spans.
+    
+    spans: A list of TimeSpans, in time order, such as those from
+    weeutil.weeutil.intervalgen.
+    
+    rows: An iterable of rows in time order, none of them after the end of
+    the last span. The first element of each row must be its timestamp.
+    
+    yields: A 2-way tuple (timespan, rows) for each span that holds at least
+    one row."""
+    stops = [span.stop for span in spans]
+    _ispan = 0
+    _rows = []
+    for _rec in rows:
+        # The rows come in time order, so the interval that includes this
+        # timestamp can only be the current one, or a later one.
+        if _rec[0] > stops[_ispan]:
+            if _rows:
+                yield (spans[_ispan], _rows)
+                _rows = []
+            _ispan = bisect.bisect_left(stops, _rec[0], _ispan)
+        # Because intervalgen can skip an interval around a DST change,
+        # the timestamp may fall between two intervals.
+        if _rec[0] > spans[_ispan].start:
+            _rows.append(_rec)
+    if _rows:
+        yield (spans[_ispan], _rows)
+
+#==============================================================================
+#                   Aggregates that can be calculated in Python
+#==============================================================================
+
+# These follow the SQL semantics: null values are ignored, and the result is
+# null (None) if there are no non-null values, except for 'count', which is
+# zero.
+
+def _agg_sum(vals):
+    _good = [v for v in vals if v is not None]
+    return sum(_good) if _good else None
+
+def _agg_count(vals):
+    return len([v for v in vals if v is not None])
+
+def _agg_avg(vals):
+    _good = [v for v in vals if v is not None]
+    return float(sum(_good)) / len(_good) if _good else None
+
+def _agg_min(vals):
+    _good = [v for v in vals if v is not None]
+    return min(_good) if _good else None
+
+def _agg_max(vals):
+    _good = [v for v in vals if v is not None]
+    return max(_good) if _good else None
+
+_aggregate_reducers = {'sum'   : _agg_sum,
+                       'count' : _agg_count,
+                       'avg'   : _agg_avg,
+                       'min'   : _agg_min,
+                       'max'   : _agg_max}
+
+#==============================================================================
+#                        Wind vector aggregation
+#==============================================================================
+
+# In what follows, mag_vec and dir_vec hold the magnitudes and directions of
+# the good wind data in a time window. The list bounds holds a tuple (start,
+# stop) of indices into them for each aggregation interval. The intervals
+# follow one another, and none is empty. The direction can be None only if the
+# magnitude is zero.
+
+def _windvec_component(mag, direction):
+    """Break a wind magnitude and direction down into a complex number."""
+    return complex(mag * math.cos(math.radians(90.0 - direction)),
+                   mag * math.sin(math.radians(90.0 - direction)))
+
+def _reduce_windvec(mag_vec, dir_vec, bounds, aggregate_type):
+    """Aggregate wind vectors using pure Python."""
+    data_vec = list()
+    if aggregate_type in ('min', 'max'):
+        _pick = min if aggregate_type == 'min' else max
+        for (_istart, _istop) in bounds:
+            # Both min() and max() return the first extreme value, if there is
+            # more than one.
+            _i = _pick(xrange(_istart, _istop), key=mag_vec.__getitem__)
+            if dir_vec[_i] is None:
+                # The only way direction can be zero with a non-zero count is if
+                # all wind velocities were zero
+                if weewx.debug:
+                    assert(mag_vec[_i] <= 1.0e-6)
+                data_vec.append(complex(0.0, 0.0))
+            else:
+                data_vec.append(_windvec_component(mag_vec[_i], dir_vec[_i]))
+    else:
+        # Calculate the x- and y-components once, for the whole window. No need
+        # to do the arithmetic if mag is zero.
+        x_vec = [_mag * math.cos(math.radians(90.0 - _dir)) if _mag > 0.0 else 0.0
+                 for (_mag, _dir) in zip(mag_vec, dir_vec)]
+        y_vec = [_mag * math.sin(math.radians(90.0 - _dir)) if _mag > 0.0 else 0.0
+                 for (_mag, _dir) in zip(mag_vec, dir_vec)]
+        for (_istart, _istop) in bounds:
+            _xsum = 0.0
+            _ysum = 0.0
+            for _i in xrange(_istart, _istop):
+                _xsum += x_vec[_i]
+                _ysum += y_vec[_i]
+            if aggregate_type == 'sum':
+                data_vec.append(complex(_xsum, _ysum))
+            else:
+                # Must be 'avg'
+                _count = _istop - _istart
+                data_vec.append(complex(_xsum / _count, _ysum / _count))
+    return data_vec
+
+def _reduce_windvec_numpy(mag_vec, dir_vec, bounds, aggregate_type):
+    """Find the minimum or maximum wind vectors using NumPy. Sums and
+    averages are left to _reduce_windvec(), because NumPy would round and add
+    the components differently."""
+    if not bounds:
+        return list()
+    _mag = numpy.array(mag_vec, dtype=float)
+    _starts = numpy.array([_istart for (_istart, _istop) in bounds])
+    _counts = numpy.array([_istop - _istart for (_istart, _istop) in bounds])
+
+    _ufunc = numpy.minimum if aggregate_type == 'min' else numpy.maximum
+    _extremes = _ufunc.reduceat(_mag, _starts)
+    # Find the index of the first occurrence of the extreme value within
+    # each interval:
+    _interval_of = numpy.repeat(numpy.arange(len(bounds)), _counts)
+    _hits = numpy.flatnonzero(_mag == _extremes[_interval_of])
+    _first = numpy.unique(_interval_of[_hits], return_index=True)[1]
+    data_vec = list()
+    for _i in _hits[_first]:
+        if dir_vec[_i] is None:
+            if weewx.debug:
+                assert(mag_vec[_i] <= 1.0e-6)
+            data_vec.append(complex(0.0, 0.0))
+        else:
+            data_vec.append(_windvec_component(mag_vec[_i], dir_vec[_i]))
+    return data_vec
+
 def reconfig(old_db_dict, new_db_dict, new_unit_system=None,
              new_schema=user.schemas.defaultArchiveSchema):
     """Copy over an old archive to a new one, using a provided schema."""
@@ -650,7 +1912,7 @@ def reconfig(old_db_dict, new_db_dict, new_unit_system=None,
         with Archive.open_with_create(new_db_dict, new_schema) as new_archive:
 
             # Wrap the input generator in a unit converter.
-            record_generator = weewx.units.GenWithConvert(old_archive.genBatchRecords(), new_unit_system)
+            record_generator = weewx.units.GenWithConvert(old_archive.genBatchViews(), new_unit_system)
         
             # This is very fast because it is done in a single transaction
             # context:
@@ -0,0 +1,318 @@
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""Writes archive records to the databases from a thread of their own.
+
+Adding a record to the archive and stats databases takes a few commits, which
+can take seconds on a slow SD card, a busy remote MySQL server, or a database
+locked by a report. If they are done by the thread that reads the LOOP
+packets, the console can overflow its buffers in the meantime. With an
+ArchiveWriter, that thread only puts the record in a queue.
+
+The queue is bounded. If it fills up, because the databases have been
+unavailable for a long time, whoever adds to it waits until there is room.
+Records are written in the order they were added, along with any other
+updates to the databases (such as those of the high/lows) queued with them.
+
+Each record is also appended to a journal file before it is queued, and the
+journal is emptied whenever the queue is. If weewx stops before a record is
+written, the record is found in the journal and added when weewx starts
+again. See replay_journal().
+
+If the databases cannot be opened, or a record or update cannot be written,
+the writer thread logs the error and stops. The records not yet written are
+left in the journal. The next call of addRecord() or addJob() raises the
+error, so that weewx restarts, as it would if the record had been written by
+the main thread.
+
+Threads that read a record from the database after it was announced by a
+NEW_ARCHIVE_RECORD event, such as the reports and the RESTful uploaders, call
+wait_until_written() first.
+
+Example:
+    writer = weewx.archivewriter.ArchiveWriter(open_databases, write_record, 50, 'weewx.journal')
+    writer.start()
+    writer.addRecord(record)
+    ...
+    writer.shutDown()
+"""
+
+from __future__ import with_statement
+import Queue
+import cPickle
+import os
+import syslog
+import threading
+import time
+import traceback
+
+import weeutil.weeutil
+
+class ArchiveWriter(threading.Thread):
+    """A thread that writes records and other updates to the databases, in
+    the order they are queued."""
+
+    def __init__(self, open_databases, write_record, max_size=50, journal_path=None):
+        """Initialize an instance of ArchiveWriter.
+
+        open_databases: A function that opens the databases used by the
+        writer. It is called by the writer thread, which then owns them. It
+        returns a tuple, which is passed on to write_record() and to the
+        functions given to addJob().
+
+        write_record: A function called with the tuple of databases and a
+        record, to write the record to them.
+
+        max_size: How many records and jobs can wait in the queue before
+        addRecord() and addJob() wait for room. [Optional. Default is 50]
+
+        journal_path: The path of the journal file, or None to keep no
+        journal. [Optional. Default is None]"""
+        threading.Thread.__init__(self, name="ArchiveWriter")
+        self.setDaemon(True)
+        self.open_databases = open_databases
+        self.write_record   = write_record
+        self.queue          = Queue.Queue(max_size)
+        self.journal        = WriteJournal(journal_path) if journal_path else None
+        # Guards the journal and the counts below, and is notified as items
+        # are written:
+        self._cond          = threading.Condition()
+        # The number of items queued, and written, ever. Items are written in
+        # the order they were queued, so an item has been written if its
+        # sequence number is no greater than the written count:
+        self._queued_count  = 0
+        self._written_count = 0
+        # A list of 2-way tuples (sequence number, timestamp) of the records
+        # in the queue:
+        self._pending       = []
+        # The exception that stopped the writer thread, if any:
+        self.error          = None
+
+    def start(self):
+        with _writers_lock:
+            _writers.add(self)
+        threading.Thread.start(self)
+
+    def addRecord(self, record):
+        """Queue a record to be written. It is added to the journal first.
+        Waits if the queue is full. If the writer thread has stopped because
+        of an error, the record is only added to the journal, and the error
+        is raised."""
+        # Later services may change the record:
+        record = dict(record)
+        with self._cond:
+            if self.journal is not None:
+                self.journal.append(record)
+            self._queued_count += 1
+            self._pending.append((self._queued_count, record['dateTime']))
+        self._put(('record', record))
+
+    def addJob(self, func, *args):
+        """Queue a function to be called by the writer thread, after the
+        records and jobs queued before it. It is called with the tuple of
+        databases, followed by args. Jobs are not kept in the journal. Waits
+        if the queue is full. If the writer thread has stopped because of an
+        error, the error is raised."""
+        with self._cond:
+            self._queued_count += 1
+        self._put(('job', (func, args)))
+
+    def waitUntilWritten(self, timestamp=None, timeout=None):
+        """Wait until the records queued so far with a timestamp up to, and
+        including, timestamp have been written. If timestamp is None, wait
+        until all the records and jobs queued so far have been.
+
+        returns: True if they have been written, False if timeout seconds
+        passed first, or the writer thread stopped because of an error."""
+        with self._cond:
+            if timestamp is None:
+                _target = self._queued_count
+            else:
+                _target = max([_seq for (_seq, _ts) in self._pending if _ts <= timestamp] or [0])
+            _end = time.time() + timeout if timeout is not None else None
+            while self._written_count < _target:
+                if self.error is not None:
+                    return False
+                if _end is None:
+                    self._cond.wait()
+                else:
+                    _remaining = _end - time.time()
+                    if _remaining <= 0:
+                        return False
+                    self._cond.wait(_remaining)
+            return True
+
+    def lastQueuedStamp(self):
+        """Return the timestamp of the newest record waiting to be written, or
+        None if there are none."""
+        with self._cond:
+            return max([_ts for (_seq, _ts) in self._pending] or [None])
+
+    def shutDown(self, timeout=60.0):
+        """Write what is in the queue, then stop the thread. If that takes
+        longer than timeout seconds, give up. The records not yet written
+        are still in the journal."""
+        if self.error is None:
+            try:
+                self._put(None)
+            except Exception:
+                # The writer thread stopped in the meantime.
+                pass
+        self.join(timeout)
+        with _writers_lock:
+            _writers.discard(self)
+        if self.isAlive():
+            syslog.syslog(syslog.LOG_ERR, "archivewriter: Unable to write %d queued records and updates" %
+                          (self._queued_count - self._written_count,))
+        else:
+            syslog.syslog(syslog.LOG_DEBUG, "archivewriter: Shut down archive writer thread.")
+            if self.journal is not None:
+                self.journal.close()
+
+    def run(self):
+        try:
+            databases = self.open_databases()
+        except Exception, e:
+            self._stop("Unable to open the databases", e)
+            return
+        try:
+            while True:
+                _item = self.queue.get()
+                if _item is None:
+                    return
+                (_kind, _payload) = _item
+                try:
+                    if _kind == 'record':
+                        self.write_record(databases, _payload)
+                    else:
+                        (_func, _args) = _payload
+                        _func(databases, *_args)
+                except Exception, e:
+                    # The item is not counted as written, so the journal
+                    # keeps the records from it on.
+                    self._stop("Unable to write %s" % ("record" if _kind == 'record' else "update"), e)
+                    return
+                with self._cond:
+                    self._written_count += 1
+                    if _kind == 'record':
+                        del self._pending[0]
+                    # Once everything in the journal has been written, it can
+                    # be emptied:
+                    if self._written_count == self._queued_count and self.journal is not None:
+                        self.journal.clear()
+                    self._cond.notifyAll()
+        finally:
+            for _db in databases:
+                _db.close()
+
+    def _stop(self, message, e):
+        """Log the exception that stopped the writer thread, and wake up
+        anyone waiting on it."""
+        syslog.syslog(syslog.LOG_CRIT, "archivewriter: %s: %s" % (message, e))
+        for _line in traceback.format_exc().splitlines():
+            syslog.syslog(syslog.LOG_CRIT, "    ****  %s" % _line)
+        syslog.syslog(syslog.LOG_CRIT, "    ****  Writer thread stopped. %d records and updates not written." %
+                      (self._queued_count - self._written_count,))
+        with self._cond:
+            self.error = e
+            self._cond.notifyAll()
+
+    def _put(self, item):
+        """Put an item in the queue, waiting for room if it is full. Raises
+        the error that stopped the writer thread, if it has."""
+        if self.error is not None:
+            raise self.error
+        try:
+            self.queue.put_nowait(item)
+        except Queue.Full:
+            syslog.syslog(syslog.LOG_ERR, "archivewriter: Queue of %d records and updates is full. "
+                          "Waiting for the databases." % (self.queue.maxsize,))
+            while True:
+                try:
+                    self.queue.put(item, True, 1.0)
+                    return
+                except Queue.Full:
+                    if self.error is not None:
+                        raise self.error
+
+class WriteJournal(object):
+    """A file of the records that have been queued to be written, but maybe
+    not yet written. Each record is pickled and synced to disk as it is
+    appended."""
+
+    def __init__(self, path):
+        self.path  = path
+        self._file = open(path, 'ab')
+
+    def append(self, record):
+        cPickle.dump(dict(record), self._file, 2)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def clear(self):
+        self._file.truncate(0)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    @staticmethod
+    def load(path):
+        """Return the records in a journal file, in the order they were
+        appended. A record cut short by a crash is ignored."""
+        records = []
+        if not os.path.exists(path):
+            return records
+        with open(path, 'rb') as _file:
+            while True:
+                try:
+                    records.append(cPickle.load(_file))
+                except EOFError:
+                    break
+                except (cPickle.UnpicklingError, ValueError, IndexError, KeyError), e:
+                    syslog.syslog(syslog.LOG_ERR, "archivewriter: Ignoring the rest of journal %s: %s" % (path, e))
+                    break
+        return records
+
+def replay_journal(path, archive):
+    """Add the records in a journal to an archive, if they are not already
+    there, then empty the journal. Call it before the stats database is
+    backfilled, so that it picks them up.
+
+    returns: The number of records added."""
+    _records = WriteJournal.load(path)
+    _last_ts = archive.lastGoodStamp()
+    _records = [_rec for _rec in _records if _last_ts is None or _rec['dateTime'] > _last_ts]
+    if _records:
+        syslog.syslog(syslog.LOG_NOTICE, "archivewriter: Adding %d records from %s to %s, from journal %s" %
+                      (len(_records), weeutil.weeutil.timestamp_to_string(_records[0]['dateTime']),
+                       weeutil.weeutil.timestamp_to_string(_records[-1]['dateTime']), path))
+        archive.addRecord(_records)
+    if os.path.exists(path):
+        open(path, 'wb').close()
+    return len(_records)
+
+# The writers running in this process. See wait_until_written().
+_writers = set()
+_writers_lock = threading.Lock()
+
+def wait_until_written(timestamp=None, timeout=None):
+    """Wait until every ArchiveWriter in this process has written its records
+    up to and including timestamp, or everything queued so far if timestamp is
+    None. Returns at once if there are no writers.
+
+    returns: True if they have, False if timeout seconds passed first."""
+    with _writers_lock:
+        _running = list(_writers)
+    for _writer in _running:
+        if not _writer.waitUntilWritten(timestamp, timeout):
+            syslog.syslog(syslog.LOG_ERR, "archivewriter: Gave up waiting after %s seconds for records "
+                          "to be written" % (timeout,))
+            return False
+    return True
@@ -214,6 +214,7 @@ class CheetahGenerator(weewx.reportengine.CachedReportGenerator):
 
         ngen = 0
         t1 = time.time()
+        (hits0, misses0) = self._getAggregateCacheCounts()
         for report in reports:
             if sections is None:
                 report_dict = self.gen_dict[period]
@@ -287,8 +288,17 @@ class CheetahGenerator(weewx.reportengine.CachedReportGenerator):
                         pass
 
         elapsed_time = time.time() - t1
-        loginf("generated %d '%s' files for %s in %.2f seconds" %
-               (ngen, period, self.skin_dict['REPORT_NAME'], elapsed_time))
+        (hits1, misses1) = self._getAggregateCacheCounts()
+        loginf("generated %d '%s' files for %s in %.2f seconds (aggregate cache: %d hits, %d misses)" %
+               (ngen, period, self.skin_dict['REPORT_NAME'], elapsed_time,
+                hits1 - hits0, misses1 - misses0))
+
+    def _getAggregateCacheCounts(self):
+        """Return the total hits and misses of the aggregate caches of the
+        stats databases used so far in this report run."""
+        hits = sum(statsdb.aggregate_cache.hits for statsdb in self.stats_cache.itervalues())
+        misses = sum(statsdb.aggregate_cache.misses for statsdb in self.stats_cache.itervalues())
+        return (hits, misses)
 
     def _getSearchList(self, encoding, timespan, archivedb, statsdb):
         """Get the complete search list to be used by Cheetah."""
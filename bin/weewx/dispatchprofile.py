@@ -0,0 +1,134 @@
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""Times the callbacks the engine calls for each event.
+
+When option profile_dispatch is set, StdEngine times every callback it calls,
+and keeps the times of the most recent calls of each callback for each event
+type. A summary of the count, mean, 95th percentile and maximum times is
+logged every profile_log_interval seconds, and whenever weewx is sent signal
+SIGUSR1:
+
+    kill -USR1 `cat /var/run/weewx.pid`
+
+This shows which service is holding up the LOOP packets.
+
+Example:
+    profiler = weewx.dispatchprofile.DispatchProfiler(window=1000, log_interval=3600)
+    t0 = time.time()
+    callback(event)
+    profiler.record(event.event_type, callback, time.time() - t0)
+    profiler.checkLog()
+"""
+
+import collections
+import math
+import syslog
+import time
+
+class CallbackTimes(object):
+    """The times taken by a callback for an event type, over a rolling window
+    of its most recent calls."""
+
+    def __init__(self, window):
+        # The total number of calls ever:
+        self.count = 0
+        self.times = collections.deque(maxlen=window)
+
+    def add(self, elapsed):
+        self.count += 1
+        self.times.append(elapsed)
+
+    def summary(self):
+        """Return a 4-way tuple (count, mean, p95, max) of the times in the
+        window, in seconds. The count is of all calls."""
+        _times = sorted(self.times)
+        if not _times:
+            return (self.count, None, None, None)
+        _p95 = _times[int(math.ceil(0.95 * len(_times))) - 1]
+        return (self.count, sum(_times) / len(_times), _p95, _times[-1])
+
+class DispatchProfiler(object):
+    """Keeps the times of the callbacks, by event type."""
+
+    def __init__(self, window=1000, log_interval=3600):
+        """Initialize an instance of DispatchProfiler.
+
+        window: How many of the most recent calls of a callback are used for
+        its mean, 95th percentile and maximum. [Optional. Default is 1000]
+
+        log_interval: How often to log a summary, in seconds, or None to log
+        it only when asked. [Optional. Default is 3600]"""
+        self.window       = window
+        self.log_interval = log_interval
+        # Key is a 2-way tuple (event type, callback name):
+        self.stats        = {}
+        self.last_log     = time.time()
+
+    def record(self, event_type, callback, elapsed):
+        """Add the time a callback took for an event."""
+        _key = (event_type, callback)
+        try:
+            _stats = self.stats[_key]
+        except KeyError:
+            _stats = self.stats[_key] = CallbackTimes(self.window)
+        _stats.add(elapsed)
+
+    def checkLog(self):
+        """Log a summary if it is time to."""
+        if self.log_interval and time.time() - self.last_log >= self.log_interval:
+            self.logSummary()
+
+    def summary(self):
+        """Return a list of 6-way tuples (event type name, callback name,
+        count, mean, p95, max), ordered by event type name and then by the
+        total time over the window, highest first."""
+        _rows = []
+        for ((_event_type, _callback), _stats) in self.stats.items():
+            (_count, _mean, _p95, _max) = _stats.summary()
+            _rows.append((event_name(_event_type), callback_name(_callback), _count, _mean, _p95, _max,
+                          sum(_stats.times)))
+        _rows.sort(key=lambda _row: (_row[0], -_row[6]))
+        return [_row[:6] for _row in _rows]
+
+    def logSummary(self):
+        """Log the summary, one line per callback and event type."""
+        self.last_log = time.time()
+        _rows = self.summary()
+        if not _rows:
+            syslog.syslog(syslog.LOG_INFO, "dispatchprofile: No events dispatched yet")
+            return
+        syslog.syslog(syslog.LOG_INFO, "dispatchprofile: Callback times over the last %d calls "
+                      "(count; mean, p95, max in ms):" % (self.window,))
+        for (_event, _callback, _count, _mean, _p95, _max) in _rows:
+            syslog.syslog(syslog.LOG_INFO, "dispatchprofile:   %-18s %-50s %8d; %9.3f %9.3f %9.3f" %
+                          (_event, _callback, _count, _mean * 1000.0, _p95 * 1000.0, _max * 1000.0))
+
+def event_name(event_type):
+    return getattr(event_type, '__name__', str(event_type))
+
+def callback_name(callback):
+    """Return a name for a callback, such as 'weewx.wxengine.StdArchive.new_loop_packet'."""
+    _self = getattr(callback, 'im_self', None)
+    if _self is not None:
+        return "%s.%s.%s" % (_self.__class__.__module__, _self.__class__.__name__, callback.__name__)
+    _module = getattr(callback, '__module__', None)
+    _name = getattr(callback, '__name__', None) or repr(callback)
+    return "%s.%s" % (_module, _name) if _module else _name
+
+# The profiler of the engine running in this process, if any. See log_summary().
+active_profiler = None
+
+def log_summary():
+    """Log the summary of the engine's profiler. Used by the handler of
+    SIGUSR1."""
+    if active_profiler is None:
+        syslog.syslog(syslog.LOG_INFO, "dispatchprofile: Profiling is not enabled. Set option profile_dispatch.")
+    else:
+        active_profiler.logSummary()
@@ -22,9 +22,12 @@ import traceback
 
 import configobj
 
+import weedb.pool
 import weeutil.weeutil
 import weewx.archive
+import weewx.archivewriter
 import weewx.stats
+import weewx.vectorcache
 from weeutil.weeutil import to_bool
 
 class StdReportEngine(threading.Thread):
@@ -77,6 +80,10 @@ class StdReportEngine(threading.Thread):
         
         self.setup()
 
+        # Wait for the latest records to be written, if weewx is writing them
+        # from another thread:
+        weewx.archivewriter.wait_until_written(timeout=int(self.config_dict['StdReport'].get('max_wait', 60)))
+
         # Iterate over each requested report
         for report in self.config_dict['StdReport'].sections:
             
@@ -296,7 +303,10 @@ class CopyGenerator(ReportGenerator):
         
 
 class CachedReportGenerator(ReportGenerator):
-    """Report generator that can cache archive and stats database connections."""
+    """Report generator that can cache archive and stats database connections.
+    
+    The connections are borrowed from weedb.pool.default_pool for the length
+    of the run, then given back, so the next run can use them again."""
     
     def start(self):
         self._initArchiveCache()
@@ -321,7 +331,14 @@ class CachedReportGenerator(ReportGenerator):
     def _getArchive(self, archive_name):
         if archive_name not in self.archive_cache:
             archive_dict = self.config_dict['Databases'][archive_name]
-            self.archive_cache[archive_name] = weewx.archive.Archive.open(archive_dict)
+            archive = weewx.archive.Archive.open(archive_dict, pool=weedb.pool.default_pool)
+            # Plot data can come from a cache of columns on disk:
+            vector_cache_root = self.config_dict['StdReport'].get('VECTOR_CACHE_ROOT')
+            if vector_cache_root:
+                archive.vector_cache = weewx.vectorcache.get_cache(archive,
+                                                                   os.path.join(self.config_dict['WEEWX_ROOT'],
+                                                                                vector_cache_root))
+            self.archive_cache[archive_name] = archive
         return self.archive_cache[archive_name]
         
     def _initStatsCache(self):
@@ -338,5 +355,5 @@ class CachedReportGenerator(ReportGenerator):
     def _getStats(self, stats_name):
         if stats_name not in self.stats_cache:
             stats_dict = self.config_dict['Databases'][stats_name]
-            self.stats_cache[stats_name] = weewx.stats.StatsDb.open(stats_dict)
+            self.stats_cache[stats_name] = weewx.stats.StatsDb.open(stats_dict, pool=weedb.pool.default_pool)
         return self.stats_cache[stats_name]
@@ -25,7 +25,10 @@ import platform
 import re
 import sys
 
+import weedb
+import weedb.pool
 import weewx.archive
+import weewx.archivewriter
 import weewx.units
 import weeutil.weeutil
 
@@ -741,6 +744,25 @@ class StationRegistry(REST):
             # indicating that this restful service is not ready to run.
             raise KeyError(errmsg)
 
+#===============================================================================
+#                             class PooledArchive
+#===============================================================================
+
+class PooledArchive(object):
+    """Stands in for an open weewx.archive.Archive. Each call of a member
+    function borrows a connection from the pool for just that call, so only
+    functions that return their results, such as getSql() and
+    lastGoodStamp(), can be used, not generators."""
+
+    def __init__(self, archive_db_dict):
+        self.archive_db_dict = archive_db_dict
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            with weewx.archive.Archive.open(self.archive_db_dict, pool=weedb.pool.default_pool) as _archive:
+                return getattr(_archive, name)(*args, **kwargs)
+        return call
+
 #===============================================================================
 #                             class RESTThread
 #===============================================================================
@@ -773,55 +795,63 @@ class RESTThread(threading.Thread):
 
     def run(self):
 
-        # Open up the archive. This cannot be done in the initializer because
-        # then the connection would have been created in a different thread.
-        # Also, use a 'with' statement. This will automatically close the
-        # archive in the case of an exception:
-        with weewx.archive.Archive.open(self.archive_db_dict) as self.archive:
+        while True :
+            # This will block until something appears in the queue:
+            time_ts = self.queue.get()
 
-            while True :
-                # This will block until something appears in the queue:
-                time_ts = self.queue.get()
-    
-                # A 'None' value appearing in the queue is our signal to exit
-                if time_ts is None:
-                    break
-                
-                # This string is just used for logging:
-                time_str = weeutil.weeutil.timestamp_to_string(time_ts)
-                
-                # Cycle through all the RESTful stations in the list:
-                for protocol in self.protocol_list:
-        
-                    # Post the data to the upload site. Be prepared to catch any exceptions:
-                    try :
-                        protocol.postData(self.archive, time_ts)
-                    # The urllib2 library throws exceptions of type urllib2.URLError, a subclass
-                    # of IOError. Hence all relevant exceptions are caught by catching IOError.
-                    # Starting with Python v2.6, socket.error is a subclass of IOError as well,
-                    # but we keep them separate to support V2.5:
-                    except (IOError, socket.error), e:
-                        syslog.syslog(syslog.LOG_ERR, "restful: Unable to publish record %s to %s station %s" % (time_str, protocol.site, protocol.station))
-                        syslog.syslog(syslog.LOG_ERR, "   ****  %s" % e)
-                        if hasattr(e, 'reason'):
-                            syslog.syslog(syslog.LOG_ERR, "   ****  Failed to reach server. Reason: %s" % e.reason)
-                        if hasattr(e, 'code'):
-                            syslog.syslog(syslog.LOG_ERR, "   ****  Failed to reach server. Error code: %s" % e.code)
-                    except SkippedPost, e:
-                        syslog.syslog(syslog.LOG_DEBUG, "restful: Skipped record %s to %s station %s" % (time_str, protocol.site, protocol.station))
-                        syslog.syslog(syslog.LOG_DEBUG, "   ****  %s" % (e,))
-                    except httplib.HTTPException, e:
-                        syslog.syslog(syslog.LOG_ERR, "restful: HTTP error from server. Skipped record %s to %s station %s" % (time_str, protocol.site, protocol.station))
-                        syslog.syslog(syslog.LOG_ERR, "   ****  %s" % (e,))
-                    except Exception, e:
-                        syslog.syslog(syslog.LOG_CRIT, "restful: Unrecoverable error when posting record %s to %s station %s" % (time_str, protocol.site, protocol.station))
-                        syslog.syslog(syslog.LOG_CRIT, "   ****  %s" % (e,))
-                        weeutil.weeutil.log_traceback("   ****  ")
-                        syslog.syslog(syslog.LOG_CRIT, "   ****  Thread terminating.")
-                        self.archive.close()
-                        raise
-                    else:
-                        syslog.syslog(syslog.LOG_INFO, "restful: Published record %s to %s station %s" % (time_str, protocol.site, protocol.station))
+            # A 'None' value appearing in the queue is our signal to exit
+            if time_ts is None:
+                break
+            
+            # Make sure the record has made it to the database:
+            weewx.archivewriter.wait_until_written(time_ts, 60)
+
+            # The protocols borrow a connection to the archive only for each
+            # query, so none is held while posting over the network:
+            self.archive = PooledArchive(self.archive_db_dict)
+            self.postRecord(time_ts)
+
+    def postRecord(self, time_ts):
+        """Post the record with timestamp time_ts to all the RESTful stations."""
+        
+        # This string is just used for logging:
+        time_str = weeutil.weeutil.timestamp_to_string(time_ts)
+        
+        # Cycle through all the RESTful stations in the list:
+        for protocol in self.protocol_list:
+
+            # Post the data to the upload site. Be prepared to catch any exceptions:
+            try :
+                protocol.postData(self.archive, time_ts)
+            # The urllib2 library throws exceptions of type urllib2.URLError, a subclass
+            # of IOError. Hence all relevant exceptions are caught by catching IOError.
+            # Starting with Python v2.6, socket.error is a subclass of IOError as well,
+            # but we keep them separate to support V2.5:
+            except (IOError, socket.error), e:
+                syslog.syslog(syslog.LOG_ERR, "restful: Unable to publish record %s to %s station %s" % (time_str, protocol.site, protocol.station))
+                syslog.syslog(syslog.LOG_ERR, "   ****  %s" % e)
+                if hasattr(e, 'reason'):
+                    syslog.syslog(syslog.LOG_ERR, "   ****  Failed to reach server. Reason: %s" % e.reason)
+                if hasattr(e, 'code'):
+                    syslog.syslog(syslog.LOG_ERR, "   ****  Failed to reach server. Error code: %s" % e.code)
+            except SkippedPost, e:
+                syslog.syslog(syslog.LOG_DEBUG, "restful: Skipped record %s to %s station %s" % (time_str, protocol.site, protocol.station))
+                syslog.syslog(syslog.LOG_DEBUG, "   ****  %s" % (e,))
+            except httplib.HTTPException, e:
+                syslog.syslog(syslog.LOG_ERR, "restful: HTTP error from server. Skipped record %s to %s station %s" % (time_str, protocol.site, protocol.station))
+                syslog.syslog(syslog.LOG_ERR, "   ****  %s" % (e,))
+            except weedb.OperationalError, e:
+                # Most likely, no connection to the archive came free in time:
+                syslog.syslog(syslog.LOG_ERR, "restful: Unable to read the archive. Skipped record %s to %s station %s" % (time_str, protocol.site, protocol.station))
+                syslog.syslog(syslog.LOG_ERR, "   ****  %s" % (e,))
+            except Exception, e:
+                syslog.syslog(syslog.LOG_CRIT, "restful: Unrecoverable error when posting record %s to %s station %s" % (time_str, protocol.site, protocol.station))
+                syslog.syslog(syslog.LOG_CRIT, "   ****  %s" % (e,))
+                weeutil.weeutil.log_traceback("   ****  ")
+                syslog.syslog(syslog.LOG_CRIT, "   ****  Thread terminating.")
+                raise
+            else:
+                syslog.syslog(syslog.LOG_INFO, "restful: Published record %s to %s station %s" % (time_str, protocol.site, protocol.station))
 
 
 #===============================================================================
@@ -84,7 +84,10 @@ import urllib
 import urllib2
 
 import weedb
+import weedb.pool
 import weeutil.weeutil
+import weewx.archive
+import weewx.archivewriter
 import weewx.wxengine
 from weeutil.weeutil import to_int, to_float, to_bool, timestamp_to_string
 import weewx.units
@@ -223,6 +226,10 @@ class RESTThread(threading.Thread):
           - CWOP
         It can be overridden and specialized for additional protocols.
 
+        archive: The archive to query, or None to add nothing from it. Types
+        already in the record are not queried again, so the record returned
+        can be passed through again with None.
+
         returns: A dictionary of weather values"""
         
         _time_ts = record['dateTime']
@@ -230,6 +237,8 @@ class RESTThread(threading.Thread):
         
         # Make a copy of the record, then start adding to it:
         _datadict = dict(record)
+        if archive is None:
+            return _datadict
 
         # If the type 'rain' does not appear in the archive schema, an exception will
         # be raised. Be prepared to catch it.
@@ -238,70 +247,72 @@ class RESTThread(threading.Thread):
                 # CWOP says rain should be "rain that fell in the past hour". WU
                 # says it should be "the accumulated rainfall in the past 60 min".
                 # Presumably, this is exclusive of the archive record 60 minutes
-                # before, so the SQL statement is exclusive on the left, inclusive
-                # on the right.
-                _result = archive.getSql("SELECT SUM(rain), MIN(usUnits), MAX(usUnits) FROM archive "
-                                         "WHERE dateTime>? AND dateTime<=?",
-                                         (_time_ts - 3600.0, _time_ts))
-                if _result is not None and _result[0] is not None:
-                    if not _result[1] == _result[2] == record['usUnits']:
-                        raise ValueError("Inconsistent units (%s vs %s vs %s) when querying for hourRain" %
-                                         (_result[1], _result[2], record['usUnits']))
-                    _datadict['hourRain'] = _result[0]
-                else:
-                    _datadict['hourRain'] = None
+                # before, so the sum is exclusive on the left, inclusive on the
+                # right.
+                _datadict['hourRain'] = self.sum_rain(archive, record, 'hourRain',
+                                                      _time_ts - 3600.0, _time_ts)
     
             if not _datadict.has_key('rain24'):
                 # Similar issue, except for last 24 hours:
-                _result = archive.getSql("SELECT SUM(rain), MIN(usUnits), MAX(usUnits) FROM archive "
-                                         "WHERE dateTime>? AND dateTime<=?",
-                                         (_time_ts - 24*3600.0, _time_ts))
-                if _result is not None and _result[0] is not None:
-                    if not _result[1] == _result[2] == record['usUnits']:
-                        raise ValueError("Inconsistent units (%s vs %s vs %s) when querying for rain24" %
-                                         (_result[1], _result[2], record['usUnits']))
-                    _datadict['rain24'] = _result[0]
-                else:
-                    _datadict['rain24'] = None
+                _datadict['rain24'] = self.sum_rain(archive, record, 'rain24',
+                                                    _time_ts - 24*3600.0, _time_ts)
     
             if not _datadict.has_key('dayRain'):
                 # NB: The WU considers the archive with time stamp 00:00
                 # (midnight) as (wrongly) belonging to the current day
                 # (instead of the previous day). But, it's their site,
-                # so we'll do it their way.  That means the SELECT statement
-                # is inclusive on both time ends:
-                _result = archive.getSql("SELECT SUM(rain), MIN(usUnits), MAX(usUnits) FROM archive "
-                                         "WHERE dateTime>=? AND dateTime<=?", 
-                                         (_sod_ts, _time_ts))
-                if _result is not None and _result[0] is not None:
-                    if not _result[1] == _result[2] == record['usUnits']:
-                        raise ValueError("Inconsistent units (%s vs %s vs %s) when querying for dayRain" %
-                                         (_result[1], _result[2], record['usUnits']))
-                    _datadict['dayRain'] = _result[0]
-                else:
-                    _datadict['dayRain'] = None
+                # so we'll do it their way.  That means the sum is inclusive
+                # on both time ends:
+                _datadict['dayRain'] = self.sum_rain(archive, record, 'dayRain',
+                                                     _sod_ts, _time_ts, include_start=True)
 
         except weedb.OperationalError:
             pass
             
         return _datadict
 
-    def run(self):
-        """If there is a database specified, open the database, then call
-        run_loop() with the database.  If no database is specified, simply
-        call run_loop()."""
-        
-        # Open up the archive. Use a 'with' statement. This will automatically
-        # close the archive in the case of an exception:
-        if self.database_dict is not None:
-            with weewx.archive.Archive.open(self.database_dict) as _archive:
-                self.run_loop(_archive)
+    def sum_rain(self, archive, record, obs_type, startstamp, stopstamp, include_start=False):
+        """Return the rain that fell in an interval, or None if there is no
+        rain data. The sum is taken from the archive's cache of recent
+        records, if it covers the interval, otherwise from the database.
+
+        obs_type: The type being calculated, for the error message if the
+        records are in different units.
+
+        startstamp: Exclusive start of the interval, unless include_start is
+        True.
+
+        stopstamp: Inclusive end of the interval."""
+        _rows = archive.getRecentColumns('rain', startstamp, stopstamp, include_start)
+        if _rows is not None:
+            _rain  = [_row[1] for _row in _rows if _row[1] is not None]
+            _units = [_row[2] for _row in _rows]
+            _result = (sum(_rain), min(_units), max(_units)) if _rain else None
         else:
-            self.run_loop()
+            _result = archive.getSql("SELECT SUM(rain), MIN(usUnits), MAX(usUnits) FROM archive "
+                                     "WHERE dateTime%s? AND dateTime<=?" % ('>=' if include_start else '>',),
+                                     (startstamp, stopstamp))
+        if _result is None or _result[0] is None:
+            return None
+        if not _result[1] == _result[2] == record['usUnits']:
+            raise ValueError("Inconsistent units (%s vs %s vs %s) when querying for %s" %
+                             (_result[1], _result[2], record['usUnits'], obs_type))
+        return _result[0]
+
+    def run(self):
+        """Call run_loop(). If a database is specified, a connection to it
+        is borrowed from the pool of connections for each record."""
+        self.run_loop()
 
     def run_loop(self, archive=None):
         """Runs a continuous loop, waiting for records to appear in the queue,
         then processing them.
+
+        archive: An open archive to use for all records. If None, and a
+        database is specified, a connection to it is borrowed from the pool
+        just long enough to get the full record with get_record(). It is given
+        back before the record is posted, and process_record() gets None for
+        the archive. [Optional. Default is None]
         """
         
         while True :
@@ -319,7 +330,23 @@ class RESTThread(threading.Thread):
             if self.skip_this_post(_record['dateTime']):
                 continue
     
+            # The record, and the ones before it, may still be on their way
+            # to the database:
+            if archive is not None or self.database_dict is not None:
+                weewx.archivewriter.wait_until_written(_record['dateTime'], 60)
+
             try:
+                if archive is None and self.database_dict is not None:
+                    # Get the full record now, so the connection is not held
+                    # while the post goes out over the network:
+                    try:
+                        with weewx.archive.Archive.open(self.database_dict, pool=weedb.pool.default_pool) as _archive:
+                            _record = self.get_record(_record, _archive)
+                    except weedb.OperationalError, e:
+                        # Most likely, no connection came free in time:
+                        syslog.syslog(syslog.LOG_ERR, "restx: %s: Unable to read the database. Skipped record %s: %s"
+                                      % (self.protocol_name, timestamp_to_string(_record['dateTime']), e))
+                        continue
                 # Process the record, using whatever method the specializing
                 # class provides
                 self.process_record(_record, archive)
@@ -350,7 +377,10 @@ class RESTThread(threading.Thread):
         """Default version of process_record.
         
         This version uses HTTP GETs to do the post, which should work for many
-        protocols, but it can always be replaced by a specializing class."""
+        protocols, but it can always be replaced by a specializing class.
+
+        archive: The archive, or None if the record has already been through
+        get_record(), while a connection was borrowed from the pool."""
         
         # Get the full record by querying the database ...
         _full_record = self.get_record(record, archive)
@@ -1501,6 +1531,8 @@ class AWEKASThread(RESTThread):
         """Add rainRate to the record."""
         # Get the record from my superclass
         r = super(AWEKASThread, self).get_record(record, archive)
+        if archive is None:
+            return r
         # Now augment with rainRate, which AWEKAS expects. If the archive does not
         # have rainRate, an exception will be raised. Prepare to catch it.
         try:
@@ -31,7 +31,10 @@
 """
 
 from __future__ import with_statement
+import collections
 import math
+import multiprocessing
+import re
 import sys
 import syslog
 import time
@@ -76,6 +79,7 @@ schema_create_str = """CREATE TABLE _stats_schema (obs_name CHAR(20) NOT NULL UN
 meta_replace_str = """REPLACE into metadata VALUES(?, ?)"""  
 
 select_update_str = """SELECT value FROM metadata WHERE name = 'lastUpdate';"""
+select_base_str   = """SELECT value FROM metadata WHERE name = ?;"""
 select_unit_str   = """SELECT value FROM metadata WHERE name = 'unit_system';"""
 
 # Set of SQL statements to be used for calculating aggregate statistics. Key is the aggregation type.
@@ -109,6 +113,183 @@ sqlDict = {'min'        : "SELECT MIN(min) FROM %(stats_type)s WHERE dateTime >=
            'min_le'     : "SELECT SUM(min <= %(val)s) FROM %(stats_type)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s",
            'sum_ge'     : "SELECT SUM(sum >= %(val)s) FROM %(stats_type)s WHERE dateTime >= %(start)s AND dateTime < %(stop)s"}
 
+# Matches the placeholders for values in the statements in sqlDict. When a
+# statement is run, these are replaced by bound parameters. See
+# StatsDb._getAggregateSql().
+_sql_param_re = re.compile(r'%\((start|stop|val)\)s')
+
+# The columns of the table for each kind of stats type:
+stats_columns = {'REAL'   : ('dateTime', 'min', 'mintime', 'max', 'maxtime', 'sum', 'count'),
+                 'VECTOR' : ('dateTime', 'min', 'mintime', 'max', 'maxtime', 'sum', 'count',
+                             'gustdir', 'xsum', 'ysum', 'squaresum', 'squarecount')}
+
+# The following functions mimic the SQL aggregate functions. Nulls (None) are
+# ignored. If there are no non-null values, the result is null.
+
+def _sql_min(vals):
+    _good = [v for v in vals if v is not None]
+    return min(_good) if _good else None
+
+def _sql_max(vals):
+    _good = [v for v in vals if v is not None]
+    return max(_good) if _good else None
+
+def _sql_sum(vals):
+    _good = [v for v in vals if v is not None]
+    return sum(_good) if _good else None
+
+def _sql_avg(vals):
+    _good = [v for v in vals if v is not None]
+    return float(sum(_good)) / len(_good) if _good else None
+
+def _sql_value_at(vals, key_vals, func):
+    """Mimics 'SELECT vals ... WHERE key_vals = (SELECT func(key_vals) ...)'."""
+    _extreme = func(key_vals)
+    if _extreme is None:
+        return None
+    return (vals[list(key_vals).index(_extreme)],)
+
+# Set of aggregation types that can be calculated from a single scan of the
+# daily rows of a stats type. See StatsDb.getAggregates(). Given a dictionary
+# with key column name, value the sequence of values of the column in time
+# order, each function returns the same row the corresponding statement in
+# sqlDict would return.
+scanDict = {'min'        : lambda c : (_sql_min(c['min']),),
+            'minmax'     : lambda c : (_sql_min(c['max']),),
+            'max'        : lambda c : (_sql_max(c['max']),),
+            'maxmin'     : lambda c : (_sql_max(c['min']),),
+            'meanmin'    : lambda c : (_sql_avg(c['min']),),
+            'meanmax'    : lambda c : (_sql_avg(c['max']),),
+            'maxsum'     : lambda c : (_sql_max(c['sum']),),
+            'mintime'    : lambda c : _sql_value_at(c['mintime'], c['min'], _sql_min),
+            'maxmintime' : lambda c : _sql_value_at(c['mintime'], c['min'], _sql_max),
+            'maxtime'    : lambda c : _sql_value_at(c['maxtime'], c['max'], _sql_max),
+            'minmaxtime' : lambda c : _sql_value_at(c['maxtime'], c['max'], _sql_min),
+            'maxsumtime' : lambda c : _sql_value_at(c['maxtime'], c['sum'], _sql_max),
+            'gustdir'    : lambda c : _sql_value_at(c['gustdir'], c['max'], _sql_max),
+            'sum'        : lambda c : (_sql_sum(c['sum']),),
+            'count'      : lambda c : (_sql_sum(c['count']),),
+            'avg'        : lambda c : (_sql_sum(c['sum']), _sql_sum(c['count'])),
+            'rms'        : lambda c : (_sql_sum(c['squaresum']), _sql_sum(c['count'])),
+            'vecavg'     : lambda c : (_sql_sum(c['xsum']), _sql_sum(c['ysum']), _sql_sum(c['squarecount'])),
+            'vecdir'     : lambda c : (_sql_sum(c['xsum']), _sql_sum(c['ysum']))}
+
+# These aggregation types are available only for 'VECTOR' stats types:
+vector_aggregates = ('gustdir', 'rms', 'vecavg', 'vecdir')
+
+#===============================================================================
+# Rollups
+#
+# Besides the daily rows, the stats database can keep a row per month and per
+# year for each stats type. These "rollup" rows have the same columns as the
+# daily rows, and are stored in tables named after the stats type and the
+# period (e.g., 'outTemp_month'). A month row is calculated from the daily
+# rows of the month, a year row from the month rows of the year. They hold
+# only the days that have closed, that is, those before the day of the last
+# update. So the rollups are left alone while a day is still getting archive
+# records, and are calculated again from the rows they roll up once it
+# closes. Rollups are used only for periods that have closed. See
+# StatsDb.setRollups().
+#===============================================================================
+
+# The periods for which rollups are kept, from the finest to the coarsest:
+rollup_periods = ('month', 'year')
+
+# The aggregation types that can be calculated from rollup rows as well as
+# from daily rows:
+rollup_aggregates = ('min', 'mintime', 'max', 'maxtime', 'gustdir', 'sum', 'count',
+                     'avg', 'rms', 'vecavg', 'vecdir')
+
+# Heating and cooling degree days are kept in tables of their own, with one
+# row per day, calculated from the average outside temperature of the day. The
+# columns are the same as those of a 'REAL' stats type, with the degree days of
+# the day as min, max and sum, and a count of one. They are not part of the
+# stats schema, because they are not accumulated from archive records.
+degree_day_types = ('heatdeg', 'cooldeg')
+
+def _rollup_table(stats_type, period):
+    """Returns the name of the table holding the rollups of a stats type."""
+    return '%s_%s' % (stats_type, period)
+
+def _startOfPeriod(time_ts, period):
+    """Returns the start of the month or year that includes time_ts."""
+    _time_tt = time.localtime(time_ts)
+    _month = _time_tt.tm_mon if period == 'month' else 1
+    return int(time.mktime((_time_tt.tm_year, _month, 1, 0, 0, 0, 0, 0, -1)))
+
+def _startOfNextPeriod(start_ts, period):
+    """Returns the start of the month or year following the one that starts
+    at start_ts."""
+    _time_tt = time.localtime(start_ts)
+    if period == 'month':
+        (_year, _month) = (_time_tt.tm_year + _time_tt.tm_mon // 12, _time_tt.tm_mon % 12 + 1)
+    else:
+        (_year, _month) = (_time_tt.tm_year + 1, 1)
+    return int(time.mktime((_year, _month, 1, 0, 0, 0, 0, 0, -1)))
+
+def _rollup_row(column_dict, obs_type):
+    """Combine rows into a single rollup row.
+    
+    column_dict: A dictionary with key column name, value the sequence of
+    values of the column in time order.
+    
+    obs_type: Either 'REAL' or 'VECTOR'.
+    
+    returns: The rollup row, as a tuple of the columns following dateTime."""
+    c = column_dict
+    _row = (_sql_min(c['min']), (_sql_value_at(c['mintime'], c['min'], _sql_min) or (None,))[0],
+            _sql_max(c['max']), (_sql_value_at(c['maxtime'], c['max'], _sql_max) or (None,))[0],
+            _sql_sum(c['sum']), _sql_sum(c['count']))
+    if obs_type == 'VECTOR':
+        _row += ((_sql_value_at(c['gustdir'], c['max'], _sql_max) or (None,))[0],
+                 _sql_sum(c['xsum']), _sql_sum(c['ysum']),
+                 _sql_sum(c['squaresum']), _sql_sum(c['squarecount']))
+    return _row
+
+#===============================================================================
+#                        Class AggregateCache
+#===============================================================================
+
+class AggregateCache(object):
+    """A bounded cache of aggregates, with least-recently-used eviction.
+    
+    The key is the tuple (stats_type, start, stop, aggregateType, val), the
+    value the value tuple returned by StatsDb.getAggregate(). The attributes
+    'hits' and 'misses' count lookups."""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()
+
+    def get(self, key):
+        """Return the cached value for key, or None if it is not in the cache."""
+        try:
+            # Move it to the end, where the most recently used entries live.
+            value = self._cache.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._cache[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Add a value to the cache, evicting the least recently used entry if
+        the cache is full."""
+        self._cache.pop(key, None)
+        self._cache[key] = value
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        """Invalidate all entries. The hit and miss counters are kept."""
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
 #===============================================================================
 #                        Class StatsDb
 #===============================================================================
@@ -167,6 +348,23 @@ class StatsDb(object):
     
     accumClass: The class to be used as an accumulator. Default is weewx.accum.WXAccum.
     This can be changed for specialized, non-weather, applications.
+    
+    rollups: The periods for which the database keeps rollups, from the finest
+    to the coarsest. See rollup_periods above. A database has none, unless they
+    have been turned on with setRollups() or createRollups().
+    
+    degree_day_bases: A 2-way tuple with the base temperatures, as (value,
+    unit) tuples, that the heating and cooling degree days in the database were
+    calculated with. None if the database does not keep degree days. See
+    setDegreeDayBases().
+    
+    aggregate_cache: An instance of AggregateCache, holding the aggregates
+    returned by getAggregate() and getAggregates(). It is cleared whenever the
+    statistics are updated through this instance. Because a report run opens
+    its own instance, its lifetime is normally a single report run. 
+    
+    pool: The weedb.pool.ConnectionPool the connection was borrowed from, or
+    None if it was not. If set, close() returns the connection to the pool.
     """
     
     def __init__(self, connection):
@@ -178,6 +376,7 @@ class StatsDb(object):
         connection: A weedb connection to the stats database. """
         
         self.connection = connection
+        self.pool = None
         try:
             self.std_unit_system = self._getStdUnitSystem()
         except weedb.OperationalError, e:
@@ -185,20 +384,46 @@ class StatsDb(object):
             raise weewx.UninitializedDatabase(e)
         self.schema = self._getSchema()
         self.statsTypes = self.schema.keys()
+        self.rollups = self._getRollups()
+        self.degree_day_bases = self._getDegreeDayBases()
+        # New bases for the degree days, to be applied by the next backfill.
+        self._new_degree_day_bases = None
         # The class to be used as an accumulator. This can be changed by the
         # calling program.
         self.AccumClass = weewx.accum.WXAccum
+        # The accumulator for the day most recently written to the database,
+        # along with the time of the last update it was written with. It is
+        # reused until the day rolls over, or another writer updates the
+        # database. See _getDayStats().
+        self._cached_day_stats = None
+        self._cached_last_update = None
+        # Aggregates calculated so far. See getAggregate().
+        self.aggregate_cache = AggregateCache()
+        # The parameterized SQL statements used so far for aggregates, keyed
+        # by (aggregateType, stats_type). See _getAggregateSql().
+        self._sql_cache = {}
         
     #--------------------------- STATIC METHODS -----------------------------------
     
     @staticmethod
-    def open(stats_db_dict):
+    def open(stats_db_dict, pool=None):
         """Helper function to return an opened StatsDb object.
         
         stats_db_dict: A dictionary passed on to weedb. It should hold
-        the keywords necessary to open the database."""
-        connection = weedb.connect(stats_db_dict)
-        return StatsDb(connection)
+        the keywords necessary to open the database.
+        
+        pool: If given, an instance of weedb.pool.ConnectionPool to borrow the
+        connection from. It is given back when the database is closed."""
+        if pool is None:
+            return StatsDb(weedb.connect(stats_db_dict))
+        connection = pool.checkout(stats_db_dict)
+        try:
+            stats = StatsDb(connection)
+        except:
+            pool.release(connection, discard=True)
+            raise
+        stats.pool = pool
+        return stats
 
     @staticmethod
     def open_with_create(stats_db_dict, stats_schema):
@@ -279,7 +504,10 @@ class StatsDb(object):
         return self.connection.database
     
     def close(self):
-        self.connection.close()
+        if self.pool is not None:
+            self.pool.release(self.connection)
+        else:
+            self.connection.close()
         
     def __enter__(self):
         return self
@@ -311,6 +539,31 @@ class StatsDb(object):
         # Then save the results:
         self._setDayStats(_stats_dict, record['dateTime'])
         
+    def setDegreeDayBases(self, heatbase_t, coolbase_t):
+        """Set the base temperatures of the heating and cooling degree days
+        kept in the database.
+        
+        If the degree days have not been calculated with these bases, they
+        will be (re)calculated from the daily temperatures by the next call to
+        backfillFrom().
+        
+        heatbase_t, coolbase_t: Value tuples with the heating and cooling
+        degree day base, respectively."""
+        _bases = ((float(heatbase_t[0]), heatbase_t[1]), (float(coolbase_t[0]), coolbase_t[1]))
+        self._new_degree_day_bases = _bases if _bases != self.degree_day_bases else None
+
+    def setRollups(self, enabled):
+        """Turn the monthly and yearly rollups on or off.
+        
+        Turning them on calculates them from the daily rows, if the database
+        does not have them yet. Turning them off drops their tables.
+        
+        enabled: True to keep rollups, False to not keep them."""
+        if enabled and not self.rollups:
+            self.createRollups()
+        elif not enabled and self.rollups:
+            self.dropRollups()
+
     def getAggregate(self, timespan, stats_type, aggregateType, val=None):
         """Returns an aggregation of a statistical type for a given time period.
         
@@ -329,7 +582,6 @@ class StatsDb(object):
         or None if not enough data was available to calculate it, or if the aggregation
         type is unknown. The second element is the unit type (eg, 'degree_F').
         The third element is the unit group (eg, "group_temperature") """
-        global sqlDict
         
         # This entry point won't work for heating or cooling degree days:
         if weewx.debug:
@@ -352,15 +604,91 @@ class StatsDb(object):
         else:
             target_val = None
             
-        # This dictionary is used for interpolating the SQL statement.
-        interDict = {'start'         : weeutil.weeutil.startOfDay(timespan.start),
-                     'stop'          : timespan.stop,
-                     'stats_type'    : stats_type,
-                     'aggregateType' : aggregateType,
-                     'val'           : target_val}
+        _key = (stats_type, timespan.start, timespan.stop, aggregateType, target_val)
+        _result = self.aggregate_cache.get(_key)
+        if _result is not None:
+            return _result
+
+        _start = weeutil.weeutil.startOfDay(timespan.start)
+        _segments = self._planSegments(_start, timespan.stop)
+        if any(_period for (_period, _, _) in _segments) and aggregateType in rollup_aggregates \
+                and (self.schema[stats_type] == 'VECTOR' or aggregateType not in vector_aggregates):
+            # The time span includes whole months or years, so use the rollups:
+            _row = scanDict[aggregateType](self._getColumns(stats_type, _segments))
+        else:
+            # The values of the parameters of the SQL statement:
+            paramDict = {'start' : _start,
+                         'stop'  : timespan.stop,
+                         'val'   : target_val}
+            
+            # Run the query against the database:
+            (_sql_stmt, _param_names) = self._getAggregateSql(aggregateType, stats_type)
+            _row = self._fetchone(_sql_stmt, tuple(paramDict[_name] for _name in _param_names))
+        
+        _result = self._makeAggregate(stats_type, aggregateType, _row)
+        self.aggregate_cache.put(_key, _result)
+        return _result
+        
+    def getAggregates(self, timespan, stats_type, aggregateTypes=None):
+        """Returns several aggregations of a statistical type for a given time
+        period, using a single query.
+        
+        timespan: An instance of weeutil.Timespan with the time period over which
+        aggregation is to be done.
+        
+        stats_type: The type over which aggregation is to be done (e.g., 'barometer',
+        'outTemp', 'rain', ...)
+        
+        aggregateTypes: An iterable of aggregation types. Types in scanDict
+        above are calculated from a single scan of the daily rows (or the
+        rollups, for the types in rollup_aggregates). Any others are passed on
+        to getAggregate(). [Optional. Default is all the types in
+        scanDict that are available for the stats type.]
         
-        # Run the query against the database:
-        _row = self.xeqSql(sqlDict[aggregateType], interDict)
+        returns: A dictionary with key aggregation type, and value a value
+        tuple, as would be returned by getAggregate()."""
+
+        # Check to see if this is a valid stats type:
+        if stats_type not in self.statsTypes:
+            raise AttributeError, "Unknown stats type %s" % (stats_type,)
+
+        _is_vector = self.schema[stats_type] == 'VECTOR'
+        if aggregateTypes is None:
+            aggregateTypes = [_agg for _agg in scanDict if _is_vector or _agg not in vector_aggregates]
+        
+        _results = {}
+        _scan_types = []
+        for _agg in aggregateTypes:
+            if _agg in scanDict and (_is_vector or _agg not in vector_aggregates):
+                _result = self.aggregate_cache.get((stats_type, timespan.start, timespan.stop, _agg, None))
+                if _result is None:
+                    _scan_types.append(_agg)
+                else:
+                    _results[_agg] = _result
+            else:
+                _results[_agg] = self.getAggregate(timespan, stats_type, _agg)
+
+        # If everything was in the cache, there is no need to scan.
+        if not _scan_types:
+            return _results
+
+        # Aggregates that can use rollups are calculated from the coarsest
+        # rows available. The rest need the daily rows.
+        _start = weeutil.weeutil.startOfDay(timespan.start)
+        _daily_segments = [(None, _start, timespan.stop)]
+        _rollup_segments = self._planSegments(_start, timespan.stop)
+        _column_dicts = {}
+        for _agg in _scan_types:
+            _segments = _rollup_segments if _agg in rollup_aggregates else _daily_segments
+            if tuple(_segments) not in _column_dicts:
+                _column_dicts[tuple(_segments)] = self._getColumns(stats_type, _segments)
+            _results[_agg] = self._makeAggregate(stats_type, _agg, scanDict[_agg](_column_dicts[tuple(_segments)]))
+            self.aggregate_cache.put((stats_type, timespan.start, timespan.stop, _agg, None), _results[_agg])
+        return _results
+
+    def _makeAggregate(self, stats_type, aggregateType, _row):
+        """Form a value tuple out of the row returned by the SQL statement for
+        an aggregation type."""
 
         #=======================================================================
         # Each aggregation type requires a slightly different calculation.
@@ -405,7 +733,7 @@ class StatsDb(object):
         # Form the value tuple and return it:
         return weewx.units.ValueTuple(_result, t, g)
         
-    def backfillFrom(self, archiveDb, start_ts = None, stop_ts = None):
+    def backfillFrom(self, archiveDb, start_ts = None, stop_ts = None, processes=1, chunk_days=30):
         """Fill the statistical database from an archive database.
         
         Normally, the stats database if filled by LOOP packets (to get maximum time
@@ -422,24 +750,69 @@ class StatsDb(object):
         stop_ts: Archive data with a timestamp less than or equal to this will be
         used. [Optional. Default is to end with the last datum in the archive.]
         
+        processes: The number of processes to use. If more than one, whole
+        days are backfilled in chunks of chunk_days days by a pool of
+        processes, each with its own connection to the archive database. The
+        results of each chunk are written in a single transaction, after which
+        the time of the last update is checkpointed, so an interrupted backfill
+        resumes where it left off. This requires that archiveDb was opened with
+        Archive.open(). [Optional. Default is 1.]
+        
+        chunk_days: The number of days in each chunk. [Optional. Default is 30.]
+        
         returns: The number of records backfilled."""
         
         syslog.syslog(syslog.LOG_DEBUG, "stats: Backfilling stats database.")
         t1 = time.time()
-        nrecs = 0
-        ndays = 0
         
-        _statsDict = None
-        _lastTime  = None
+        # If the degree days are missing, or use different bases, calculate
+        # them from the daily statistics we have so far:
+        if self._new_degree_day_bases is not None:
+            self._backfillDegreeDays(*self._new_degree_day_bases)
+            self._new_degree_day_bases = None
         
         # If a start time for the backfill wasn't given, then start with the time of
         # the last statistics recorded:
         if start_ts is None:
             start_ts = self._getLastUpdate()
         
+        # Records deleted after they were rolled up cannot be backfilled:
+        _retained_ts = archiveDb.retainedFrom()
+        if _retained_ts is not None and (start_ts is None or start_ts < _retained_ts):
+            syslog.syslog(syslog.LOG_ERR, "stats: Archive records before %s have been deleted. "
+                          "Their statistics cannot be backfilled." % weeutil.weeutil.timestamp_to_string(_retained_ts))
+        
+        if processes > 1 and archiveDb.db_dict is not None:
+            (nrecs, ndays) = self._backfillParallel(archiveDb, start_ts, stop_ts, processes, chunk_days)
+        else:
+            if processes > 1:
+                syslog.syslog(syslog.LOG_INFO, "stats: Archive database was not opened with Archive.open(). Backfilling with one process.")
+            (nrecs, ndays) = self._backfillSerial(archiveDb, start_ts, stop_ts)
+        
+        t2 = time.time()
+        tdiff = t2 - t1
+        if nrecs:
+            syslog.syslog(syslog.LOG_NOTICE, 
+                          "stats: backfilled %d days of statistics with %d records in %.2f seconds" % (ndays, nrecs, tdiff))
+        else:
+            syslog.syslog(syslog.LOG_INFO,
+                          "stats: stats database up to date.")
+    
+        return nrecs
+
+    def _backfillSerial(self, archiveDb, start_ts, stop_ts):
+        """Backfill, one record at a time.
+        
+        returns: A 2-way tuple with the number of records and days backfilled."""
+        nrecs = 0
+        ndays = 0
+        
+        _statsDict = None
+        _lastTime  = None
+        
         # Go through all the archiveDb records in the time span, adding them to the
         # database
-        for _rec in archiveDb.genBatchRecords(start_ts, stop_ts):
+        for _rec in archiveDb.genBatchViews(start_ts, stop_ts):
     
             # Get the start-of-day for the record:
             _sod_ts = weeutil.weeutil.startOfArchiveDay(_rec['dateTime'])
@@ -464,27 +837,162 @@ class StatsDb(object):
             _lastTime = _rec['dateTime']
             nrecs += 1
             if nrecs % 1000 == 0:
-                syslog.syslog(syslog.LOG_DEBUG, "stats: Records processed: %d; Last date: %s" % \
-                              (nrecs, weeutil.weeutil.timestamp_to_string(_lastTime)))
-                print >>sys.stdout, "Records processed: %d; Last date: %s\r" % \
-                              (nrecs, weeutil.weeutil.timestamp_to_string(_lastTime)),
-                sys.stdout.flush()
+                _logProgress(nrecs, _lastTime)
     
         # We're done. Record the stats for the last day.
         if _statsDict:
             self._setDayStats(_statsDict, _lastTime)
             ndays += 1
         
-        t2 = time.time()
-        tdiff = t2 - t1
-        if nrecs:
-            syslog.syslog(syslog.LOG_NOTICE, 
-                          "stats: backfilled %d days of statistics with %d records in %.2f seconds" % (ndays, nrecs, tdiff))
+        return (nrecs, ndays)
+
+    def _backfillParallel(self, archiveDb, start_ts, stop_ts, processes, chunk_days):
+        """Backfill whole days in chunks, using a pool of processes. See
+        backfillFrom().
+        
+        returns: A 2-way tuple with the number of records and days backfilled."""
+        
+        if stop_ts is None:
+            stop_ts = archiveDb.lastGoodStamp()
+        if start_ts is None:
+            _first_ts = archiveDb.firstGoodStamp()
+            if _first_ts is None:
+                return (0, 0)
+            _begin_ts = weeutil.weeutil.startOfArchiveDay(_first_ts)
+            (nrecs, ndays) = (0, 0)
         else:
-            syslog.syslog(syslog.LOG_INFO,
-                          "stats: stats database up to date.")
-    
-        return nrecs
+            # The rest of a day that is already in the database has to be
+            # merged with what is there, so do it one record at a time.
+            _begin_ts = weeutil.weeutil.archiveDaySpan(start_ts).stop
+            (nrecs, ndays) = self._backfillSerial(archiveDb, start_ts, min(_begin_ts, stop_ts))
+        
+        # Break the remaining time into chunks of whole days. The database
+        # dictionary may be a configobj section, which does its interpolation
+        # on lookup, so make a plain copy for the worker processes.
+        _db_dict = dict((_key, archiveDb.db_dict[_key]) for _key in archiveDb.db_dict)
+        _chunks = []
+        while _begin_ts < stop_ts:
+            # Adding half a day takes care of any daylight savings time change:
+            _end_ts = min(weeutil.weeutil.startOfDay(_begin_ts + chunk_days * 86400 + 43200), stop_ts)
+            _chunks.append((_db_dict, archiveDb.table, self.AccumClass, self.schema, _begin_ts, _end_ts))
+            _begin_ts = _end_ts
+        if not _chunks:
+            return (nrecs, ndays)
+        
+        _pool = multiprocessing.Pool(min(processes, len(_chunks)))
+        try:
+            # The results come back in order, so the time of the last update
+            # only moves forward.
+            for (_day_list, _chunk_nrecs, _last_ts) in _pool.imap(_backfill_chunk, _chunks):
+                if _chunk_nrecs:
+                    self._writeDays(_day_list, _last_ts)
+                    nrecs += _chunk_nrecs
+                    ndays += len(_day_list)
+                    _logProgress(nrecs, _last_ts)
+            _pool.close()
+        except:
+            _pool.terminate()
+            raise
+        finally:
+            _pool.join()
+        
+        return (nrecs, ndays)
+
+    def _writeDays(self, day_list, lastUpdate):
+        """Write the statistics of several whole days in a single transaction.
+        
+        day_list: A list of 3-way tuples (sod_ts, unit_system, stats_dict),
+        where stats_dict has key stats type, value the stats tuple of the type
+        for the day.
+        
+        lastUpdate: The time of the last update will be set to this."""
+        
+        with weedb.Transaction(self.connection) as _cursor:
+            _old_update = self._getLastUpdate(_cursor)
+            for (_sod_ts, _unit_system, _stats_dict) in day_list:
+                self._checkUnitSystem(_cursor, _unit_system)
+                for _stats_type in self.statsTypes:
+                    _cursor.execute(_sql_replace_string_factory(self.schema, _stats_type),
+                                    (_sod_ts,) + _stats_dict[_stats_type])
+                if 'outTemp' in self.statsTypes and self.degree_day_bases:
+                    _outTemp = dict(zip(stats_columns['REAL'][1:], _stats_dict['outTemp']))
+                    self._writeDegreeDays(_cursor, _sod_ts, _outTemp['sum'], _outTemp['count'], _unit_system)
+            self._updateRollups(_cursor, [_sod_ts for (_sod_ts, _, _) in day_list], _old_update, lastUpdate)
+            # Checkpoint the time of the last update:
+            _cursor.execute(meta_replace_str, ('lastUpdate', str(int(lastUpdate))))
+        
+        # Anything cached is now stale:
+        self.aggregate_cache.clear()
+        self._cached_day_stats = None
+
+    def createRollups(self):
+        """Create the rollup tables of any stats types that do not have them,
+        then calculate the rollups from the daily rows.
+        
+        returns: The number of rollup rows written."""
+        
+        syslog.syslog(syslog.LOG_DEBUG, "stats: Creating rollups.")
+        t1 = time.time()
+        nrows = 0
+        _tables = self.connection.tables()
+        _stats_types = self.statsTypes + (list(degree_day_types) if self.degree_day_bases else [])
+        with weedb.Transaction(self.connection) as _cursor:
+            _closed_ts = self._getClosedStamp(self._getLastUpdate(_cursor))
+            for _stats_type in _stats_types:
+                for _period in rollup_periods:
+                    _table = _rollup_table(_stats_type, _period)
+                    if _table not in _tables:
+                        _cursor.execute(_sql_create_string_factory((_table, self.schema.get(_stats_type, 'REAL'))))
+                    else:
+                        _cursor.execute("DELETE FROM %s" % _table)
+                nrows += self._rollupAll(_cursor, _stats_type, rollup_periods, _closed_ts)
+        self.rollups = self._getRollups()
+        self.aggregate_cache.clear()
+        syslog.syslog(syslog.LOG_NOTICE, "stats: Created %d rollup rows in %.2f seconds" % (nrows, time.time() - t1))
+        return nrows
+
+    def dropRollups(self):
+        """Drop the rollup tables of all stats types."""
+        _tables = self.connection.tables()
+        with weedb.Transaction(self.connection) as _cursor:
+            for _stats_type in self.statsTypes + list(degree_day_types):
+                for _period in rollup_periods:
+                    _table = _rollup_table(_stats_type, _period)
+                    if _table in _tables:
+                        _cursor.execute("DROP TABLE %s" % _table)
+        self.rollups = []
+        self.aggregate_cache.clear()
+        syslog.syslog(syslog.LOG_NOTICE, "stats: Dropped the rollups.")
+
+    def _backfillDegreeDays(self, heatbase_t, coolbase_t):
+        """Calculate the heating and cooling degree days of every day in the
+        database, creating their tables if necessary.
+        
+        heatbase_t, coolbase_t: The heating and cooling degree day base, as
+        (value, unit) tuples."""
+        
+        t1 = time.time()
+        _tables = self.connection.tables()
+        with weedb.Transaction(self.connection) as _cursor:
+            for _stats_type in degree_day_types:
+                for _table in [_stats_type] + [_rollup_table(_stats_type, _period) for _period in self.rollups]:
+                    if _table not in _tables:
+                        _cursor.execute(_sql_create_string_factory((_table, 'REAL')))
+                    _cursor.execute("DELETE FROM %s" % _table)
+            _cursor.execute(meta_replace_str, ('heatbase', "%r, %s" % heatbase_t))
+            _cursor.execute(meta_replace_str, ('coolbase', "%r, %s" % coolbase_t))
+            self.degree_day_bases = (heatbase_t, coolbase_t)
+            ndays = 0
+            if 'outTemp' in self.statsTypes:
+                _cursor.execute("SELECT dateTime, sum, count FROM outTemp ORDER BY dateTime ASC")
+                for (_sod_ts, _sum, _count) in list(_cursor):
+                    if self._writeDegreeDays(_cursor, _sod_ts, _sum, _count, self.std_unit_system):
+                        ndays += 1
+            _closed_ts = self._getClosedStamp(self._getLastUpdate(_cursor))
+            for _stats_type in degree_day_types:
+                self._rollupAll(_cursor, _stats_type, self.rollups, _closed_ts)
+        self.aggregate_cache.clear()
+        syslog.syslog(syslog.LOG_NOTICE, "stats: Calculated degree days for %d days in %.2f seconds" % (ndays, time.time() - t1))
 
     def xeqSql(self, rawsqlStmt, interDict):
         """Execute an arbitrary SQL statement, using an interpolation dictionary.
@@ -509,10 +1017,221 @@ class StatsDb(object):
         
     #--------------------------- UTILITY FUNCTIONS -----------------------------------
 
+    def _getAggregateSql(self, aggregateType, stats_type):
+        """Return the SQL statement for an aggregation type, using bound
+        parameters for the values.
+        
+        Because the statement for a given aggregation type and stats type is
+        always the same string, the database can reuse its compiled form.
+        
+        returns: A 2-way tuple. The first element is the SQL statement, the
+        second a tuple with the names of its parameters ('start', 'stop', or
+        'val'), in order."""
+        try:
+            return self._sql_cache[(aggregateType, stats_type)]
+        except KeyError:
+            pass
+        _raw_stmt = sqlDict[aggregateType]
+        _param_names = tuple(_sql_param_re.findall(_raw_stmt))
+        _sql_stmt = _sql_param_re.sub('?', _raw_stmt) % {'stats_type' : stats_type}
+        self._sql_cache[(aggregateType, stats_type)] = (_sql_stmt, _param_names)
+        return (_sql_stmt, _param_names)
+
+    def _planSegments(self, start_ts, stop_ts, periods=None, closed_ts=None):
+        """Break the daily rows between start_ts (inclusive) and stop_ts
+        (exclusive) into segments, each to be read from the coarsest rollups
+        that cover it. Only the ragged edges use finer rows, and so do any
+        periods that have not closed by closed_ts. [Optional. Default is
+        the start of the day of the last update.]
+        
+        returns: A list of 3-way tuples (period, start, stop), in time order.
+        The period is None for segments to be read from the daily rows."""
+        if periods is None:
+            periods = self.rollups
+            if periods:
+                closed_ts = self._getClosedStamp(self._getLastUpdate())
+        if not periods or closed_ts is None:
+            return [(None, start_ts, stop_ts)] if start_ts < stop_ts else []
+        _period = periods[-1]
+        # Find the first whole period in the time span...
+        _first_ts = _startOfPeriod(start_ts, _period)
+        if _first_ts < start_ts:
+            _first_ts = _startOfNextPeriod(_first_ts, _period)
+        # ... and the end of the last one that has closed:
+        _last_ts = _first_ts
+        while _startOfNextPeriod(_last_ts, _period) <= min(stop_ts, closed_ts):
+            _last_ts = _startOfNextPeriod(_last_ts, _period)
+        if _last_ts == _first_ts:
+            # No whole periods. Try the next finer rows.
+            return self._planSegments(start_ts, stop_ts, periods[:-1], closed_ts)
+        return self._planSegments(start_ts, _first_ts, periods[:-1], closed_ts) + [(_period, _first_ts, _last_ts)] \
+            + self._planSegments(_last_ts, stop_ts, periods[:-1], closed_ts)
+
+    def _getColumns(self, stats_type, segments, cursor=None):
+        """Read the rows of a stats type for a list of segments, as returned by
+        _planSegments().
+        
+        returns: A dictionary with key column name, value a tuple with the
+        values of the column in time order."""
+        # The degree day types are not in the schema. They are kept as 'REAL'.
+        _columns = stats_columns[self.schema.get(stats_type, 'REAL')]
+        _sql_stmt = "SELECT %s FROM %%s WHERE dateTime >= ? AND dateTime < ? ORDER BY dateTime ASC" % ', '.join(_columns)
+        _cursor = cursor or self.connection.cursor()
+        try:
+            _rows = []
+            for (_period, _start_ts, _stop_ts) in segments:
+                _table = stats_type if _period is None else _rollup_table(stats_type, _period)
+                _cursor.execute(_sql_stmt % _table, (_start_ts, _stop_ts))
+                _rows.extend(_cursor)
+        finally:
+            if cursor is None:
+                _cursor.close()
+        # Transpose the rows into columns:
+        if _rows:
+            return dict(zip(_columns, zip(*_rows)))
+        return dict((_column, ()) for _column in _columns)
+
+    def _updateRollup(self, cursor, stats_type, period, start_ts, closed_ts):
+        """Recalculate the rollup row of a stats type for the period starting
+        at start_ts, from the next finer rows before closed_ts.
+        
+        returns: True if a row was written, False if there were no rows to
+        roll up."""
+        _iperiod = rollup_periods.index(period)
+        _source = None if _iperiod == 0 else rollup_periods[_iperiod - 1]
+        _stop_ts = min(_startOfNextPeriod(start_ts, period), closed_ts)
+        _column_dict = self._getColumns(stats_type, [(_source, start_ts, _stop_ts)], cursor)
+        _table = _rollup_table(stats_type, period)
+        if not _column_dict['dateTime']:
+            cursor.execute("DELETE FROM %s WHERE dateTime = ?" % _table, (start_ts,))
+            return False
+        _obs_type = self.schema.get(stats_type, 'REAL')
+        _write_tuple = (start_ts,) + _rollup_row(_column_dict, _obs_type)
+        cursor.execute(sql_replace_strs[_obs_type] % _table, _write_tuple)
+        return True
+
+    def _updateRollups(self, cursor, sod_list, old_update, new_update):
+        """Bring the rollups up to date, after the daily rows of some days
+        have been written, and the time of the last update has gone from
+        old_update to new_update.
+        
+        The rollups of a closed day are calculated again if its row changed.
+        Those of the days that have closed since old_update are calculated
+        for the first time."""
+        if not self.rollups:
+            return
+        _closed_ts = self._getClosedStamp(new_update)
+        _old_closed_ts = self._getClosedStamp(old_update)
+        _stats_types = self.statsTypes + (list(degree_day_types) if self.degree_day_bases else [])
+        # The finer rollups come first, because the coarser ones are
+        # calculated from them:
+        for _period in self.rollups:
+            _starts = set(_startOfPeriod(_sod_ts, _period) for _sod_ts in sod_list if _sod_ts < _closed_ts)
+            if _old_closed_ts is not None and _old_closed_ts < _closed_ts:
+                _start_ts = _startOfPeriod(_old_closed_ts, _period)
+                while _start_ts < _closed_ts:
+                    _starts.add(_start_ts)
+                    _start_ts = _startOfNextPeriod(_start_ts, _period)
+            for _start_ts in sorted(_starts):
+                for _stats_type in _stats_types:
+                    self._updateRollup(cursor, _stats_type, _period, _start_ts, _closed_ts)
+
+    @staticmethod
+    def _getClosedStamp(lastUpdate):
+        """Returns the start of the day of the last update. The days before it
+        have closed. None if there has been no update."""
+        if lastUpdate is None:
+            return None
+        return weeutil.weeutil.startOfArchiveDay(lastUpdate)
+
+    def _rollupAll(self, cursor, stats_type, periods, closed_ts):
+        """Recalculate all the rollup rows of a stats type for the given
+        periods, from the rows before closed_ts.
+        
+        returns: The number of rows written."""
+        nrows = 0
+        for _period in periods:
+            # Each rollup is calculated from the next finer rows:
+            _iperiod = rollup_periods.index(_period)
+            _source = stats_type if _iperiod == 0 else _rollup_table(stats_type, rollup_periods[_iperiod - 1])
+            cursor.execute("SELECT MIN(dateTime), MAX(dateTime) FROM %s" % _source)
+            (_first_ts, _last_ts) = cursor.fetchone()
+            if _first_ts is None or closed_ts is None:
+                continue
+            _start_ts = _startOfPeriod(_first_ts, _period)
+            while _start_ts <= _last_ts and _start_ts < closed_ts:
+                if self._updateRollup(cursor, stats_type, _period, _start_ts, closed_ts):
+                    nrows += 1
+                _start_ts = _startOfNextPeriod(_start_ts, _period)
+        return nrows
+
+    def _writeDegreeDays(self, cursor, sod_ts, outTemp_sum, outTemp_count, unit_system):
+        """Write the heating and cooling degree days of a day, given the sum
+        and count of its outside temperatures.
+        
+        returns: True if they were written, False if there is no average
+        temperature for the day."""
+        if not outTemp_count:
+            return False
+        # Calculate the degree days exactly as get_heat_cool() would from the
+        # daily statistics:
+        (t, g) = weewx.units.getStandardUnitType(unit_system, 'outTemp', 'avg')
+        Tavg_t = weewx.units.ValueTuple(outTemp_sum / outTemp_count, t, g)
+        (heatbase_t, coolbase_t) = self.degree_day_bases
+        _heatdeg = weewx.wxformulas.heating_degrees(weewx.units.convert(Tavg_t, heatbase_t[1])[0], heatbase_t[0])
+        _cooldeg = weewx.wxformulas.cooling_degrees(weewx.units.convert(Tavg_t, coolbase_t[1])[0], coolbase_t[0])
+        for (_stats_type, _dd) in (('heatdeg', _heatdeg), ('cooldeg', _cooldeg)):
+            cursor.execute(sql_replace_strs['REAL'] % _stats_type, (sod_ts, _dd, sod_ts, _dd, sod_ts, _dd, 1))
+        return True
+
+    def _getDegreeDayBases(self):
+        """Returns the bases the degree days in the database were calculated
+        with, or None if the database does not keep degree days."""
+        _bases = []
+        for _name in ('heatbase', 'coolbase'):
+            _row = self._fetchone(select_base_str, (_name,))
+            if not _row:
+                return None
+            (_value, _unit) = str(_row[0]).split(',')
+            _bases.append((float(_value), _unit.strip()))
+        return tuple(_bases)
+
+    def _getRollups(self):
+        """Returns the periods for which all stats types have rollup tables."""
+        _tables = set(self.connection.tables())
+        _rollups = []
+        for _period in rollup_periods:
+            if not all(_rollup_table(_stats_type, _period) in _tables for _stats_type in self.statsTypes):
+                break
+            _rollups.append(_period)
+        return _rollups
+
+    def _fetchone(self, sql_stmt, params):
+        """Execute a SQL statement with bound parameters, returning the first
+        row of the result set."""
+        _cursor = self.connection.cursor()
+        try:
+            _cursor.execute(sql_stmt, params)
+            return _cursor.fetchone()
+        finally:
+            _cursor.close()
+
     def _getDayStats(self, sod_ts):
         """Return an instance an appropriate accumulator, initialized to a given day's statistics.
 
         sod_ts: The timestamp of the start-of-day of the desired day."""
+        
+        # The cached accumulator is handed over to the caller, who may modify
+        # it, so it is no longer good. It will be cached again when it is
+        # written back by _setDayStats().
+        _cached_day_stats, self._cached_day_stats = self._cached_day_stats, None
+        
+        # If it is for the same day, and no one else has updated the database
+        # since we last wrote it, the cached accumulator can be used as is.
+        if _cached_day_stats is not None and _cached_day_stats.timespan.start == sod_ts:
+            if self._getLastUpdate() == self._cached_last_update:
+                return _cached_day_stats
+            syslog.syslog(syslog.LOG_DEBUG, "stats: Database updated by another writer. Reloading day statistics.")
                 
         # Get the TimeSpan for the day starting with sod_ts:
         timespan = weeutil.weeutil.archiveDaySpan(sod_ts,0)
@@ -523,7 +1242,7 @@ class StatsDb(object):
         # For each kind of stats, execute the SQL query and hand the results on
         # to the accumulator.
         for stats_type in self.statsTypes:
-            _row = self.xeqSql("SELECT * FROM %s WHERE dateTime = %d" % (stats_type, sod_ts), {})
+            _row = self._fetchone("SELECT * FROM %s WHERE dateTime = ?" % stats_type, (sod_ts,))
 
             # If the date does not exist in the database yet then _row will be None.
             _stats_tuple = _row[1:] if _row is not None else None
@@ -536,7 +1255,9 @@ class StatsDb(object):
         return _stats_dict
 
     def _setDayStats(self, dayStatsDict, lastUpdate):
-        """Write all statistics for a day to the database in a single transaction.
+        """Write the statistics for a day to the database in a single transaction.
+        
+        Only the types whose statistics have changed are written.
         
         dayStatsDict: an accumulator. See weewx.accum
         
@@ -548,32 +1269,62 @@ class StatsDb(object):
 
         # Using the _connection as a context manager means that
         # in case of an error, all tables will get rolled back.
+        # Only the types whose statistics have changed need to be written. This
+        # includes any types that do not have a row for this day yet.
+        _dirty_types = set(dayStatsDict.getDirtyTypes())
+
         with weedb.Transaction(self.connection) as _cursor:
 
             # For each stats type...
             for _stats_type in self.statsTypes:
-                # ... get the stats tuple to be written to the database...
-                _write_tuple = (_sod,) + dayStatsDict[_stats_type].getStatsTuple()
-                # ... and an appropriate SQL command ...
-                _sql_replace_str = _sql_replace_string_factory(self.schema, _stats_type)
-                # ... and write to the database.
-                _cursor.execute(_sql_replace_str,_write_tuple)
+                if _stats_type not in _dirty_types:
+                    continue
+                # ... write its stats tuple to the database:
+                _cursor.execute(_sql_replace_string_factory(self.schema, _stats_type),
+                                (_sod,) + dayStatsDict[_stats_type].getStatsTuple())
+                # The degree days follow the average temperature of the day:
+                if _stats_type == 'outTemp' and self.degree_day_bases:
+                    self._writeDegreeDays(_cursor, _sod, dayStatsDict['outTemp'].sum, dayStatsDict['outTemp'].count,
+                                          dayStatsDict.unit_system)
                 
-            # Set the unit system if it has not been set before. 
-            # To do this, first see if this file has ever been used:
-            last_update = self._getLastUpdate(_cursor)
-            if last_update is None:
-                # File has never been used. Set the unit system:
-                _cursor.execute(meta_replace_str, ('unit_system', str(int(dayStatsDict.unit_system))))
-            else:
-                # The file has been used. Make sure the new data uses
-                # the same unit system as the database.
-                unit_system = self._getStdUnitSystem(_cursor)
-                if unit_system != dayStatsDict.unit_system:
-                    raise ValueError("stats: Data uses different unit system (0x%x) than stats file (0x%x)" % (dayStatsDict.unit_system, unit_system))
+            # Set the unit system if it has not been set before, or check it:
+            _old_update = self._checkUnitSystem(_cursor, dayStatsDict.unit_system)
+            # The rollups change only if the day had closed, or another one
+            # has closed since the last update:
+            self._updateRollups(_cursor, [_sod] if _dirty_types else [], _old_update, lastUpdate)
             # Update the time of the last stats update:
             _cursor.execute(meta_replace_str, ('lastUpdate', str(int(lastUpdate))))
+        
+        # The statistics have changed, so any aggregates calculated so far
+        # may be stale.
+        self.aggregate_cache.clear()
+
+        # The transaction succeeded, so the accumulator matches what is in the
+        # database. Hang on to it for the next update.
+        dayStatsDict.clearDirty()
+        self._cached_day_stats = dayStatsDict
+        self._cached_last_update = int(lastUpdate)
             
+    def _checkUnitSystem(self, cursor, unit_system):
+        """Set the unit system of the database if it has never been used.
+        Otherwise, make sure the new data uses the same unit system as the
+        database.
+        
+        returns: The time of the last update, or None if there has been
+        none."""
+        # To do this, first see if this file has ever been used:
+        last_update = self._getLastUpdate(cursor)
+        if last_update is None:
+            # File has never been used. Set the unit system:
+            cursor.execute(meta_replace_str, ('unit_system', str(int(unit_system))))
+        else:
+            # The file has been used. Make sure the new data uses
+            # the same unit system as the database.
+            db_unit_system = self._getStdUnitSystem(cursor)
+            if db_unit_system != unit_system:
+                raise ValueError("stats: Data uses different unit system (0x%x) than stats file (0x%x)" % (unit_system, db_unit_system))
+        return last_update
+
     def _getLastUpdate(self, cursor=None):
         """Returns the time of the last update to the statistical database."""
 
@@ -638,13 +1389,88 @@ class StatsDb(object):
         # they are not used) due to an earlier bug. Filter them out. Also,
         # filter out the metadata table. In case the same database is being used
         # for the archive data, filter out the 'archive' database.
-        stats_types = [s for s in raw_stats_types if s not in ['heatdeg','cooldeg','metadata', 'archive']]
+        stats_types = [s for s in raw_stats_types if s not in ['heatdeg','cooldeg','metadata', 'archive']
+                       and s.rsplit('_', 1)[-1] not in rollup_periods]
         stats_schema = []
         for stat_type in stats_types:
             ncol = len(self.connection.columnsOf(stat_type))
             stats_schema.append((stat_type, 'REAL' if ncol==7 else 'VECTOR'))
         return stats_schema
 
+#===============================================================================
+#                        Backfill helpers
+#===============================================================================
+
+def _logProgress(nrecs, last_ts):
+    """Log and print the progress of a backfill."""
+    syslog.syslog(syslog.LOG_DEBUG, "stats: Records processed: %d; Last date: %s" % \
+                  (nrecs, weeutil.weeutil.timestamp_to_string(last_ts)))
+    print >>sys.stdout, "Records processed: %d; Last date: %s\r" % \
+                  (nrecs, weeutil.weeutil.timestamp_to_string(last_ts)),
+    sys.stdout.flush()
+
+def _backfill_chunk(chunk):
+    """Accumulate the statistics of a chunk of whole days from the archive.
+    This runs in a worker process of StatsDb._backfillParallel().
+    
+    chunk: A tuple (archive_db_dict, table, AccumClass, schema, start_ts,
+    stop_ts). Records with a timestamp greater than start_ts, and less than or
+    equal to stop_ts will be used.
+    
+    returns: A 3-way tuple. The first element is a list of (sod_ts,
+    unit_system, stats_dict) for each day with data, where stats_dict has key
+    stats type, value its stats tuple. The second is the number of records,
+    the third the timestamp of the last record."""
+    import weewx.archive
+    (archive_db_dict, table, AccumClass, schema, start_ts, stop_ts) = chunk
+    
+    def _finish(accum):
+        return (accum.timespan.start, accum.unit_system,
+                dict((_stats_type, accum[_stats_type].getStatsTuple()) for _stats_type in schema))
+    
+    _day_list = []
+    _accum = None
+    nrecs = 0
+    _last_ts = None
+    with weewx.archive.Archive.open(archive_db_dict, table) as archive:
+        for _rec in archive.genBatchViews(start_ts, stop_ts):
+            if _accum is None or not _accum.timespan.includesArchiveTime(_rec['dateTime']):
+                if _accum is not None:
+                    _day_list.append(_finish(_accum))
+                # Start a new day, with empty statistics for every stats type:
+                _sod_ts = weeutil.weeutil.startOfArchiveDay(_rec['dateTime'])
+                _accum = AccumClass(weeutil.weeutil.archiveDaySpan(_sod_ts, 0))
+                for _stats_type in schema:
+                    _accum[_stats_type] = weewx.accum.ScalarStats() if schema[_stats_type] == 'REAL' else weewx.accum.VecStats()
+            _accum.addRecord(_rec)
+            _last_ts = _rec['dateTime']
+            nrecs += 1
+    if _accum is not None:
+        _day_list.append(_finish(_accum))
+    return (_day_list, nrecs, _last_ts)
+
+#===============================================================================
+#                        function get_degree_day_bases
+#===============================================================================
+
+# The default base temperature for heating and cooling degree days:
+default_degree_day_base = (65.0, 'degree_F')
+
+def get_degree_day_bases(archive_dict):
+    """Get the bases of the degree days to be kept in the stats database.
+    
+    archive_dict: The section [StdArchive] of the configuration dictionary. The
+    options 'heating_base' and 'cooling_base' give the base temperature with
+    its unit, e.g., "65, degree_F". [Optional. Default is 65 degree_F.]
+    
+    returns: A 2-way tuple with the heating and cooling degree day base, as
+    (value, unit) tuples."""
+    _bases = []
+    for _option in ('heating_base', 'cooling_base'):
+        _base = archive_dict.get(_option)
+        _bases.append((float(_base[0]), _base[1]) if _base else default_degree_day_base)
+    return tuple(_bases)
+
 #===============================================================================
 #                        function get_heat_cool
 #===============================================================================
@@ -675,22 +1501,34 @@ def get_heat_cool(statsdb, timespan, stats_type, aggregateType, heatbase_t, cool
     if aggregateType not in ['sum', 'avg']:
         raise weewx.ViolatedPrecondition, "Aggregate type %s for %s not supported." % (aggregateType, stats_type)
 
-    _sum = 0.0
-    _count = 0
-    for daySpan in weeutil.weeutil.genDaySpans(timespan.start, timespan.stop):
-        # Get the average temperature for the day as a value tuple:
-        Tavg_t = statsdb.getAggregate(daySpan, 'outTemp', 'avg')
-        # Make sure it's valid before including it in the aggregation:
-        if Tavg_t is not None and Tavg_t[0] is not None:
-            if stats_type == 'heatdeg':
-                # Convert average temperature to the same units as heatbase:
-                Tavg_target_t = weewx.units.convert(Tavg_t, heatbase_t[1])
-                _sum += weewx.wxformulas.heating_degrees(Tavg_target_t[0], heatbase_t[0])
-            else:
-                # Convert average temperature to the same units as coolbase:
-                Tavg_target_t = weewx.units.convert(Tavg_t, coolbase_t[1])
-                _sum += weewx.wxformulas.cooling_degrees(Tavg_target_t[0], coolbase_t[0])
-            _count += 1
+    _start_ts = weeutil.weeutil.startOfDay(timespan.start)
+    if statsdb.degree_day_bases == ((float(heatbase_t[0]), heatbase_t[1]), (float(coolbase_t[0]), coolbase_t[1])):
+        # The database keeps the degree days for these bases, so they can be
+        # read directly, using the rollups if possible:
+        _columns = statsdb._getColumns(stats_type, statsdb._planSegments(_start_ts, timespan.stop))
+        _sum = _sql_sum(_columns['sum']) or 0.0
+        _count = _sql_sum(_columns['count']) or 0
+    else:
+        # Calculate them from the daily temperatures, read in a single query:
+        if 'outTemp' not in statsdb.statsTypes:
+            raise AttributeError, "Unknown stats type outTemp"
+        _columns = statsdb._getColumns('outTemp', [(None, _start_ts, timespan.stop)])
+        (t, g) = weewx.units.getStandardUnitType(statsdb.std_unit_system, 'outTemp', 'avg')
+        _sum = 0.0
+        _count = 0
+        for (_day_sum, _day_count) in zip(_columns['sum'], _columns['count']):
+            # Make sure there is an average temperature before including it in the aggregation:
+            if _day_sum is not None and _day_count:
+                Tavg_t = weewx.units.ValueTuple(_day_sum / _day_count, t, g)
+                if stats_type == 'heatdeg':
+                    # Convert average temperature to the same units as heatbase:
+                    Tavg_target_t = weewx.units.convert(Tavg_t, heatbase_t[1])
+                    _sum += weewx.wxformulas.heating_degrees(Tavg_target_t[0], heatbase_t[0])
+                else:
+                    # Convert average temperature to the same units as coolbase:
+                    Tavg_target_t = weewx.units.convert(Tavg_t, coolbase_t[1])
+                    _sum += weewx.wxformulas.cooling_degrees(Tavg_target_t[0], coolbase_t[0])
+                _count += 1
 
     if aggregateType == 'sum':
         _result = _sum
@@ -740,31 +1578,35 @@ class TaggedStats(object):
         self.formatter   = formatter
         self.converter   = converter
         self.option_dict = option_dict
+        # The TimeSpanStats handed out so far, keyed by time period. Reusing them
+        # allows the aggregates they prefetch to be shared between tags.
+        self._timespan_stats = {}
         
     # What follows is the list of time period attributes:
 
     @property
     def day(self):
-        return TimeSpanStats(weeutil.weeutil.archiveDaySpan(self.endtime_ts), self.db, 'day', 
-                             self.formatter, self.converter, **self.option_dict)
+        return self._getTimeSpanStats(weeutil.weeutil.archiveDaySpan(self.endtime_ts), 'day')
     @property
     def week(self):
         week_start = self.option_dict.get('week_start', 6)
-        return TimeSpanStats(weeutil.weeutil.archiveWeekSpan(self.endtime_ts, week_start), self.db, 'week', 
-                             self.formatter, self.converter, **self.option_dict)
+        return self._getTimeSpanStats(weeutil.weeutil.archiveWeekSpan(self.endtime_ts, week_start), 'week')
     @property
     def month(self):
-        return TimeSpanStats(weeutil.weeutil.archiveMonthSpan(self.endtime_ts), self.db, 'month', 
-                             self.formatter, self.converter, **self.option_dict)
+        return self._getTimeSpanStats(weeutil.weeutil.archiveMonthSpan(self.endtime_ts), 'month')
     @property
     def year(self):
-        return TimeSpanStats(weeutil.weeutil.archiveYearSpan(self.endtime_ts), self.db, 'year', 
-                             self.formatter, self.converter, **self.option_dict)
+        return self._getTimeSpanStats(weeutil.weeutil.archiveYearSpan(self.endtime_ts), 'year')
     @property
     def rainyear(self):
-        return TimeSpanStats(weeutil.weeutil.archiveRainYearSpan(self.endtime_ts, self.option_dict['rain_year_start']), self.db, 'rainyear', 
-                             self.formatter, self.converter, **self.option_dict)
-        
+        return self._getTimeSpanStats(weeutil.weeutil.archiveRainYearSpan(self.endtime_ts, self.option_dict['rain_year_start']), 'rainyear')
+        
+    def _getTimeSpanStats(self, timespan, context):
+        """Return the TimeSpanStats for a time period, creating it if necessary."""
+        if context not in self._timespan_stats:
+            self._timespan_stats[context] = TimeSpanStats(timespan, self.db, context, 
+                                                          self.formatter, self.converter, **self.option_dict)
+        return self._timespan_stats[context]
    
 #===============================================================================
 #                    Class TimeSpanStats
@@ -818,6 +1660,8 @@ class TimeSpanStats(object):
         self.formatter   = formatter
         self.converter   = converter
         self.option_dict = option_dict
+        # The StatsTypeHelpers handed out so far, keyed by stats type:
+        self._type_helpers = {}
         
     # Iterate over days in the time period:
     @property
@@ -863,8 +1707,12 @@ class TimeSpanStats(object):
         if stats_type == 'has_key':
             raise AttributeError
 
-        # Return the helper class, bound to the type:
-        return StatsTypeHelper(stats_type, self.timespan, self.db, self.context, self.formatter, self.converter, **self.option_dict)
+        # Return the helper class, bound to the type. Hang on to it, so any
+        # aggregates it prefetches can be used by later tags.
+        if stats_type not in self._type_helpers:
+            self._type_helpers[stats_type] = StatsTypeHelper(stats_type, self.timespan, self.db, self.context,
+                                                             self.formatter, self.converter, **self.option_dict)
+        return self._type_helpers[stats_type]
         
 #===============================================================================
 #                    Class StatsTypeHelper
@@ -911,6 +1759,9 @@ class StatsTypeHelper(object):
         self.formatter   = formatter
         self.converter   = converter
         self.option_dict = option_dict
+        # The aggregates prefetched through getAggregates(). None until
+        # the first aggregate is requested.
+        self._aggregates = None
     
     def max_ge(self, val):
         result = self.db.getAggregate(self.timespan, self.stats_type, 'max_ge', val)
@@ -945,11 +1796,31 @@ class StatsTypeHelper(object):
         if aggregateType == 'exists':
             return self.stats_type in self.db.statsTypes
         elif aggregateType == 'has_data':
-            return self.stats_type in self.db.statsTypes and self.db.getAggregate(self.timespan, self.stats_type, 'count')[0] != 0
+            return self.stats_type in self.db.statsTypes and self._getAggregate('count')[0] != 0
         elif self.stats_type in ['heatdeg', 'cooldeg']:
             # Heating and cooling degree days use a different entry point into Stats:
             result = get_heat_cool(self.db, self.timespan, self.stats_type, aggregateType, self.option_dict['heatbase'], self.option_dict['coolbase'])
         else:
-            result = self.db.getAggregate(self.timespan, self.stats_type, aggregateType)
+            result = self._getAggregate(aggregateType)
         # Wrap the result in a ValueHelper:
         return weewx.units.ValueHelper(result, self.context, self.formatter, self.converter)
+
+    def _getAggregate(self, aggregateType):
+        """Return an aggregate as a value tuple. The first time an aggregate
+        that can be calculated by a scan is requested, all such aggregates for
+        my type and timespan that are calculated from the same rows are
+        fetched at once."""
+        if aggregateType in scanDict:
+            if self._aggregates is None:
+                self._aggregates = {}
+            if aggregateType not in self._aggregates:
+                # Aggregates that can use the rollups are calculated from
+                # different rows than the rest, so fetch them separately.
+                _is_vector = self.db.schema.get(self.stats_type) == 'VECTOR'
+                _use_rollups = aggregateType in rollup_aggregates
+                _group = [_agg for _agg in scanDict if (_agg in rollup_aggregates) == _use_rollups
+                          and (_is_vector or _agg not in vector_aggregates)]
+                self._aggregates.update(self.db.getAggregates(self.timespan, self.stats_type, _group))
+            if aggregateType in self._aggregates:
+                return self._aggregates[aggregateType]
+        return self.db.getAggregate(self.timespan, self.stats_type, aggregateType)
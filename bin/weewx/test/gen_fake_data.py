@@ -83,6 +83,7 @@ def configDatabases(archive_db_dict, stats_db_dict):
             pass
         # Now create and configure a new one:
         with weewx.stats.StatsDb.open_with_create(stats_db_dict, user.schemas.defaultStatsSchema) as stats:
+            stats.setDegreeDayBases((65.0, 'degree_F'), (65.0, 'degree_F'))
             t1 = time.time()
             # Now backfill the stats database from the main archive database.
             nrecs = stats.backfillFrom(archive)
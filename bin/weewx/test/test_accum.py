@@ -11,6 +11,8 @@
 import time
 import unittest
 
+import weeutil.weeutil
+import weewx
 import weewx.accum
 from gen_fake_data import genFakeRecords
 
@@ -69,6 +71,47 @@ class AccumTest(unittest.TestCase):
         self.assertEqual(ss.sum, 2*tsum)
         self.assertEqual(ss.count, 2*tcount)
         
+    def test_dirty(self):
+        
+        # A new accumulator has not been saved yet, so it starts out dirty:
+        ss = weewx.accum.ScalarStats()
+        self.assertTrue(ss.dirty)
+        
+        # One initialized from a stats-tuple starts out clean:
+        ss = weewx.accum.ScalarStats((10.0, start_ts, 20.0, start_ts, 30.0, 2))
+        self.assertFalse(ss.dirty)
+        
+        # Values that do not change the stats-tuple leave it clean:
+        ss.addHiLo(None, stop_ts)
+        ss.addSum(None)
+        ss.addHiLo(15.0, stop_ts)
+        self.assertFalse(ss.dirty)
+        ss.mergeHiLo(weewx.accum.ScalarStats((12.0, start_ts, 18.0, start_ts, 30.0, 2)))
+        ss.mergeSum(weewx.accum.ScalarStats())
+        self.assertFalse(ss.dirty)
+
+        # A new high changes it:
+        ss.addHiLo(25.0, stop_ts)
+        self.assertTrue(ss.dirty)
+        
+        vs = weewx.accum.VecStats((1.0, start_ts, 5.0, start_ts, 6.0, 2, 90.0, 0.0, 6.0, 26.0, 2))
+        self.assertFalse(vs.dirty)
+        vs.addHiLo((None, None), stop_ts)
+        self.assertFalse(vs.dirty)
+        vs.addSum((3.0, 270.0))
+        self.assertTrue(vs.dirty)
+        
+        # Check the accumulator as a whole:
+        accum = weewx.accum.WXAccum(weeutil.weeutil.TimeSpan(start_ts, stop_ts))
+        # The first record is not in the accumulator's timespan, so skip it:
+        for record in self.dataset[1:]:
+            accum.addRecord(record)
+        self.assertTrue('outTemp' in accum.getDirtyTypes())
+        accum.clearDirty()
+        self.assertEqual(accum.getDirtyTypes(), [])
+        accum.addRecord({'dateTime' : stop_ts, 'usUnits' : weewx.US, 'outTemp' : 1000.0, 'barometer' : None})
+        self.assertEqual(accum.getDirtyTypes(), ['outTemp'])
+        
 if __name__ == '__main__':
     unittest.main()
             
\ No newline at end of file
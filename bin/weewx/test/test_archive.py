@@ -10,15 +10,22 @@
 #
 """Test archive and stats database modules"""
 from __future__ import with_statement
+import math
+import random
+import shutil
+import tempfile
 import unittest
 import time
 
 import weewx.archive
+import weewx.vectorcache
 import weedb
 import weeutil.weeutil
 
 archive_sqlite = {'database': '/tmp/weedb.sdb', 'driver':'weedb.sqlite'}
 archive_mysql  = {'database': 'test_weedb', 'user':'weewx', 'password':'weewx', 'driver':'weedb.mysql'}
+scratch_sqlite = {'database': '/tmp/weedb_scratch.sdb', 'driver':'weedb.sqlite'}
+scratch_mysql  = {'database': 'test_weedb_scratch', 'user':'weewx', 'password':'weewx', 'driver':'weedb.mysql'}
 
 archive_schema = [('dateTime',             'INTEGER NOT NULL UNIQUE PRIMARY KEY'),
                   ('usUnits',              'INTEGER NOT NULL'),
@@ -28,6 +35,14 @@ archive_schema = [('dateTime',             'INTEGER NOT NULL UNIQUE PRIMARY KEY'
                   ('outTemp',              'REAL'),
                   ('windSpeed',            'REAL')]
 
+wind_schema = [('dateTime',             'INTEGER NOT NULL UNIQUE PRIMARY KEY'),
+               ('usUnits',              'INTEGER NOT NULL'),
+               ('interval',             'INTEGER NOT NULL'),
+               ('windSpeed',            'REAL'),
+               ('windDir',              'REAL'),
+               ('windGust',             'REAL'),
+               ('windGustDir',          'REAL')]
+
 std_unit_system = 1
 interval = 3600     # One hour
 nrecs = 48          # Two days
@@ -60,6 +75,18 @@ def genRecords():
         _record = expected_record(irec)
         yield _record
 
+def windfunc(i):
+    # Every fifth record is calm, with no direction
+    if i % 5 == 0:
+        return (0.0, None)
+    return (1.0 + 0.5*(i % 7), (37.0*i) % 360.0)
+
+def genWindRecords():
+    for irec in range(nrecs):
+        (speed, direction) = windfunc(irec)
+        yield {'dateTime': timefunc(irec), 'interval': interval, 'usUnits' : 1,
+               'windSpeed' : speed, 'windDir' : direction}
+
 #for rec in genRecords():
 #    print weeutil.weeutil.timestamp_to_string(rec['dateTime']), rec
 #time.sleep(0.5)
@@ -67,16 +94,18 @@ def genRecords():
 class Common(unittest.TestCase):
     
     def setUp(self):
-        try:
-            weedb.drop(self.archive_db_dict)
-        except:
-            pass
+        for db_dict in (self.archive_db_dict, self.scratch_db_dict):
+            try:
+                weedb.drop(db_dict)
+            except:
+                pass
 
     def tearDown(self):
-        try:
-            weedb.drop(self.archive_db_dict)
-        except:
-            pass
+        for db_dict in (self.archive_db_dict, self.scratch_db_dict):
+            try:
+                weedb.drop(db_dict)
+            except:
+                pass
         
     def test_no_archive(self):
         # Attempt to open a non-existent database results in an exception:
@@ -132,10 +161,339 @@ class Common(unittest.TestCase):
             existing_record = {'dateTime': start_ts, 'interval': interval, 'usUnits' : 1, 'outTemp': 68.0}
             archive.addRecord(existing_record)
             
+            # Test adding a batch that includes an existing record, as well as
+            # records with different types. Only the new records should get added:
+            new_records = [{'dateTime': stop_ts + interval, 'interval': interval, 'usUnits' : 1, 'outTemp': 70.0},
+                           existing_record,
+                           {'dateTime': stop_ts + 2*interval, 'interval': interval, 'usUnits' : 1, 'outTemp': 71.0},
+                           {'dateTime': stop_ts + 3*interval, 'interval': interval, 'usUnits' : 1, 'inTemp': 72.0}]
+            archive.addRecord(new_records, chunk_size=2)
+            self.assertEqual(archive.lastGoodStamp(), stop_ts + 3*interval)
+            self.assertEqual(archive.getRecord(start_ts)['outTemp'], temperfunc(0))
+            self.assertEqual(archive.getRecord(stop_ts + interval)['outTemp'], 70.0)
+            self.assertEqual(archive.getRecord(stop_ts + 2*interval)['outTemp'], 71.0)
+            self.assertEqual(archive.getRecord(stop_ts + 3*interval)['inTemp'], 72.0)
+            
             # Test changing the unit system. It should raise a ValueError exception:
-            metric_record = {'dateTime': stop_ts + interval, 'interval': interval, 'usUnits' : 16, 'outTemp': 20.0}
+            metric_record = {'dateTime': stop_ts + 4*interval, 'interval': interval, 'usUnits' : 16, 'outTemp': 20.0}
             self.assertRaises(ValueError, archive.addRecord, metric_record)
 
+    def test_record_views(self):
+        with weewx.archive.Archive.open_with_create(self.archive_db_dict, archive_schema) as archive:
+            archive.addRecord(genRecords())
+            
+            # The views must hold the same data as the dictionaries:
+            _nrecs = 0
+            for (_rec, _view) in zip(archive.genBatchRecords(), archive.genBatchViews()):
+                self.assertEqual(_rec, dict(_view))
+                self.assertEqual(sorted(_rec.keys()), sorted(_view.keys()))
+                self.assertEqual(_rec['outTemp'], _view['outTemp'])
+                self.assertEqual(_view.get('foo', 'default'), 'default')
+                self.assertTrue('outTemp' in _view)
+                self.assertFalse('foo' in _view)
+                self.assertRaises(KeyError, _view.__getitem__, 'foo')
+                _nrecs += 1
+            self.assertEqual(_nrecs, nrecs)
+            
+            # All the views should share the same layout:
+            _layouts = set(id(_view.layout) for _view in archive.genBatchViews())
+            self.assertEqual(len(_layouts), 1)
+            
+            # Views should be acceptable to addRecord:
+            with weewx.archive.Archive.open_with_create(self.scratch_db_dict, archive_schema) as scratch:
+                scratch.addRecord(archive.genBatchViews(start_ts, stop_ts))
+                self.assertEqual(scratch.firstGoodStamp(), start_ts + interval)
+                self.assertEqual(scratch.lastGoodStamp(), stop_ts)
+                self.assertEqual(scratch.getRecord(stop_ts), archive.getRecord(stop_ts))
+
+    def test_cached_bounds(self):
+        with weewx.archive.Archive.open_with_create(self.archive_db_dict, archive_schema) as archive:
+            self.assertEqual(archive.lastGoodStamp(), None)
+            archive.addRecord(genRecords())
+            self.assertEqual(archive.firstGoodStamp(), start_ts)
+            self.assertEqual(archive.lastGoodStamp(), stop_ts)
+            
+            # If nothing has changed, the database should not be asked again:
+            _queries = []
+            _getSql = archive.getSql
+            archive.getSql = lambda *args : _queries.append(args) or _getSql(*args)
+            self.assertEqual(archive.lastGoodStamp(), stop_ts)
+            self.assertEqual(_queries, [])
+            
+            # Records added through this object are written through to the
+            # cache:
+            archive.addRecord({'dateTime': stop_ts + interval, 'interval': interval, 'usUnits' : 1, 'outTemp': 70.0})
+            archive.addRecord([{'dateTime': start_ts - interval, 'interval': interval, 'usUnits' : 1, 'outTemp': 70.0}])
+            self.assertEqual(archive.lastGoodStamp(), stop_ts + interval)
+            self.assertEqual(archive.firstGoodStamp(), start_ts - interval)
+            self.assertEqual(_queries, [])
+            
+            # Records added through another object should be seen:
+            with weewx.archive.Archive.open(self.archive_db_dict) as archive2:
+                archive2.addRecord({'dateTime': stop_ts + 2*interval, 'interval': interval, 'usUnits' : 1, 'outTemp': 71.0})
+            self.assertEqual(archive.lastGoodStamp(), stop_ts + 2*interval)
+            
+            # If the database can tell, so should records added outside of weewx:
+            if archive.connection.dataVersion() is not None:
+                _connect = weedb.connect(self.archive_db_dict)
+                with weedb.Transaction(_connect) as _cursor:
+                    _cursor.execute("INSERT INTO archive (dateTime, usUnits, interval) VALUES (?, 1, ?)", (stop_ts + 3*interval, interval))
+                _connect.close()
+                self.assertEqual(archive.lastGoodStamp(), stop_ts + 3*interval)
+
+    def test_nearest_record(self):
+        with weewx.archive.Archive.open_with_create(self.archive_db_dict, archive_schema) as archive:
+            # Records at irregular intervals, with a gap:
+            _times = [start_ts + i*interval + (i % 3)*137 for i in range(nrecs) if not 10 <= i < 15]
+            archive.addRecord([{'dateTime': ts, 'interval': interval, 'usUnits' : 1, 'outTemp': 68.0} for ts in _times])
+            
+            # Compare with the old way of doing it, which sorted the window by
+            # distance:
+            def nearest_by_sorting(target_ts, max_delta):
+                return archive.getSql("SELECT dateTime FROM archive WHERE dateTime>=? AND dateTime<=? "\
+                                      "ORDER BY ABS(dateTime-?) ASC, dateTime ASC LIMIT 1",
+                                      (target_ts - max_delta, target_ts + max_delta, target_ts))
+            
+            for target_ts in range(start_ts - 2*interval, stop_ts + 2*interval, 601):
+                for max_delta in (interval/10, interval/2, interval, 5*interval):
+                    _expected = nearest_by_sorting(target_ts, max_delta)
+                    _rec = archive.getRecord(target_ts, max_delta)
+                    if _expected is None:
+                        self.assertEqual(_rec, None)
+                    else:
+                        self.assertEqual(_rec['dateTime'], _expected[0])
+
+            # An exact match, and a tie, which goes to the earlier record:
+            self.assertEqual(archive.getRecord(_times[4], 60)['dateTime'], _times[4])
+            _mid_ts = (_times[2] + _times[3]) / 2
+            self.assertEqual(_mid_ts - _times[2], _times[3] - _mid_ts)
+            self.assertEqual(archive.getRecord(_mid_ts, interval)['dateTime'], _times[2])
+
+    def test_recent_records(self):
+        with weewx.archive.Archive.open_with_create(self.archive_db_dict, wind_schema) as archive:
+            archive.addRecord(list(genWindRecords())[:40])
+            
+            # Queries that fall within the last 20 records, and some that do
+            # not:
+            def read_all():
+                return [archive.getRecord(timefunc(35)),
+                        archive.getRecord(timefunc(35) + 100),
+                        archive.getRecord(timefunc(35) + 100, 1200),
+                        archive.getRecord(timefunc(nrecs + 5), 3*interval),
+                        archive.getRecord(timefunc(5)),
+                        list(archive.genBatchRecords(timefunc(30))),
+                        list(archive.genBatchRecords(timefunc(25), timefunc(38))),
+                        list(archive.genBatchRecords(timefunc(10), timefunc(30))),
+                        archive.getSqlVectors('windSpeed', timefunc(30), timefunc(nrecs)),
+                        archive.getSqlVectors('windSpeed', timefunc(24), timefunc(nrecs), 3*interval, 'avg'),
+                        archive.getSqlVectors('windSpeed', timefunc(0), timefunc(nrecs), 3*interval, 'max'),
+                        archive.getSqlVectorsExtended('windvec', timefunc(30), timefunc(nrecs)),
+                        archive.getSqlVectorsExtended('windvec', timefunc(24), timefunc(nrecs), 3*interval, 'avg')]
+            
+            expected = read_all()
+            try:
+                archive.cacheRecentRecords(20)
+                self.assertEqual(read_all(), expected)
+                # Make sure the cache actually got used:
+                self.assertEqual(len(archive._getRecentRows(timefunc(20), timefunc(nrecs), True)), 20)
+                self.assertEqual(archive._getRecentRows(timefunc(19), timefunc(nrecs), True), None)
+
+                # Records added through another Archive object should show up:
+                with weewx.archive.Archive.open(self.archive_db_dict) as archive2:
+                    archive2.addRecord(list(genWindRecords())[40:])
+                self.assertEqual(archive.getRecord(timefunc(nrecs-1))['dateTime'], timefunc(nrecs-1))
+                self.assertEqual([_rec['dateTime'] for _rec in archive.genBatchRecords(timefunc(27))],
+                                 timevec[28:])
+                self.assertEqual(archive._getRecentRows(timefunc(27), timefunc(nrecs), True), None)
+                expected_cached = read_all()
+            finally:
+                archive.cacheRecentRecords(0)
+            self.assertEqual(read_all(), expected_cached)
+
+    def test_vector_cache(self):
+        cache_root = tempfile.mkdtemp()
+        try:
+            with weewx.archive.Archive.open_with_create(self.archive_db_dict, wind_schema) as archive:
+                archive.addRecord(list(genWindRecords())[:30])
+
+                def read_all():
+                    return [archive.getSqlVectors('windSpeed', start_ts, stop_ts),
+                            archive.getSqlVectors('windSpeed', timefunc(10), timefunc(20)),
+                            archive.getSqlVectors('windSpeed', start_ts, stop_ts, 3*interval, 'avg'),
+                            archive.getSqlVectorsExtended('windvec', start_ts, stop_ts),
+                            archive.getSqlVectorsExtended('windvec', start_ts, stop_ts, 3*interval, 'max')]
+
+                expected = read_all()
+                archive.vector_cache = weewx.vectorcache.get_cache(archive, cache_root)
+                self.assertEqual(read_all(), expected)
+                self.assertEqual(len(archive.vector_cache._types['windSpeed']), 30)
+
+                # New records get appended, without counting the records in
+                # the archive again:
+                unordered_count = archive.getUnorderedCount()
+                archive.addRecord(list(genWindRecords())[30:])
+                self.assertEqual(archive.getUnorderedCount(), unordered_count)
+                archive.vector_cache, vector_cache = None, archive.vector_cache
+                expected = read_all()
+                archive.vector_cache = vector_cache
+                queries = []
+                def getSql(sql, sqlargs=()):
+                    queries.append(sql)
+                    return weewx.archive.Archive.getSql(archive, sql, sqlargs)
+                archive.getSql = getSql
+                self.assertEqual(read_all(), expected)
+                del archive.getSql
+                self.assertEqual([sql for sql in queries if 'COUNT' in sql], [])
+                self.assertEqual(len(vector_cache._types['windSpeed']), nrecs)
+
+                # A record out of order, and a changed value, are noticed:
+                archive.addRecord({'dateTime': timefunc(5) + 60, 'interval': interval, 'usUnits' : 1,
+                                   'windSpeed' : 42.0, 'windDir' : 90.0})
+                archive.updateValue(timefunc(7), 'windSpeed', 43.0)
+                archive.vector_cache = None
+                expected = read_all()
+                archive.vector_cache = vector_cache
+                self.assertEqual(read_all(), expected)
+                self.assertEqual(len(vector_cache._types['windSpeed']), nrecs + 1)
+
+                # A cache in a new process picks up where this one left off:
+                vector_cache.close()
+                archive.vector_cache = weewx.vectorcache.VectorCache(vector_cache.cache_dir)
+                self.assertEqual(read_all(), expected)
+                archive.vector_cache.close()
+        finally:
+            shutil.rmtree(cache_root)
+
+    def test_rollup(self):
+        # Three days of five minute records, with some missing values:
+        _times = [start_ts + i*300 for i in range(1, 3*288 + 1)]
+        def gen_rollup_records():
+            for (i, ts) in enumerate(_times):
+                (speed, direction) = windfunc(i)
+                yield {'dateTime': ts, 'interval': 5, 'usUnits' : 1,
+                       'windSpeed' : speed if i % 11 else None, 'windDir' : direction,
+                       'windGust' : speed + 2.0, 'windGustDir' : direction}
+
+        with weewx.archive.Archive.open_with_create(self.archive_db_dict, wind_schema) as archive:
+            archive.addRecord(gen_rollup_records())
+            
+            # Queries that line up with hours or days, and one that does not:
+            queries = [(archive.getSqlVectors, 'windSpeed', agg_type, agg_interval, start_ts + offset)
+                       for agg_type in ('avg', 'sum', 'min', 'max', 'count')
+                       for (agg_interval, offset) in ((3600, 0), (10800, 3600), (86400, 0), (7200, 1800))]
+            queries += [(archive.getSqlVectorsExtended, vec_type, agg_type, 3600, start_ts)
+                        for vec_type in ('windvec', 'windgustvec')
+                        for agg_type in ('avg', 'sum', 'min', 'max', 'count')]
+            def read_all():
+                return [func(obs_type, startstamp, _times[-1], agg_interval, agg_type)
+                        for (func, obs_type, agg_type, agg_interval, startstamp) in queries]
+            def assert_same(results, expected):
+                for ((time_t, data_t), (exp_time_t, exp_data_t)) in zip(results, expected):
+                    self.assertEqual(time_t, exp_time_t)
+                    self.assertEqual(data_t[1:], exp_data_t[1:])
+                    self.assertEqual(len(data_t[0]), len(exp_data_t[0]))
+                    for (_val, _exp) in zip(data_t[0], exp_data_t[0]):
+                        if _exp is None:
+                            self.assertEqual(_val, None)
+                        else:
+                            self.assertAlmostEqual(abs(_val - _exp), 0.0)
+
+            expected = read_all()
+            self.assertEqual(archive.retainedFrom(), None)
+            archive.rollUp()
+            self.assertEqual(archive.retainedFrom(), None)
+            self.assertEqual(sorted(_table for _table in archive.connection.tables() if _table != 'archive'),
+                             ['archive_daily', 'archive_hourly'])
+            self.assertEqual(archive.getSql("SELECT COUNT(*) FROM archive_hourly")[0], 3*24)
+            # Only the complete days are rolled up. The last record is at
+            # midnight, so all three are:
+            self.assertEqual(archive.getSql("SELECT COUNT(*) FROM archive_daily")[0], 3)
+            self.assertNotEqual(archive._getTierSpans(['windSpeed_sum'], start_ts, _times[-1], 86400), None)
+            self.assertEqual(archive._getTierSpans(['windSpeed_sum'], start_ts + 1800, _times[-1], 7200), None)
+            assert_same(read_all(), expected)
+            
+            # Rolling up again does nothing:
+            archive.rollUp()
+            self.assertEqual(archive.getSql("SELECT COUNT(*) FROM archive_hourly")[0], 3*24)
+
+            # Keep only a day of records. The aggregates over whole hours and
+            # days are still the same:
+            (raw_time_t, raw_data_t) = archive.getSqlVectors('windSpeed', start_ts, _times[-1])
+            (_, raw_vec_data_t) = archive.getSqlVectorsExtended('windvec', start_ts, _times[-1])
+            hour_avg = archive.getSqlVectorsExtended('windvec', start_ts, start_ts + 3600, 3600, 'avg')[1][0][0]
+            archive.rollUp(retention_days=1)
+            self.assertEqual(archive.firstGoodStamp(), _times[-1] - 86400 + 300)
+            self.assertEqual(archive.retainedFrom(), _times[-1] - 86400 + 300)
+            _results = read_all()
+            for (query, result, exp) in zip(queries, _results, expected):
+                if query[3] != 7200:
+                    assert_same([result], [exp])
+            # The deleted records are stood in for by hourly averages, taken
+            # at the last record of each hour:
+            _hourly = [archive.getSqlVectors('windSpeed', ts - 3600, ts, 3600, 'avg') for ts in
+                       range(start_ts + 3600, archive.retainedFrom(), 3600)]
+            (time_t, data_t) = archive.getSqlVectors('windSpeed', start_ts, _times[-1])
+            self.assertEqual(time_t[0], [_t[0][0][0] for _t in _hourly] + raw_time_t[0][-288:])
+            assert_same([(time_t, data_t)], [(time_t, ([_t[1][0][0] for _t in _hourly] + raw_data_t[0][-288:],)
+                                              + raw_data_t[1:])])
+            (time_t, data_t) = archive.getSqlVectorsExtended('windvec', start_ts, _times[-1])
+            self.assertEqual(len(time_t[0]), 2*24 + 288)
+            self.assertEqual(data_t[0][-288:], raw_vec_data_t[0][-288:])
+            self.assertAlmostEqual(abs(data_t[0][0] - hour_avg), 0.0)
+
+    def test_covering_indexes(self):
+        with weewx.archive.Archive.open_with_create(self.archive_db_dict, wind_schema) as archive:
+            archive.addRecord(genWindRecords())
+
+            def read_all():
+                return [archive.getSqlVectors('windSpeed', start_ts, stop_ts),
+                        archive.getSqlVectors('windSpeed', start_ts, stop_ts, 3*interval, 'avg'),
+                        archive.getSqlVectorsExtended('windvec', start_ts, stop_ts),
+                        archive.getSqlVectorsExtended('windvec', start_ts, stop_ts, 3*interval, 'max')]
+            def explain(sql_str, sqlargs=()):
+                return ' '.join([str(_row[-1]) for _row in
+                                 archive.connection.connection.execute("EXPLAIN QUERY PLAN " + sql_str, sqlargs)])
+
+            expected = read_all()
+            (sql_str, unit_system) = archive._planColumns('windSpeed', start_ts, stop_ts)
+            self.assertEqual(unit_system, None)
+            if archive.connection.dbtype == 'sqlite':
+                self.assertFalse('COVERING INDEX' in explain(sql_str, (start_ts, stop_ts)))
+
+            self.assertEqual(archive.createIndexes(['windSpeed', 'windvec']),
+                             ['archive_idx_usUnits', 'archive_idx_windSpeed', 'archive_idx_windvec'])
+            self.assertEqual(archive.createIndexes(['windSpeed']), [])
+            self.assertRaises(weewx.ViolatedPrecondition, archive.createIndexes, ['usUnits'])
+            self.assertEqual(read_all(), expected)
+            for (sql_columns, index_name) in (('windSpeed', 'archive_idx_windSpeed'),
+                                              ('windSpeed, windDir', 'archive_idx_windvec')):
+                (sql_str, unit_system) = archive._planColumns(sql_columns, start_ts, stop_ts)
+                self.assertEqual(unit_system, 1)
+                self.assertFalse('usUnits' in sql_str)
+                if archive.connection.dbtype == 'sqlite':
+                    self.assertTrue('COVERING INDEX %s' % index_name in explain(sql_str, (start_ts, stop_ts)))
+            # There is no index for the gusts:
+            self.assertEqual(archive._planColumns('windGust', start_ts, stop_ts)[1], None)
+            if archive.connection.dbtype == 'sqlite':
+                self.assertTrue('COVERING INDEX archive_idx_usUnits' in
+                                explain("SELECT MIN(usUnits) FROM archive"))
+                self.assertTrue('COVERING INDEX archive_idx_usUnits' in
+                                explain("SELECT usUnits FROM archive WHERE usUnits > ? AND +dateTime >= ? "
+                                        "AND +dateTime <= ? LIMIT 1", (1, start_ts, stop_ts)))
+
+            # A record in another unit system is noticed, but only within its
+            # time range. It has to be slipped in behind the back of addRecord():
+            archive.connection.execute("INSERT INTO archive (dateTime, `interval`, usUnits, windSpeed, windDir) "
+                                       "VALUES (?, ?, ?, ?, ?)", (stop_ts + interval, interval, 16, 10.0, 90.0))
+            self.assertEqual(archive._getUnitSystem(start_ts, stop_ts), 1)
+            self.assertEqual(archive._getUnitSystem(start_ts, stop_ts + interval), None)
+            self.assertEqual(read_all(), expected)
+
+            self.assertEqual(sorted(archive.dropIndexes()),
+                             ['archive_idx_usUnits', 'archive_idx_windSpeed', 'archive_idx_windvec'])
+            self.assertEqual(archive._planColumns('windSpeed', start_ts, stop_ts)[1], None)
+            self.assertEqual(read_all(), expected)
+
     def test_get_records(self):
         # Add a bunch of records:
         with weewx.archive.Archive.open_with_create(self.archive_db_dict, archive_schema) as archive:
@@ -204,23 +562,130 @@ class Common(unittest.TestCase):
                 # Compare them.
                 self.assertAlmostEqual(expected_avg, barvec[1][0][irec])
 
+    def test_aggregate_vectors(self):
+        with weewx.archive.Archive.open_with_create(self.archive_db_dict, archive_schema) as archive:
+            archive.addRecord(genRecords())
+
+        # The aggregates calculated in a single scan should match what the
+        # database calculates, one aggregation interval at a time:
+        with weewx.archive.Archive.open(self.archive_db_dict) as archive:
+            for agg_type in ('avg', 'sum', 'min', 'max', 'count'):
+                for agg_interval in (3*interval, 7*interval, 24*interval):
+                    expected_time = []
+                    expected_data = []
+                    for span in weeutil.weeutil.intervalgen(start_ts - interval/2, stop_ts, agg_interval):
+                        _row = archive.getSql("SELECT MAX(dateTime), %s(outTemp) FROM archive "
+                                              "WHERE dateTime > ? AND dateTime <= ?" % agg_type, span)
+                        if _row[0] is not None:
+                            expected_time.append(_row[0])
+                            expected_data.append(_row[1])
+                    vec = archive.getSqlVectors('outTemp', start_ts - interval/2, stop_ts,
+                                                aggregate_interval=agg_interval, aggregate_type=agg_type)
+                    self.assertEqual(vec[0][0], expected_time)
+                    self.assertEqual(len(vec[1][0]), len(expected_data))
+                    for (got, expected) in zip(vec[1][0], expected_data):
+                        self.assertAlmostEqual(got, expected)
+                    
+            # Observation types that are always null should still have a
+            # timestamp in each interval:
+            vec = archive.getSqlVectors('windSpeed', start_ts, stop_ts,
+                                        aggregate_interval=6*interval, aggregate_type='max')
+            self.assertEqual(len(vec[0][0]), nrecs/6)
+            self.assertEqual(vec[1][0], [None] * (nrecs/6))
+
+    def test_windvec_aggregates(self):
+        with weewx.archive.Archive.open_with_create(self.archive_db_dict, wind_schema) as archive:
+            archive.addRecord(genWindRecords())
+
+        def as_complex(i):
+            (speed, direction) = windfunc(i)
+            if not speed:
+                return complex(0.0, 0.0)
+            return complex(speed * math.cos(math.radians(90.0 - direction)),
+                           speed * math.sin(math.radians(90.0 - direction)))
+
+        saved_numpy = weewx.archive.numpy
+        # The aggregates, with NumPy and without:
+        results = {True : [], False : []}
+        try:
+            # Try it with NumPy (if installed), then without:
+            for use_numpy in (True, False):
+                if not use_numpy:
+                    weewx.archive.numpy = None
+                with weewx.archive.Archive.open(self.archive_db_dict) as archive:
+                    for agg_type in ('avg', 'sum', 'min', 'max', 'count'):
+                        vec = archive.getSqlVectorsExtended('windvec', start_ts, stop_ts,
+                                                            aggregate_interval=6*interval, aggregate_type=agg_type)
+                        results[use_numpy].append(vec)
+                        self.assertEqual(len(vec[0][0]), nrecs/6)
+                        gen = gen_included_recs(timevec, start_ts, stop_ts, 6*interval)
+                        for (irec, recs) in enumerate(gen):
+                            self.assertEqual(timevec[max(recs)], vec[0][0][irec])
+                            if agg_type == 'count':
+                                expected = len(recs)
+                            elif agg_type in ('min', 'max'):
+                                pick = min if agg_type == 'min' else max
+                                expected = as_complex(pick(recs, key=lambda i: windfunc(i)[0]))
+                            else:
+                                expected = sum((as_complex(i) for i in recs), complex(0.0, 0.0))
+                                if agg_type == 'avg':
+                                    expected /= len(recs)
+                            self.assertAlmostEqual(expected, vec[1][0][irec])
+                    # Missing gust data results in no intervals:
+                    vec = archive.getSqlVectorsExtended('windgustvec', start_ts, stop_ts,
+                                                        aggregate_interval=6*interval, aggregate_type='avg')
+                    self.assertEqual(vec[0][0], [])
+                    self.assertEqual(vec[1][0], [])
+        finally:
+            weewx.archive.numpy = saved_numpy
+        # NumPy gives exactly the same results:
+        self.assertEqual(results[True], results[False])
+
 class TestSqlite(Common):
 
     def __init__(self, *args, **kwargs):
         self.archive_db_dict = archive_sqlite
+        self.scratch_db_dict = scratch_sqlite
         super(TestSqlite, self).__init__(*args, **kwargs)
         
 class TestMySQL(Common):
     
     def __init__(self, *args, **kwargs):
         self.archive_db_dict = archive_mysql
+        self.scratch_db_dict = scratch_mysql
         super(TestMySQL, self).__init__(*args, **kwargs)
         
     
+class TestWindvec(unittest.TestCase):
+
+    def test_numpy(self):
+        if weewx.archive.numpy is None:
+            return
+        random.seed(12)
+        mag_vec = list()
+        dir_vec = list()
+        bounds  = list()
+        for count in [1, 2, 7, 12, 1, 300, 5] * 20:
+            _istart = len(mag_vec)
+            for _ in xrange(count):
+                # Calm, with and without a direction, and ties for the extremes:
+                _mag = random.choice([0.0, 0.0, 5.0, random.uniform(0.0, 30.0)])
+                mag_vec.append(_mag)
+                dir_vec.append(None if _mag == 0.0 and random.random() < 0.5 else random.uniform(0.0, 360.0))
+            bounds.append((_istart, len(mag_vec)))
+        for aggregate_type in ('min', 'max'):
+            expected = weewx.archive._reduce_windvec(mag_vec, dir_vec, bounds, aggregate_type)
+            result = weewx.archive._reduce_windvec_numpy(mag_vec, dir_vec, bounds, aggregate_type)
+            self.assertEqual(len(result), len(bounds))
+            self.assertEqual(result, expected)
+        self.assertEqual(weewx.archive._reduce_windvec_numpy([], [], [], 'min'), [])
+
 def suite():
     tests = ['test_no_archive', 'test_create_archive', 
-             'test_empty_archive', 'test_add_archive_records', 'test_get_records']
-    return unittest.TestSuite(map(TestSqlite, tests) + map(TestMySQL, tests))
+             'test_empty_archive', 'test_add_archive_records', 'test_record_views', 'test_cached_bounds', 'test_nearest_record', 'test_recent_records', 'test_vector_cache', 'test_rollup', 'test_covering_indexes',
+             'test_get_records',
+             'test_aggregate_vectors', 'test_windvec_aggregates']
+    return unittest.TestSuite(map(TestSqlite, tests) + map(TestMySQL, tests) + [TestWindvec('test_numpy')])
             
 if __name__ == '__main__':
     unittest.TextTestRunner(verbosity=2).run(suite())
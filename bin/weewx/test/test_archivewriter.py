@@ -0,0 +1,201 @@
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""Test the archive writer thread"""
+
+from __future__ import with_statement
+import os
+import threading
+import time
+import unittest
+
+import weedb
+import weewx.archive
+import weewx.archivewriter
+
+archive_db_dict = {'database': '/tmp/test_archivewriter.sdb', 'driver':'weedb.sqlite'}
+journal_path = '/tmp/test_archivewriter.journal'
+
+schema = [('dateTime', 'INTEGER NOT NULL UNIQUE PRIMARY KEY'),
+          ('usUnits',  'INTEGER NOT NULL'),
+          ('interval', 'INTEGER NOT NULL'),
+          ('outTemp',  'REAL')]
+
+start_ts = int(time.mktime((2014, 1, 1, 0, 0, 0, 0, 0, -1)))
+
+def make_record(irec):
+    return {'dateTime' : start_ts + irec * 300, 'usUnits' : 1, 'interval' : 5, 'outTemp' : 20.0 + irec}
+
+def open_databases():
+    return (weewx.archive.Archive.open(archive_db_dict),)
+
+class TestArchiveWriter(unittest.TestCase):
+
+    def setUp(self):
+        for _path in (archive_db_dict['database'], journal_path):
+            if os.path.exists(_path):
+                os.remove(_path)
+        weewx.archive.Archive.open_with_create(archive_db_dict, schema).close()
+        # Set to hold up the writer:
+        self.gate = threading.Event()
+        self.gate.set()
+        self.written = []
+        # The timestamp of a record that cannot be written:
+        self.bad_ts = None
+
+    def tearDown(self):
+        try:
+            weedb.drop(archive_db_dict)
+        except weedb.NoDatabase:
+            pass
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+
+    def write_record(self, databases, record):
+        self.gate.wait()
+        if record['dateTime'] == self.bad_ts:
+            raise weedb.OperationalError("database is locked")
+        databases[0].addRecord(record)
+        self.written.append(record['dateTime'])
+
+    def test_order(self):
+        writer = weewx.archivewriter.ArchiveWriter(open_databases, self.write_record, 5, journal_path)
+        writer.start()
+        jobs = []
+        for irec in range(20):
+            writer.addRecord(make_record(irec))
+            if irec % 5 == 0:
+                # Jobs run in turn with the records:
+                writer.addJob(lambda databases, irec: jobs.append((irec, databases[0].lastGoodStamp())), irec)
+        self.assertTrue(writer.waitUntilWritten())
+        self.assertEqual(self.written, [make_record(irec)['dateTime'] for irec in range(20)])
+        self.assertEqual(jobs, [(irec, make_record(irec)['dateTime']) for irec in range(0, 20, 5)])
+        # Everything was written, so the journal is empty:
+        self.assertEqual(os.path.getsize(journal_path), 0)
+        writer.shutDown()
+        self.assertFalse(writer.isAlive())
+        with weewx.archive.Archive.open(archive_db_dict) as archive:
+            self.assertEqual([_rec['outTemp'] for _rec in archive.genBatchRecords()],
+                             [20.0 + irec for irec in range(20)])
+
+    def test_backpressure(self):
+        writer = weewx.archivewriter.ArchiveWriter(open_databases, self.write_record, 2)
+        writer.start()
+        self.gate.clear()
+        # One record is taken by the writer, and two wait in the queue. The
+        # fourth has to wait for room:
+        def add_records():
+            for irec in range(4):
+                writer.addRecord(make_record(irec))
+        _thread = threading.Thread(target=add_records)
+        _thread.start()
+        _thread.join(0.5)
+        self.assertTrue(_thread.isAlive())
+        self.assertEqual(self.written, [])
+        self.assertFalse(writer.waitUntilWritten(make_record(0)['dateTime'], 0.1))
+        self.gate.set()
+        _thread.join(5.0)
+        self.assertFalse(_thread.isAlive())
+        self.assertTrue(writer.waitUntilWritten(timeout=5.0))
+        self.assertEqual(len(self.written), 4)
+        writer.shutDown()
+
+    def test_wait_until_written(self):
+        writer = weewx.archivewriter.ArchiveWriter(open_databases, self.write_record)
+        # With no writers running, there is nothing to wait for:
+        self.assertTrue(weewx.archivewriter.wait_until_written(timeout=0.1))
+        writer.start()
+        self.gate.clear()
+        writer.addRecord(make_record(0))
+        writer.addRecord(make_record(1))
+        self.assertEqual(writer.lastQueuedStamp(), make_record(1)['dateTime'])
+        self.assertFalse(weewx.archivewriter.wait_until_written(make_record(0)['dateTime'], 0.1))
+        # A record before any that are queued does not wait:
+        self.assertTrue(weewx.archivewriter.wait_until_written(make_record(-1)['dateTime'], 0.1))
+        self.gate.set()
+        self.assertTrue(weewx.archivewriter.wait_until_written(make_record(1)['dateTime'], 5.0))
+        self.assertEqual(writer.lastQueuedStamp(), None)
+        writer.shutDown()
+        self.assertTrue(weewx.archivewriter.wait_until_written(timeout=0.1))
+
+    def test_journal(self):
+        writer = weewx.archivewriter.ArchiveWriter(open_databases, self.write_record, 10, journal_path)
+        writer.start()
+        writer.addRecord(make_record(0))
+        self.assertTrue(writer.waitUntilWritten(timeout=5.0))
+        # Hold up the writer, as a locked database would, then stop before the
+        # records get written:
+        self.gate.clear()
+        for irec in range(1, 6):
+            writer.addRecord(make_record(irec))
+        self.assertEqual([_rec['dateTime'] for _rec in weewx.archivewriter.WriteJournal.load(journal_path)],
+                         [make_record(irec)['dateTime'] for irec in range(1, 6)])
+        writer.shutDown(0.1)
+        self.assertTrue(writer.isAlive())
+
+        # A record cut short at the end of the journal is ignored:
+        with open(journal_path, 'ab') as _file:
+            _file.write('\x80\x02}q')
+        with weewx.archive.Archive.open(archive_db_dict) as archive:
+            # The first record is already there, and the one after it may be:
+            self.assertTrue(weewx.archivewriter.replay_journal(journal_path, archive) >= 4)
+            self.assertEqual(os.path.getsize(journal_path), 0)
+            self.assertEqual([_rec['dateTime'] for _rec in archive.genBatchRecords()],
+                             [make_record(irec)['dateTime'] for irec in range(6)])
+        # Let the old writer finish. It only finds records that are already
+        # in the archive:
+        self.gate.set()
+        writer.join(5.0)
+
+    def test_write_error(self):
+        writer = weewx.archivewriter.ArchiveWriter(open_databases, self.write_record, 1, journal_path)
+        writer.start()
+        writer.addRecord(make_record(0))
+        self.assertTrue(writer.waitUntilWritten(timeout=5.0))
+        self.bad_ts = make_record(1)['dateTime']
+        writer.addRecord(make_record(1))
+        writer.join(5.0)
+        self.assertFalse(writer.isAlive())
+        self.assertTrue(isinstance(writer.error, weedb.OperationalError))
+        # The record that failed is not counted as written, and is kept in the
+        # journal:
+        self.assertFalse(writer.waitUntilWritten())
+        self.assertEqual(self.written, [make_record(0)['dateTime']])
+        # More records than fit in the queue are not waited on. They are
+        # added to the journal, then the error is raised:
+        for irec in range(2, 5):
+            self.assertRaises(weedb.OperationalError, writer.addRecord, make_record(irec))
+        self.assertRaises(weedb.OperationalError, writer.addJob, lambda databases: None)
+        writer.shutDown(5.0)
+        self.assertEqual([_rec['dateTime'] for _rec in weewx.archivewriter.WriteJournal.load(journal_path)],
+                         [make_record(irec)['dateTime'] for irec in range(1, 5)])
+        with weewx.archive.Archive.open(archive_db_dict) as archive:
+            self.assertEqual(weewx.archivewriter.replay_journal(journal_path, archive), 4)
+
+    def test_open_error(self):
+        def open_missing():
+            return (weewx.archive.Archive.open({'database': '/tmp/test_archivewriter_missing.sdb',
+                                                'driver':'weedb.sqlite'}),)
+        writer = weewx.archivewriter.ArchiveWriter(open_missing, self.write_record, 1)
+        writer.start()
+        writer.join(5.0)
+        self.assertFalse(writer.isAlive())
+        self.assertTrue(writer.error is not None)
+        self.assertRaises(type(writer.error), writer.addRecord, make_record(0))
+        self.assertRaises(type(writer.error), writer.addRecord, make_record(1))
+        self.assertFalse(weewx.archivewriter.wait_until_written(timeout=None))
+        writer.shutDown(5.0)
+
+def suite():
+    tests = ['test_order', 'test_backpressure', 'test_wait_until_written', 'test_journal',
+             'test_write_error', 'test_open_error']
+    return unittest.TestSuite(map(TestArchiveWriter, tests))
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,86 @@
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""Test the profiling of the engine's callbacks"""
+
+import unittest
+
+import weewx
+import weewx.dispatchprofile
+import weewx.wxengine
+
+class SlowService(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def new_loop_packet(self, event):
+        self.calls += 1
+
+    def check_loop(self, event):
+        raise weewx.wxengine.BreakLoop
+
+def plain_function(event):
+    pass
+
+class TestDispatchProfile(unittest.TestCase):
+
+    def test_summary(self):
+        times = weewx.dispatchprofile.CallbackTimes(20)
+        self.assertEqual(times.summary(), (0, None, None, None))
+        for i in range(1, 41):
+            times.add(float(i))
+        # Only the last 20 calls are in the window, but all are counted:
+        (count, mean, p95, maxval) = times.summary()
+        self.assertEqual(count, 40)
+        self.assertAlmostEqual(mean, 30.5)
+        self.assertEqual(p95, 39.0)
+        self.assertEqual(maxval, 40.0)
+
+    def test_names(self):
+        service = SlowService()
+        self.assertEqual(weewx.dispatchprofile.callback_name(service.new_loop_packet),
+                         '%s.SlowService.new_loop_packet' % __name__)
+        self.assertEqual(weewx.dispatchprofile.callback_name(plain_function), '%s.plain_function' % __name__)
+        self.assertEqual(weewx.dispatchprofile.event_name(weewx.NEW_LOOP_PACKET), 'NEW_LOOP_PACKET')
+
+    def test_dispatch(self):
+        # An engine without a station or services:
+        engine = weewx.wxengine.StdEngine.__new__(weewx.wxengine.StdEngine)
+        engine.callbacks = {}
+        engine.dispatch_table = None
+        engine.profiler = weewx.dispatchprofile.DispatchProfiler(window=10, log_interval=None)
+        service = SlowService()
+        engine.bind(weewx.NEW_LOOP_PACKET, service.new_loop_packet)
+        engine.bind(weewx.NEW_LOOP_PACKET, plain_function)
+        engine.bind(weewx.CHECK_LOOP, service.check_loop)
+        for _ in range(5):
+            engine.dispatchEvent(weewx.Event(weewx.NEW_LOOP_PACKET, packet={}))
+        # Calls that break the loop are timed too:
+        self.assertRaises(weewx.wxengine.BreakLoop, engine.dispatchEvent, weewx.Event(weewx.CHECK_LOOP, packet={}))
+        # Events with no callbacks are not recorded:
+        engine.dispatchEvent(weewx.Event(weewx.POST_LOOP))
+        self.assertEqual(service.calls, 5)
+        rows = engine.profiler.summary()
+        self.assertEqual(sorted((_row[0], _row[1], _row[2]) for _row in rows),
+                         [('CHECK_LOOP', '%s.SlowService.check_loop' % __name__, 1),
+                          ('NEW_LOOP_PACKET', '%s.SlowService.new_loop_packet' % __name__, 5),
+                          ('NEW_LOOP_PACKET', '%s.plain_function' % __name__, 5)])
+        for (_event, _callback, _count, _mean, _p95, _max) in rows:
+            self.assertTrue(0 <= _mean <= _max)
+            self.assertTrue(_p95 <= _max)
+        # Does not raise:
+        engine.profiler.logSummary()
+
+def suite():
+    tests = ['test_summary', 'test_names', 'test_dispatch']
+    return unittest.TestSuite(map(TestDispatchProfile, tests))
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,216 @@
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""Test the dispatching of events by the engine"""
+
+import copy
+import math
+import unittest
+
+import configobj
+
+import weewx
+import weewx.abstractstation
+import weewx.drivers.simulator
+import weewx.units
+import weewx.wxengine
+
+class FakeConsole(weewx.abstractstation.AbstractStation):
+
+    def __init__(self, npackets):
+        self.npackets = npackets
+
+    def genLoopPackets(self):
+        for i in range(self.npackets):
+            yield {'dateTime' : 1400000000 + 2 * i, 'usUnits' : weewx.US, 'outTemp' : 50.0 + i}
+        raise weewx.StopNow("Out of packets")
+
+    def closePort(self):
+        pass
+
+class Converter(object):
+    """Replaces each LOOP packet with a new one, as StdConvert does."""
+
+    def new_loop_packet(self, event):
+        event.packet = dict(event.packet, outTemp=(event.packet['outTemp'] - 32.0) / 1.8)
+
+class Recorder(object):
+
+    def __init__(self):
+        self.loop = []
+        self.check = []
+        self.events = []
+        self.loop_events = []
+        self.check_events = []
+
+    def pre_loop(self, event):
+        self.events.append(event.event_type)
+
+    def new_loop_packet(self, event):
+        self.events.append(event.event_type)
+        self.loop.append(event.packet['outTemp'])
+        self.loop_events.append(event)
+
+    def check_loop(self, event):
+        self.events.append(event.event_type)
+        self.check.append(event.packet['outTemp'])
+        self.check_events.append(event)
+
+def make_engine():
+    """Return an engine without a station or services."""
+    engine = weewx.wxengine.StdEngine.__new__(weewx.wxengine.StdEngine)
+    engine.callbacks = {}
+    engine.dispatch_table = None
+    engine.profiler = None
+    engine.gc_interval = 3 * 3600
+    return engine
+
+class TestEngine(unittest.TestCase):
+
+    def test_dispatch_table(self):
+        engine = make_engine()
+        recorder = Recorder()
+        engine.bind(weewx.NEW_LOOP_PACKET, recorder.new_loop_packet)
+        engine.compileDispatchTable()
+        self.assertEqual(engine.dispatch_table, {weewx.NEW_LOOP_PACKET : (recorder.new_loop_packet,)})
+        # Callbacks bound later are added to the table:
+        engine.bind(weewx.CHECK_LOOP, recorder.check_loop)
+        engine.bind(weewx.NEW_LOOP_PACKET, recorder.check_loop)
+        self.assertEqual(engine.dispatch_table[weewx.NEW_LOOP_PACKET],
+                         (recorder.new_loop_packet, recorder.check_loop))
+        self.assertEqual(engine.dispatch_table[weewx.CHECK_LOOP], (recorder.check_loop,))
+        # Events with no callbacks are ignored:
+        engine.dispatchEvent(weewx.Event(weewx.POST_LOOP))
+        engine.dispatchEvent(weewx.Event(weewx.NEW_LOOP_PACKET, packet={'outTemp' : 1.0}))
+        self.assertEqual(recorder.events, [weewx.NEW_LOOP_PACKET, weewx.NEW_LOOP_PACKET])
+
+    def test_run(self):
+        engine = make_engine()
+        engine.console = FakeConsole(3)
+        recorder = Recorder()
+        engine.bind(weewx.PRE_LOOP, recorder.pre_loop)
+        engine.bind(weewx.NEW_LOOP_PACKET, Converter().new_loop_packet)
+        engine.bind(weewx.NEW_LOOP_PACKET, recorder.new_loop_packet)
+        engine.bind(weewx.CHECK_LOOP, recorder.check_loop)
+        engine.compileDispatchTable()
+        self.assertRaises(weewx.StopNow, engine.run)
+        self.assertEqual(recorder.events, [weewx.PRE_LOOP] + [weewx.NEW_LOOP_PACKET, weewx.CHECK_LOOP] * 3)
+        # Each packet gets converted once, and the CHECK_LOOP event still gets
+        # the packet from the console:
+        self.assertEqual(recorder.loop, [(50.0 + i - 32.0) / 1.8 for i in range(3)])
+        self.assertEqual(recorder.check, [50.0 + i for i in range(3)])
+        # Every packet gets events of its own, so a service can keep them:
+        self.assertEqual([event.packet['outTemp'] for event in recorder.check_events], recorder.check)
+        self.assertEqual(len(set(map(id, recorder.loop_events + recorder.check_events))), 6)
+
+def make_config(target_unit):
+    return configobj.ConfigObj({
+        'StdConvert'   : {'target_unit' : target_unit},
+        'StdCalibrate' : {'Corrections' : {'outTemp' : 'outTemp - 0.2',
+                                           'outHumidity' : 'outHumidity * 1.02',
+                                           'dewpoint' : 'dewpoint + outHumidity / 100.0'}},
+        'StdQC'        : {'MinMax' : {'outTemp' : ['-40', '120', 'degree_F'],
+                                      'barometer' : ['26', '32.5', 'inHg'],
+                                      'outHumidity' : ['0', '100'],
+                                      'windSpeed' : ['0', '10', 'meter_per_second']}}})
+
+def make_packets(unit_system):
+    station = weewx.drivers.simulator.Simulator(mode='generator', loop_interval=300, start_time=1400000000)
+    packets = []
+    for (i, packet) in enumerate(station.genLoopPackets()):
+        if i >= 200:
+            break
+        packet = weewx.units.to_std_system(packet, unit_system)
+        packet['usUnits'] = unit_system
+        # Some missing values, values out of bounds, and types that are
+        # unknown or not numbers:
+        if i % 7 == 0:
+            packet['outTemp'] = None
+        if i % 11 == 0:
+            packet['barometer'] *= 2
+        packet['dewpoint'] = 0.0
+        packet['myType'] = i
+        packet['rain24'] = [i, None]
+        packets.append(packet)
+    return packets
+
+class TestFilter(unittest.TestCase):
+
+    def filter(self, services, config_dict, event):
+        engine = make_engine()
+        for service in services:
+            service(engine, config_dict)
+        engine.dispatchEvent(event)
+        return engine
+
+    def check(self, target_unit, unit_system):
+        config_dict = make_config(target_unit)
+        chain = (weewx.wxengine.StdConvert, weewx.wxengine.StdCalibrate, weewx.wxengine.StdQC)
+        for packet in make_packets(unit_system):
+            events = [weewx.Event(weewx.NEW_LOOP_PACKET, packet=copy.deepcopy(packet)),
+                      weewx.Event(weewx.NEW_ARCHIVE_RECORD, record=copy.deepcopy(packet), origin='hardware'),
+                      weewx.Event(weewx.NEW_ARCHIVE_RECORD, record=copy.deepcopy(packet), origin='software')]
+            for event in events:
+                filtered = copy.deepcopy(event)
+                self.filter(chain, config_dict, event)
+                self.filter([weewx.wxengine.StdFilter], config_dict, filtered)
+                self.assertEqual(getattr(event, 'packet', None), getattr(filtered, 'packet', None))
+                self.assertEqual(getattr(event, 'record', None), getattr(filtered, 'record', None))
+
+    def test_same_units(self):
+        self.check('US', weewx.US)
+
+    def test_convert(self):
+        self.check('METRIC', weewx.US)
+        self.check('US', weewx.METRICWX)
+
+    def test_in_place(self):
+        config_dict = make_config('METRIC')
+        packet = make_packets(weewx.US)[1]
+        original = dict(packet)
+        event = weewx.Event(weewx.NEW_LOOP_PACKET, packet=packet)
+        self.filter([weewx.wxengine.StdFilter], config_dict, event)
+        # A packet that has to be converted is replaced, and left as it was:
+        self.assertEqual(packet, original)
+        self.assertEqual(event.packet['usUnits'], weewx.METRIC)
+        # One already in the target unit system is changed in place:
+        event = weewx.Event(weewx.NEW_LOOP_PACKET, packet=event.packet)
+        metric_packet = event.packet
+        self.filter([weewx.wxengine.StdFilter], config_dict, event)
+        self.assertTrue(event.packet is metric_packet)
+
+    def test_nan(self):
+        for (target_unit, unit_system) in (('US', weewx.US), ('METRIC', weewx.US)):
+            config_dict = make_config(target_unit)
+            chain = (weewx.wxengine.StdConvert, weewx.wxengine.StdCalibrate, weewx.wxengine.StdQC)
+            packet = make_packets(unit_system)[1]
+            for obs_type in ('outTemp', 'outHumidity', 'barometer', 'windSpeed'):
+                packet[obs_type] = float('nan')
+            event = weewx.Event(weewx.NEW_LOOP_PACKET, packet=copy.deepcopy(packet))
+            filtered = weewx.Event(weewx.NEW_LOOP_PACKET, packet=copy.deepcopy(packet))
+            self.filter(chain, config_dict, event)
+            self.filter([weewx.wxengine.StdFilter], config_dict, filtered)
+            self.assertEqual(sorted(event.packet), sorted(filtered.packet))
+            # Types without limits, such as the calibrated dewpoint, keep NaN:
+            for obs_type in event.packet:
+                if isinstance(event.packet[obs_type], float) and math.isnan(event.packet[obs_type]):
+                    self.assertTrue(math.isnan(filtered.packet[obs_type]))
+                else:
+                    self.assertEqual(event.packet[obs_type], filtered.packet[obs_type])
+            # A NaN is not within the limits, so both reject it:
+            for obs_type in ('outTemp', 'outHumidity', 'barometer', 'windSpeed'):
+                self.assertEqual(filtered.packet[obs_type], None)
+
+def suite():
+    tests = ['test_dispatch_table', 'test_run']
+    filter_tests = ['test_same_units', 'test_convert', 'test_in_place', 'test_nan']
+    return unittest.TestSuite(map(TestEngine, tests) + map(TestFilter, filter_tests))
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
@@ -0,0 +1,169 @@
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""Test the RESTful threads"""
+
+from __future__ import with_statement
+import Queue
+import time
+import unittest
+
+import weedb
+import weedb.pool
+import weewx.archive
+import weewx.restful
+import weewx.restx
+
+archive_db_dict = {'database': '/tmp/test_restx.sdb', 'driver':'weedb.sqlite'}
+
+schema = [('dateTime', 'INTEGER NOT NULL UNIQUE PRIMARY KEY'),
+          ('usUnits',  'INTEGER NOT NULL'),
+          ('interval', 'INTEGER NOT NULL'),
+          ('outTemp',  'REAL'),
+          ('rain',     'REAL')]
+
+start_ts = int(time.mktime((2014, 1, 1, 0, 0, 0, 0, 0, -1)))
+
+def make_record(irec):
+    return {'dateTime' : start_ts + irec * 300, 'usUnits' : 1, 'interval' : 5,
+            'outTemp' : 20.0 + irec, 'rain' : 0.01 * irec}
+
+class Recorder(weewx.restx.RESTThread):
+    """Records the connections each record was read with, and what it would
+    have been posted with."""
+
+    def __init__(self, queue, database_dict):
+        super(Recorder, self).__init__(queue, 'Recorder', database_dict, log_success=False)
+        self.read   = []
+        self.posted = []
+        # Called before each record is read:
+        self.before_read = lambda time_ts : None
+
+    def skip_this_post(self, time_ts):
+        self.before_read(time_ts)
+        return False
+
+    def get_record(self, record, archive):
+        if archive is not None:
+            self.read.append((archive.connection, archive.pool, weedb.pool.default_pool.stats()))
+        return super(Recorder, self).get_record(record, archive)
+
+    def process_record(self, record, archive):
+        self.posted.append((archive, weedb.pool.default_pool.stats(), self.get_record(record, archive)))
+
+class TestRESTThread(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            weedb.drop(archive_db_dict)
+        except weedb.NoDatabase:
+            pass
+        with weewx.archive.Archive.open_with_create(archive_db_dict, schema) as _archive:
+            _archive.addRecord([make_record(irec) for irec in range(24)])
+        self.pool_config = (weedb.pool.default_pool.max_size, weedb.pool.default_pool.timeout)
+
+    def tearDown(self):
+        weedb.pool.default_pool.configure(max_size=self.pool_config[0], timeout=self.pool_config[1])
+        weedb.pool.default_pool.closeAll()
+        try:
+            weedb.drop(archive_db_dict)
+        except weedb.NoDatabase:
+            pass
+
+    def test_pool(self):
+        (_in_use, _idle) = weedb.pool.default_pool.stats()
+        _queue = Queue.Queue()
+        for irec in (12, 23):
+            _queue.put(make_record(irec))
+        _queue.put(None)
+        _thread = Recorder(_queue, archive_db_dict)
+        _thread.start()
+        _thread.join(10)
+        self.assertFalse(_thread.isAlive())
+        self.assertEqual(len(_thread.read), 2)
+        for (_connection, _pool, _stats) in _thread.read:
+            # The connection was borrowed from the pool, and is the same one
+            # both times:
+            self.assertTrue(_pool is weedb.pool.default_pool)
+            self.assertTrue(_connection is _thread.read[0][0])
+            self.assertEqual(_stats[0], _in_use + 1)
+        # It is given back before the record is posted:
+        self.assertEqual(len(_thread.posted), 2)
+        for (_archive, _stats, _record) in _thread.posted:
+            self.assertEqual(_archive, None)
+            self.assertEqual(_stats, (_in_use, _idle + 1))
+        # The archive got used:
+        self.assertAlmostEqual(_thread.posted[0][2]['hourRain'], 0.01 * sum(range(1, 13)))
+        self.assertAlmostEqual(_thread.posted[1][2]['hourRain'], 0.01 * sum(range(12, 24)))
+        self.assertEqual(weedb.pool.default_pool.stats(), (_in_use, _idle + 1))
+
+    def test_pool_timeout(self):
+        weedb.pool.default_pool.configure(max_size=1, timeout=0.1)
+        _held = weedb.pool.default_pool.checkout(archive_db_dict)
+        _queue = Queue.Queue()
+        for irec in (12, 23):
+            _queue.put(make_record(irec))
+        _queue.put(None)
+        _thread = Recorder(_queue, archive_db_dict)
+        # Give the connection back before the second record:
+        def before_read(time_ts):
+            if time_ts == make_record(23)['dateTime']:
+                weedb.pool.default_pool.release(_held)
+        _thread.before_read = before_read
+        _thread.start()
+        _thread.join(10)
+        # The first record is skipped, but the thread carries on:
+        self.assertFalse(_thread.isAlive())
+        self.assertEqual([_record['dateTime'] for (_archive, _stats, _record) in _thread.posted],
+                         [make_record(23)['dateTime']])
+
+    def test_pooled_archive(self):
+        (_in_use, _idle) = weedb.pool.default_pool.stats()
+        _archive = weewx.restful.PooledArchive(archive_db_dict)
+        self.assertEqual(_archive.lastGoodStamp(), make_record(23)['dateTime'])
+        self.assertEqual(_archive.getSql("SELECT COUNT(*) FROM archive"), (24,))
+        # Nothing is held between calls:
+        self.assertEqual(weedb.pool.default_pool.stats(), (_in_use, _idle + 1))
+
+    def test_recent_rain(self):
+        _thread = Recorder(Queue.Queue(), archive_db_dict)
+        _record = make_record(23)
+        with weewx.archive.Archive.open(archive_db_dict) as _archive:
+            _expected = _thread.get_record(_record, _archive)
+            self.assertAlmostEqual(_expected['hourRain'], 0.01 * sum(range(12, 24)))
+            self.assertAlmostEqual(_expected['rain24'], 0.01 * sum(range(24)))
+            self.assertAlmostEqual(_expected['dayRain'], 0.01 * sum(range(24)))
+            _queries = []
+            _getSql = _archive.getSql
+            def getSql(sql, sqlargs=()):
+                _queries.append(sql)
+                return _getSql(sql, sqlargs)
+            _archive.getSql = getSql
+            try:
+                # The cache covers the last hour, but not the last day:
+                _archive.cacheRecentRecords(15)
+                _results = [_thread.get_record(_record, _archive)]
+                self.assertEqual(len(_queries), 2)
+                # It covers all of them:
+                _archive.cacheRecentRecords(30)
+                del _queries[:]
+                _results.append(_thread.get_record(_record, _archive))
+                self.assertEqual(_queries, [])
+            finally:
+                _archive.cacheRecentRecords(0)
+        for _result in _results:
+            for _type in ('hourRain', 'rain24', 'dayRain'):
+                self.assertAlmostEqual(_result[_type], _expected[_type])
+
+def suite():
+    tests = ['test_pool', 'test_pool_timeout', 'test_pooled_archive', 'test_recent_rain']
+    return unittest.TestSuite(map(TestRESTThread, tests))
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
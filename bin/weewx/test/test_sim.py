@@ -61,6 +61,7 @@ class Common(unittest.TestCase):
         # Set the database to be used in the configuration dictionary
         self.config_dict['StdArchive']['archive_database'] = self.archive_db
         self.config_dict['StdArchive']['stats_database']   = self.stats_db
+        self.config_dict['StdArchive']['async_write']      = getattr(self, 'async_write', False)
         self.archive_db_dict = self.config_dict['Databases'][self.archive_db]
 
         try:
@@ -119,6 +120,14 @@ class TestSqlite(Common):
         self.stats_db   = "stats_sqlite"
         super(TestSqlite, self).__init__(*args, **kwargs)
         
+class TestSqliteAsync(Common):
+
+    def __init__(self, *args, **kwargs):
+        self.archive_db  = "archive_sqlite_async"
+        self.stats_db    = "stats_sqlite_async"
+        self.async_write = True
+        super(TestSqliteAsync, self).__init__(*args, **kwargs)
+        
 class TestMySQL(Common):
     
     def __init__(self, *args, **kwargs):
@@ -169,7 +178,7 @@ def calc_stats(config_dict, start_ts, stop_ts):
 def suite():
     tests = ['test_archive_data']
 #    return unittest.TestSuite(map(TestSqlite, tests) + map(TestMySQL, tests))
-    return unittest.TestSuite(map(TestSqlite, tests))
+    return unittest.TestSuite(map(TestSqlite, tests) + map(TestSqliteAsync, tests))
 
 if __name__ == '__main__':
     unittest.TextTestRunner(verbosity=2).run(suite())
@@ -20,6 +20,7 @@ import math
 
 import configobj
 
+import weedb
 import weeutil.weeutil
 import weewx.stats
 import gen_fake_data
@@ -253,8 +254,337 @@ class Common(unittest.TestCase):
             self.assertEqual(str(tagStats.year.cooldeg.sum), "1026.2°F-day")
     
 
+    def test_degree_days(self):
+        spans = [weeutil.weeutil.TimeSpan(time.mktime((2010,3,15,0,0,0,0,0,-1)),
+                                          time.mktime((2010,3,16,0,0,0,0,0,-1))),
+                 weeutil.weeutil.TimeSpan(time.mktime((2010,3,01,0,0,0,0,0,-1)),
+                                          time.mktime((2010,4,01,0,0,0,0,0,-1))),
+                 weeutil.weeutil.TimeSpan(time.mktime((2009,12,20,0,0,0,0,0,-1)),
+                                          time.mktime((2011,1,01,0,0,0,0,0,-1)))]
+        def check(stats, heatbase_t, coolbase_t):
+            self.assertEqual(stats.degree_day_bases, (heatbase_t, coolbase_t))
+            for span in spans:
+                for stats_type in weewx.stats.degree_day_types:
+                    for aggregate in ('sum', 'avg'):
+                        # Read from the degree days kept in the database...
+                        stored = weewx.stats.get_heat_cool(stats, span, stats_type, aggregate, heatbase_t, coolbase_t)
+                        # ... then calculate them from the daily temperatures:
+                        stats.degree_day_bases = None
+                        calculated = weewx.stats.get_heat_cool(stats, span, stats_type, aggregate, heatbase_t, coolbase_t)
+                        stats.degree_day_bases = (heatbase_t, coolbase_t)
+                        self.assertAlmostEqual(stored[0], calculated[0], 6)
+                        self.assertEqual(stored[1:], calculated[1:])
 
+        with weewx.archive.Archive.open(self.archive_db_dict) as archive:
+            with weewx.stats.StatsDb.open(self.stats_db_dict) as stats:
+                check(stats, (65.0, 'degree_F'), (65.0, 'degree_F'))
+                # Changing the bases should recalculate the degree days on the next backfill:
+                stats.setDegreeDayBases((18.0, 'degree_C'), (20.0, 'degree_C'))
+                self.assertEqual(stats.backfillFrom(archive), 0)
+                check(stats, (18.0, 'degree_C'), (20.0, 'degree_C'))
+                # Now put the test database back:
+                stats.setDegreeDayBases((65.0, 'degree_F'), (65.0, 'degree_F'))
+                stats.backfillFrom(archive)
+                check(stats, (65.0, 'degree_F'), (65.0, 'degree_F'))
 
+    def test_get_aggregates(self):
+        with weewx.stats.StatsDb.open(self.stats_db_dict) as stats:
+            spans = [weeutil.weeutil.TimeSpan(time.mktime((2010,3,15,0,0,0,0,0,-1)),
+                                              time.mktime((2010,3,16,0,0,0,0,0,-1))),
+                     weeutil.weeutil.TimeSpan(time.mktime((2010,3,01,0,0,0,0,0,-1)),
+                                              time.mktime((2010,4,01,0,0,0,0,0,-1))),
+                     weeutil.weeutil.TimeSpan(time.mktime((2010,1,01,0,0,0,0,0,-1)),
+                                              time.mktime((2011,1,01,0,0,0,0,0,-1))),
+                     # A span with no data:
+                     weeutil.weeutil.TimeSpan(time.mktime((2012,1,01,0,0,0,0,0,-1)),
+                                              time.mktime((2012,2,01,0,0,0,0,0,-1)))]
+            for span in spans:
+                for stats_type in ('outTemp', 'rain', 'wind', 'inHumidity'):
+                    results = stats.getAggregates(span, stats_type)
+                    if stats_type == 'wind':
+                        self.assertEqual(sorted(results.keys()), sorted(weewx.stats.scanDict.keys()))
+                    else:
+                        self.assertFalse('rms' in results)
+                    # The results should be exactly the same as doing them one at a time:
+                    for aggregate in results:
+                        self.assertEqual(results[aggregate], stats.getAggregate(span, stats_type, aggregate),
+                                         "Failing type %s, aggregate %s" % (stats_type, aggregate))
+            
+            # Ask for only some aggregates:
+            results = stats.getAggregates(spans[1], 'outTemp', ['max', 'maxtime'])
+            self.assertEqual(sorted(results.keys()), ['max', 'maxtime'])
+            self.assertEqual(results['maxtime'], stats.getAggregate(spans[1], 'outTemp', 'maxtime'))
+            
+            self.assertRaises(AttributeError, stats.getAggregates, spans[1], 'foo')
+
+    def test_sql_cache(self):
+        with weewx.stats.StatsDb.open(self.stats_db_dict) as stats:
+            month_span = weeutil.weeutil.TimeSpan(time.mktime((2010,3,01,0,0,0,0,0,-1)),
+                                                  time.mktime((2010,4,01,0,0,0,0,0,-1)))
+            day_span = weeutil.weeutil.TimeSpan(time.mktime((2010,3,15,0,0,0,0,0,-1)),
+                                                time.mktime((2010,3,16,0,0,0,0,0,-1)))
+            max_t = stats.getAggregate(month_span, 'outTemp', 'max')
+            stats.getAggregate(day_span, 'outTemp', 'max')
+            # The same statement should be used for both time spans:
+            self.assertEqual(stats._sql_cache.keys(), [('max', 'outTemp')])
+            self.assertEqual(stats._sql_cache[('max', 'outTemp')][1], ('start', 'stop'))
+
+            # Values are bound with full precision, so the day with the highest
+            # temperature should be found by max_ge, but not by max_ge of a
+            # slightly higher value:
+            self.assertEqual(stats.getAggregate(month_span, 'outTemp', 'max_ge', max_t)[0], 1)
+            higher_t = (max_t[0] + 1e-12 * abs(max_t[0]),) + max_t[1:]
+            self.assertEqual(stats.getAggregate(month_span, 'outTemp', 'max_ge', higher_t)[0], 0)
+
+    def test_rollups(self):
+        with weewx.stats.StatsDb.open(self.stats_db_dict) as stats:
+            # The rollups are off, unless turned on:
+            self.assertEqual(stats.rollups, [])
+            stats.setRollups(True)
+            self.assertEqual(stats.rollups, ['month', 'year'])
+            try:
+                self._check_rollups(stats)
+            finally:
+                stats.dropRollups()
+
+    def _check_rollups(self, stats):
+        # Only the ragged edges of a time span should use finer rows...
+        start_ts = int(time.mktime((2009,11,15,0,0,0,0,0,-1)))
+        stop_ts  = int(time.mktime((2011,3,10,0,0,0,0,0,-1)))
+        self.assertEqual([segment[0] for segment in stats._planSegments(start_ts, stop_ts, stats.rollups, stop_ts)],
+                         [None, 'month', 'year', 'month', None])
+        # ... and the periods that have not closed. The last record is
+        # at midnight of 2011-01-01, so December 31st is still open:
+        self.assertEqual(stats._planSegments(start_ts, stop_ts),
+                         [(None, start_ts, int(time.mktime((2009,12,1,0,0,0,0,0,-1)))),
+                          ('month', int(time.mktime((2009,12,1,0,0,0,0,0,-1))), int(time.mktime((2010,12,1,0,0,0,0,0,-1)))),
+                          (None, int(time.mktime((2010,12,1,0,0,0,0,0,-1))), stop_ts)])
+
+        # Rebuilding the rollups should not change anything:
+        self.assertTrue(stats.createRollups() > 0)
+
+        spans = [weeutil.weeutil.TimeSpan(start_ts, stop_ts),
+                 weeutil.weeutil.TimeSpan(time.mktime((2010,3,01,0,0,0,0,0,-1)),
+                                          time.mktime((2010,4,01,0,0,0,0,0,-1))),
+                 weeutil.weeutil.TimeSpan(time.mktime((2010,1,01,0,0,0,0,0,-1)),
+                                          time.mktime((2011,1,01,0,0,0,0,0,-1))),
+                 weeutil.weeutil.TimeSpan(time.mktime((2009,12,20,0,0,0,0,0,-1)),
+                                          time.mktime((2010,6,10,12,0,0,0,0,-1)))]
+        for span in spans:
+            for stats_type in ('outTemp', 'rain', 'wind'):
+                for aggregate in weewx.stats.rollup_aggregates:
+                    if stats_type != 'wind' and aggregate in weewx.stats.vector_aggregates:
+                        continue
+                    stats.aggregate_cache.clear()
+                    stats.rollups = ['month', 'year']
+                    from_rollups = stats.getAggregate(span, stats_type, aggregate)
+                    # Now calculate it from the daily rows:
+                    stats.aggregate_cache.clear()
+                    stats.rollups = []
+                    from_days = stats.getAggregate(span, stats_type, aggregate)
+                    msg = "Failing type %s, aggregate %s" % (stats_type, aggregate)
+                    if aggregate in ('sum', 'avg', 'rms', 'vecavg', 'vecdir'):
+                        # These are sums, which may be added in a different order:
+                        self.assertAlmostEqual(from_rollups[0], from_days[0], 6, msg)
+                    else:
+                        self.assertEqual(from_rollups, from_days, msg)
+
+    def test_parallel_backfill(self):
+        scratch_db_dict = self.stats_db_dict.dict()
+        scratch_db_dict['database'] = scratch_db_dict['database'].replace('test_stats', 'test_scratch_stats')
+        try:
+            weedb.drop(scratch_db_dict)
+        except weedb.NoDatabase:
+            pass
+
+        with weewx.archive.Archive.open(self.archive_db_dict) as archive:
+            with weewx.stats.StatsDb.open_with_create(scratch_db_dict, user.schemas.defaultStatsSchema) as stats:
+                stats.setDegreeDayBases((65.0, 'degree_F'), (65.0, 'degree_F'))
+                # Stop part way through a day, as if the backfill had been interrupted...
+                stop_ts = int(time.mktime((2010,6,15,12,0,0,0,0,-1)))
+                nrecs = stats.backfillFrom(archive, stop_ts=stop_ts, processes=2, chunk_days=20)
+                self.assertEqual(stats._getLastUpdate(), stop_ts)
+                # ... then resume it:
+                nrecs += stats.backfillFrom(archive, processes=2, chunk_days=45)
+                self.assertEqual(nrecs, len(list(archive.genBatchRows())))
+
+        # The results should be identical to a backfill done one record at a time:
+        with weewx.stats.StatsDb.open(self.stats_db_dict) as serial_stats:
+            with weewx.stats.StatsDb.open(scratch_db_dict) as stats:
+                self.assertEqual(stats._getLastUpdate(), serial_stats._getLastUpdate())
+                tables = serial_stats.connection.tables()
+                self.assertEqual(sorted(stats.connection.tables()), sorted(tables))
+                for table in tables:
+                    if table in ('metadata', '_stats_schema'):
+                        continue
+                    sql = "SELECT * FROM %s ORDER BY dateTime" % table
+                    rows = list(stats.connection.cursor().execute(sql))
+                    serial_rows = list(serial_stats.connection.cursor().execute(sql))
+                    if table.endswith('_year'):
+                        # The serial backfill merges each day into the year,
+                        # so its sums may be added in a different order:
+                        self.assertRowsAlmostEqual(rows, serial_rows, "Table %s differs" % table)
+                    else:
+                        self.assertEqual(rows, serial_rows, "Table %s differs" % table)
+
+        weedb.drop(scratch_db_dict)
+
+    def assertRowsAlmostEqual(self, rows1, rows2, msg):
+        self.assertEqual(len(rows1), len(rows2), msg)
+        for (row1, row2) in zip(rows1, rows2):
+            self.assertEqual(len(row1), len(row2), msg)
+            for (val1, val2) in zip(row1, row2):
+                if isinstance(val1, float) and isinstance(val2, float):
+                    self.assertAlmostEqual(val1, val2, 6, msg)
+                else:
+                    self.assertEqual(val1, val2, msg)
+
+    def test_rollups_day_close(self):
+        # The rollups of a database updated one record at a time, across the
+        # end of a month and a year. They should be the same as when they are
+        # calculated from the daily rows:
+        scratch_db_dict = self.stats_db_dict.dict()
+        scratch_db_dict['database'] = scratch_db_dict['database'].replace('test_stats', 'test_scratch_stats')
+        try:
+            weedb.drop(scratch_db_dict)
+        except weedb.NoDatabase:
+            pass
+
+        start_ts = int(time.mktime((2009,12,29,0,0,0,0,0,-1)))
+        with weewx.stats.StatsDb.open_with_create(scratch_db_dict, [('outTemp', 'REAL'), ('wind', 'VECTOR')]) as stats:
+            stats.setRollups(True)
+            stats.setDegreeDayBases((65.0, 'degree_F'), (65.0, 'degree_F'))
+            stats.backfillFrom(weewx.archive.Archive.open(self.archive_db_dict), stop_ts=start_ts)
+            # Count the rollup rows calculated for each record:
+            updates = []
+            _updateRollup = stats._updateRollup
+            def updateRollup(*args):
+                updates[-1] += 1
+                return _updateRollup(*args)
+            stats._updateRollup = updateRollup
+            for i in range(1, 5 * 48):
+                angle = 2.0 * math.pi * i / 37.0
+                updates.append(0)
+                stats.addRecord({'dateTime' : start_ts + 1800 * i, 'usUnits' : weewx.US, 'interval' : 30,
+                                 'outTemp' : 60.0 + 20.0 * math.sin(angle) - 0.1 * i,
+                                 'windSpeed' : 5.0 + 5.0 * math.cos(angle), 'windDir' : (i * 47) % 360,
+                                 'windGust' : 10.0 + 5.0 * math.cos(angle), 'windGustDir' : (i * 53) % 360})
+            # The rollups are calculated only by the first record of a day,
+            # which closes the day before it. That is a month and a year row
+            # for each of the four types. The very first record has no day
+            # before it:
+            self.assertEqual([updates[i] for i in range(0, len(updates), 48)], [0, 8, 8, 8, 8])
+            self.assertEqual(sum(updates), 8 * 4)
+            tables = [weewx.stats._rollup_table(stats_type, period) for stats_type in ('outTemp', 'wind', 'heatdeg', 'cooldeg')
+                      for period in weewx.stats.rollup_periods]
+            sql = "SELECT * FROM %s ORDER BY dateTime"
+            updated = dict((table, list(stats.connection.cursor().execute(sql % table))) for table in tables)
+            stats.createRollups()
+            for table in tables:
+                self.assertEqual(updated[table], list(stats.connection.cursor().execute(sql % table)),
+                                 "Table %s differs" % table)
+            # The open day is not in the rollups:
+            jan_ts = int(time.mktime((2010,1,1,0,0,0,0,0,-1)))
+            (month_count,) = stats.connection.cursor().execute("SELECT count FROM outTemp_month WHERE dateTime = ?",
+                                                               (jan_ts,)).fetchone()
+            self.assertEqual(month_count, 48)
+
+            # Turning them off drops them:
+            stats.setRollups(False)
+            self.assertEqual(stats.rollups, [])
+            for table in tables:
+                self.assertFalse(table in stats.connection.tables())
+
+        weedb.drop(scratch_db_dict)
+
+    def test_day_cache(self):
+        # Use a scratch database, so the test database is not disturbed:
+        scratch_db_dict = self.stats_db_dict.dict()
+        scratch_db_dict['database'] = scratch_db_dict['database'].replace('test_stats', 'test_scratch_stats')
+        try:
+            weedb.drop(scratch_db_dict)
+        except weedb.NoDatabase:
+            pass
+
+        sod_ts = int(time.mktime((2010,3,15,0,0,0,0,0,-1)))
+        def make_record(i, outTemp):
+            return {'dateTime' : sod_ts + 300*i, 'usUnits' : weewx.US, 'interval' : 5, 'outTemp' : outTemp}
+
+        with weewx.stats.StatsDb.open_with_create(scratch_db_dict, [('outTemp', 'REAL'), ('wind', 'VECTOR')]) as stats:
+            stats.addRecord(make_record(1, 10.0))
+            stats.addRecord(make_record(2, 20.0))
+            # The day's statistics should now be held in memory:
+            self.assertEqual(stats._cached_day_stats.timespan.start, sod_ts)
+            self.assertEqual(stats._cached_day_stats['outTemp'].count, 2)
+
+            # Now have another writer update the same day...
+            with weewx.stats.StatsDb.open(scratch_db_dict) as other_stats:
+                other_stats.addRecord(make_record(3, 5.0))
+            # ... which should be detected by the first writer:
+            stats.addRecord(make_record(4, 30.0))
+
+        with weewx.stats.StatsDb.open(scratch_db_dict) as stats:
+            day_stats = stats._getDayStats(sod_ts)
+            self.assertEqual(day_stats['outTemp'].count, 4)
+            self.assertEqual(day_stats['outTemp'].min, 5.0)
+            self.assertEqual(day_stats['outTemp'].max, 30.0)
+            self.assertEqual(day_stats['outTemp'].sum, 65.0)
+
+            # A record from the next day should start a new accumulator:
+            stats.addRecord(make_record(24*12 + 1, 15.0))
+            self.assertEqual(stats._cached_day_stats.timespan.start, sod_ts + 24*3600)
+            self.assertEqual(stats._cached_day_stats['outTemp'].count, 1)
+            
+        weedb.drop(scratch_db_dict)
+
+    def test_aggregate_cache(self):
+        # First, the cache itself. It should evict the least recently used entry:
+        cache = weewx.stats.AggregateCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+        scratch_db_dict = self.stats_db_dict.dict()
+        scratch_db_dict['database'] = scratch_db_dict['database'].replace('test_stats', 'test_scratch_stats')
+        try:
+            weedb.drop(scratch_db_dict)
+        except weedb.NoDatabase:
+            pass
+
+        sod_ts = int(time.mktime((2010,3,15,0,0,0,0,0,-1)))
+        day_span = weeutil.weeutil.archiveDaySpan(sod_ts, 0)
+        def make_record(i, outTemp):
+            return {'dateTime' : sod_ts + 300*i, 'usUnits' : weewx.US, 'interval' : 5, 'outTemp' : outTemp}
+
+        with weewx.stats.StatsDb.open_with_create(scratch_db_dict, [('outTemp', 'REAL'), ('wind', 'VECTOR')]) as stats:
+            stats.addRecord(make_record(1, 10.0))
+            self.assertEqual(stats.getAggregate(day_span, 'outTemp', 'max')[0], 10.0)
+            # Asking again should be answered from the cache:
+            hits = stats.aggregate_cache.hits
+            self.assertEqual(stats.getAggregate(day_span, 'outTemp', 'max')[0], 10.0)
+            self.assertEqual(stats.aggregate_cache.hits, hits + 1)
+            # Adding a record should invalidate the cache:
+            stats.addRecord(make_record(2, 20.0))
+            self.assertEqual(len(stats.aggregate_cache), 0)
+            self.assertEqual(stats.getAggregate(day_span, 'outTemp', 'max')[0], 20.0)
+            # getAggregates() shares the cache with getAggregate():
+            results = stats.getAggregates(day_span, 'outTemp')
+            self.assertEqual(results['max'][0], 20.0)
+            hits = stats.aggregate_cache.hits
+            self.assertEqual(stats.getAggregate(day_span, 'outTemp', 'min')[0], 10.0)
+            self.assertEqual(stats.aggregate_cache.hits, hits + 1)
+            # So does updating the highs and lows:
+            accum = weewx.accum.WXAccum(weeutil.weeutil.TimeSpan(sod_ts + 600, sod_ts + 900))
+            accum.addRecord(make_record(3, 30.0))
+            stats.updateHiLo(accum)
+            self.assertEqual(stats.getAggregates(day_span, 'outTemp', ['max'])['max'][0], 30.0)
+
+        weedb.drop(scratch_db_dict)
 
 class TestSqlite(Common):
 
@@ -273,7 +603,7 @@ class TestMySQL(Common):
     
 def suite():
     tests = ['test_create_stats', 'testScalarTally', 'testWindTally', 
-             'testTags', 'test_rainYear', 'test_heatcool']
+             'testTags', 'test_rainYear', 'test_heatcool', 'test_degree_days', 'test_get_aggregates', 'test_sql_cache', 'test_rollups', 'test_rollups_day_close', 'test_parallel_backfill', 'test_day_cache', 'test_aggregate_cache']
     return unittest.TestSuite(map(TestSqlite, tests) + map(TestMySQL, tests))
 
 if __name__ == '__main__':
@@ -10,6 +10,7 @@
 #
 """Test module weewx.units"""
 
+import array
 import unittest
 import operator
 
@@ -64,6 +65,48 @@ class ConverterTest(unittest.TestCase):
         # Do a formatted comparison to compensate for small rounding errors: 
         self.assertEqual(("%.2f" % converted[0],)+converted[1:3], ("1013.25", "mbar", "group_pressure"))
         
+    def testConvertVector(self):
+        vec = [-40.0, None, 0.0, 12.5, 1013.25, None, 123456.7]
+        saved_numpy = weewx.units.numpy
+        try:
+            for use_numpy in (True, False):
+                if not use_numpy:
+                    weewx.units.numpy = None
+                for from_unit in weewx.units.conversionDict:
+                    for to_unit in weewx.units.conversionDict[from_unit]:
+                        func = weewx.units.conversionDict[from_unit][to_unit]
+                        conversion = weewx.units.compile_conversion(from_unit, to_unit)
+                        # All the standard conversions compile:
+                        self.assertTrue(conversion.coefficients is not None)
+                        # They give the same results as the conversion function:
+                        expected = [func(x) if x is not None else None for x in vec]
+                        self.assertEqual(weewx.units.convert_vector(vec, from_unit, to_unit), expected)
+                        self.assertEqual(weewx.units.convert((vec, from_unit, None), to_unit)[0], expected)
+                        # Missing values are NaN in arrays of doubles:
+                        nan_vec = array.array('d', [x if x is not None else float('nan') for x in vec])
+                        converted = conversion.convert_vector(nan_vec)
+                        self.assertTrue(isinstance(converted, array.array))
+                        self.assertEqual([x for x in converted if x == x], [x for x in expected if x is not None])
+                        if use_numpy and saved_numpy is not None:
+                            converted = conversion.convert_vector(saved_numpy.array(nan_vec))
+                            self.assertEqual([x for x in converted.tolist() if x == x],
+                                             [x for x in expected if x is not None])
+        finally:
+            weewx.units.numpy = saved_numpy
+
+        # A conversion that is not a multiplication, or in the table, calls its
+        # function:
+        weewx.units.conversionDict['foo'] = {'foo_squared' : lambda x : x * x}
+        try:
+            conversion = weewx.units.compile_conversion('foo', 'foo_squared')
+            self.assertEqual(conversion.coefficients, None)
+            self.assertEqual(conversion.convert_vector([2.0, None, 3.0]), [4.0, None, 9.0])
+            self.assertEqual(conversion(3.0), 9.0)
+        finally:
+            del weewx.units.conversionDict['foo']
+            del weewx.units._compiled_conversions[('foo', 'foo_squared')]
+        self.assertRaises(KeyError, weewx.units.convert_vector, [1.0], 'foo', 'foo_squared')
+
     def testConvertDict(self):
         d_m =  {'outTemp'   : 20.01,
                 'barometer' : 1002.3,
@@ -8,10 +8,18 @@
 #
 """Data structures and functions for dealing with units."""
 
+import array
 import locale
 import time
 import syslog
 
+# If the user has installed NumPy, use it to convert NumPy arrays, and arrays
+# of doubles. Otherwise, fall back to pure Python:
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 import weewx
 import weeutil.weeutil
 
@@ -987,23 +995,183 @@ def convert(val_t, target_unit_type):
     if val_t[1] == target_unit_type:
         return val_t
 
-    # Retrieve the conversion function. An exception of type KeyError
-    # will occur if the target or source units are invalid
-    try:
-        conversion_func = conversionDict[val_t[1]][target_unit_type]
-    except KeyError:
-        if weewx.debug:
-            syslog.syslog(syslog.LOG_DEBUG, "units: Unable to convert from %s to %s" %(val_t[1], target_unit_type))
-        raise
+    # Retrieve the conversion. An exception of type KeyError will occur if
+    # the target or source units are invalid
+    conversion = compile_conversion(val_t[1], target_unit_type)
     # Try converting a sequence first. A TypeError exception will occur if
     # the value is actually a scalar:
     try:
-        new_val = map(lambda x : conversion_func(x) if x is not None else None, val_t[0])
+        iter(val_t[0])
     except TypeError:
-        new_val = conversion_func(val_t[0]) if val_t[0] is not None else None
+        new_val = conversion.func(val_t[0]) if val_t[0] is not None else None
+    else:
+        new_val = conversion.convert_vector(val_t[0])
     # Add on the unit type and the group type and return the results:
     return ValueTuple(new_val, target_unit_type, val_t[2])
 
+class UnitConversion(object):
+    """A conversion from one unit type to another, compiled from
+    conversionDict. See compile_conversion().
+
+    A conversion that is a multiplication, or one of the others listed in
+    conversionCoefficients, is done with its coefficients, which converts a
+    whole vector in one list comprehension or a few NumPy operations, without
+    calling the conversion function for each value. It gives the same results
+    as the function. Any other conversion is done by calling the function,
+    and coefficients is None."""
+
+    def __init__(self, from_unit, to_unit, func):
+        self.from_unit    = from_unit
+        self.to_unit      = to_unit
+        self.func         = func
+        self.coefficients = _conversion_coefficients(from_unit, to_unit, func)
+        if self.coefficients is not None:
+            (self._convert_list, self._convert_floats, self._convert_numpy) = _linear_converters(*self.coefficients)
+        else:
+            self._convert_list   = lambda vec : [func(x) if x is not None else None for x in vec]
+            self._convert_floats = lambda vec : [func(x) for x in vec]
+            self._convert_numpy  = lambda vec : numpy.array([func(x) for x in vec.tolist()], dtype=float)
+
+    def __call__(self, val):
+        """Convert a single value, which may be None."""
+        return self.func(val) if val is not None else None
+
+    def convert_vector(self, vec):
+        """Convert a sequence of values.
+
+        vec: A NumPy array, an array of doubles (array.array('d')), or any
+        other sequence, such as a list. Missing values are None in a list,
+        and NaN in the arrays.
+
+        returns: The converted values, in a NumPy array or array of doubles
+        if that is what vec is, otherwise in a list."""
+        if numpy is not None and isinstance(vec, numpy.ndarray):
+            return self._convert_numpy(vec)
+        if isinstance(vec, array.array) and vec.typecode == 'd':
+            if numpy is not None:
+                return array.array('d', self._convert_numpy(numpy.frombuffer(vec, dtype=float)).tostring())
+            return array.array('d', self._convert_floats(vec))
+        return self._convert_list(vec)
+
+# The conversions in conversionDict that are not a simple multiplication. Key
+# is a 2-way tuple (from unit, to unit). Value is a 4-way tuple (offset,
+# multiplier, divisor, offset), applied in that order. None means the step is
+# skipped:
+conversionCoefficients = {
+      ('degree_F',   'degree_C')   : (-32.0,    5.0/9.0, None,    None),
+      ('degree_C',   'degree_F')   : (None,     9.0/5.0, None,    32.0),
+      ('mmHg',       'inHg')       : (None,     None,    25.4,    None),
+      ('mmHg',       'mbar')       : (None,     None,    0.75006168, None),
+      ('mmHg',       'hPa')        : (None,     None,    0.75006168, None),
+      ('mbar',       'inHg')       : (None,     None,    33.86,   None),
+      ('hPa',        'inHg')       : (None,     None,    33.86,   None),
+      ('dublin_jd',  'unix_epoch') : (-25567.5, 86400.0, None,    None),
+      ('unix_epoch', 'dublin_jd')  : (None,     None,    86400.0, 25567.5),
+      ('second',     'hour')       : (None,     None,    3600.0,  None),
+      ('second',     'day')        : (None,     None,    86400.0, None),
+      ('hour',       'day')        : (None,     None,    24.0,    None)}
+
+# The conversions compiled so far. Key is a 2-way tuple (from unit, to unit):
+_compiled_conversions = {}
+
+def compile_conversion(from_unit, to_unit):
+    """Return the conversion from one unit type to another, as an instance of
+    UnitConversion. Conversions are compiled once, then reused.
+
+    Raises KeyError if there is no such conversion.
+
+    Example:
+    >>> c = compile_conversion('degree_F', 'degree_C')
+    >>> print c.coefficients
+    (-32.0, 0.5555555555555556, None, None)
+    >>> print c(212.0)
+    100.0
+    >>> print c.convert_vector([50.0, None, 68.0])
+    [10.0, None, 20.0]
+    """
+    try:
+        return _compiled_conversions[(from_unit, to_unit)]
+    except KeyError:
+        pass
+    if from_unit == to_unit:
+        func = lambda x : x
+    else:
+        try:
+            func = conversionDict[from_unit][to_unit]
+        except KeyError:
+            if weewx.debug:
+                syslog.syslog(syslog.LOG_DEBUG, "units: Unable to convert from %s to %s" %(from_unit, to_unit))
+            raise
+    conversion = _compiled_conversions[(from_unit, to_unit)] = UnitConversion(from_unit, to_unit, func)
+    return conversion
+
+def convert_vector(vec, from_unit, to_unit):
+    """Convert a sequence of values from one unit type to another, in one
+    call. See UnitConversion.convert_vector().
+
+    Example:
+    >>> print convert_vector([1.0, None, 2.5], 'inch', 'mm')
+    [25.4, None, 63.5]
+    """
+    return compile_conversion(from_unit, to_unit).convert_vector(vec)
+
+def _conversion_coefficients(from_unit, to_unit, func):
+    """Return the coefficients (pre, multiplier, divisor, post) of a linear
+    conversion that does what the conversion function func does, or None if
+    there are none."""
+    if from_unit == to_unit:
+        return (None, None, None, None)
+    try:
+        coefficients = conversionCoefficients.get((from_unit, to_unit), (None, func(1.0), None, None))
+        # Make sure they give the same results as the function. They might
+        # not, if conversionDict has been changed.
+        x_values = [0.0, 1.0, -40.0, 12.5, 1013.25, 123456.7]
+        if _linear_converters(*coefficients)[1](x_values) != [func(x) for x in x_values]:
+            return None
+    except (TypeError, ValueError, ArithmeticError):
+        return None
+    return coefficients
+
+def _linear_converters(pre, multiplier, divisor, post):
+    """Return three functions that add pre to each value of a vector,
+    multiply by multiplier, divide by divisor, then add post. A coefficient
+    of None skips its step. The first converts a list, where missing values
+    are None, the second a sequence of floats, and the third a NumPy array."""
+    if pre is None and multiplier is None and divisor is None and post is None:
+        return (list, list, lambda vec : vec)
+    _multiplier = float(multiplier) if multiplier is not None else 1.0
+    _divisor    = float(divisor) if divisor is not None else 1.0
+    if not pre and divisor is None and not post:
+        # Most conversions are just a multiplication:
+        def convert_list(vec):
+            return [x * _multiplier if x is not None else None for x in vec]
+        def convert_floats(vec):
+            return [x * _multiplier for x in vec]
+    elif not pre and multiplier is None and not post:
+        def convert_list(vec):
+            return [x / _divisor if x is not None else None for x in vec]
+        def convert_floats(vec):
+            return [x / _divisor for x in vec]
+    else:
+        # A skipped step is done with a value that leaves x as it is:
+        _pre  = pre or 0.0
+        _post = post or 0.0
+        def convert_list(vec):
+            return [(x + _pre) * _multiplier / _divisor + _post if x is not None else None for x in vec]
+        def convert_floats(vec):
+            return [(x + _pre) * _multiplier / _divisor + _post for x in vec]
+    def convert_numpy(vec):
+        if pre:
+            vec = vec + pre
+        if multiplier is not None:
+            vec = vec * _multiplier
+        if divisor is not None:
+            vec = vec / _divisor
+        if post:
+            vec = vec + post
+        return vec
+    return (convert_list, convert_floats, convert_numpy)
+
 def convertStd(val_t, target_std_unit_system):
     """Convert a value tuple to an appropriate unit in a target standardized
     unit system
@@ -1079,7 +1247,8 @@ class GenWithConvert(object):
     def __init__(self, input_generator, target_unit_system=weewx.METRIC):
         """Initialize an instance of GenWithConvert
         
-        input_generator: An iterator which will return dictionary records.
+        input_generator: An iterator which will return dictionary records, or
+        dictionary-like views of them, such as weewx.archive.RecordView.
         
         target_unit_system: The unit system the output of the generator should
         use, or 'None' if it should leave the output unchanged."""
@@ -0,0 +1,316 @@
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""A persistent, columnar cache of archive data, used for plots.
+
+Each observation type is kept in three files of native doubles: the
+timestamps, the values, and the unit systems of every record in the archive.
+The files are memory mapped. Each time a type is read, any records newer than
+the last one cached are appended, so a plot over a day, week, month, or year
+becomes a binary search and a slice of the files, rather than a scan of the
+database.
+
+The cache only ever grows at the end. If the number of records up to the last
+cached timestamp no longer matches the cache (because records were inserted
+out of order, or deleted), the type is rebuilt from scratch. The exception is
+when only the oldest records were deleted, as by a retention policy (see
+weewx.archive.Archive.rollUp()). Then they are skipped. The records are
+counted the first time a type is read by a process, and again only after this
+process has written to the archive other than by adding records after the
+last one. Records inserted or deleted by other programs are noticed by the
+next process to use the cache. Values changed in place by some other program
+are not noticed. Delete the cache directory if that happens.
+
+Example:
+    archive.vector_cache = weewx.vectorcache.get_cache(archive, '/home/weewx/archive/vectors')
+    (time_vec_t, data_vec_t) = archive.getSqlVectors('outTemp', start_ts, stop_ts)
+"""
+
+from __future__ import with_statement
+import array
+import bisect
+import fcntl
+import mmap
+import os
+import re
+import struct
+import syslog
+import threading
+
+# The number of records appended to the files at a time:
+chunk_size = 10000
+
+class ColumnFile(object):
+    """A memory mapped file of doubles, which can be appended to. It looks like
+    a read-only sequence, so the bisect module can search it."""
+
+    itemsize = array.array('d').itemsize
+
+    def __init__(self, path):
+        self.path = path
+        # In append mode, writes always go to the end of the file:
+        self._file = open(path, 'a+b')
+        self._map  = None
+        self._size = 0
+        self.refresh()
+
+    def refresh(self):
+        """Map the file again if its size has changed."""
+        _size = os.fstat(self._file.fileno()).st_size
+        if _size != self._size or (_size and self._map is None):
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            if _size:
+                self._map = mmap.mmap(self._file.fileno(), _size, access=mmap.ACCESS_READ)
+            self._size = _size
+
+    def __len__(self):
+        return self._size // ColumnFile.itemsize
+
+    def __getitem__(self, i):
+        return struct.unpack_from('d', self._map, i * ColumnFile.itemsize)[0]
+
+    def slice(self, start, stop):
+        """Return the items from start up to, but not including, stop as an
+        array of doubles."""
+        _vec = array.array('d')
+        if stop > start:
+            _vec.fromstring(self._map[start * ColumnFile.itemsize:stop * ColumnFile.itemsize])
+        return _vec
+
+    def extend(self, values):
+        array.array('d', values).tofile(self._file)
+        self._file.flush()
+        self.refresh()
+
+    def truncate(self, nitems):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.truncate(nitems * ColumnFile.itemsize)
+        self._file.flush()
+        self.refresh()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+class TypeColumns(object):
+    """The columns of timestamps, values, and unit systems of a single
+    observation type."""
+
+    def __init__(self, cache_dir, obs_type):
+        self.obs_type = obs_type
+        self.times    = ColumnFile(os.path.join(cache_dir, '%s.time'  % obs_type))
+        self.values   = ColumnFile(os.path.join(cache_dir, '%s.data'  % obs_type))
+        self.units    = ColumnFile(os.path.join(cache_dir, '%s.units' % obs_type))
+        self.columns  = (self.times, self.values, self.units)
+        # The index of the first record that is still in the database. The
+        # ones before it were deleted by a retention policy:
+        self.head = 0
+        # A 2-way tuple (archive unordered write count, number of records) as
+        # of the last sync. See sync():
+        self._checked = None
+
+    def __len__(self):
+        # The files are appended to one at a time. If a write was cut short,
+        # only the records in all three count.
+        return min(len(_col) for _col in self.columns)
+
+    def truncate(self, nitems):
+        for _col in self.columns:
+            _col.truncate(nitems)
+        self.head = min(self.head, nitems)
+        self._checked = None
+
+    def sync(self, archive):
+        """Bring the columns up to date with an archive."""
+        for _col in self.columns:
+            _col.refresh()
+        _n = len(self)
+        _unordered_count = archive.getUnorderedCount()
+        if _n:
+            _last_ts = int(self.times[_n - 1])
+            # Counting the records scans the table, so it is done only the
+            # first time, and when this process has written to the archive
+            # other than by adding records after the last one. Records that
+            # were only appended are picked up below.
+            if self._checked != (_unordered_count, _n):
+                _count = archive.getSql("SELECT COUNT(*) FROM %s WHERE dateTime <= ?" % archive.table,
+                                        (_last_ts,))[0]
+                if _count != _n - self.head:
+                    # If the oldest records were deleted, only skip them, unless
+                    # they are more than half the cache.
+                    _first_ts = archive.firstGoodStamp()
+                    _head = bisect.bisect_left(self.times, _first_ts, 0, _n) if _first_ts is not None else _n
+                    if _count == _n - _head and _head <= _n // 2:
+                        self.head = _head
+                    else:
+                        syslog.syslog(syslog.LOG_INFO, "vectorcache: records were added or removed before %d. "
+                                      "Rebuilding cache of %s" % (_last_ts, self.obs_type))
+                        _n = 0
+        if any(len(_col) != _n for _col in self.columns):
+            self.truncate(_n)
+
+        if _n:
+            _gen = archive.genSql("SELECT dateTime, %s, usUnits FROM %s WHERE dateTime > ? ORDER BY dateTime ASC" %
+                                  (self.obs_type, archive.table), (_last_ts,))
+        else:
+            _gen = archive.genSql("SELECT dateTime, %s, usUnits FROM %s ORDER BY dateTime ASC" %
+                                  (self.obs_type, archive.table))
+        _rows = []
+        for _row in _gen:
+            _rows.append(_row)
+            if len(_rows) >= chunk_size:
+                self._append(_rows)
+                _rows = []
+        if _rows:
+            self._append(_rows)
+        self._checked = (_unordered_count, len(self))
+
+    def _append(self, rows):
+        (_times, _values, _units) = zip(*rows)
+        # A null value is kept as a NaN:
+        _values = [_nan if _v is None else float(_v) for _v in _values]
+        self.times.extend(_times)
+        self.values.extend(_values)
+        self.units.extend(_units)
+
+    def close(self):
+        for _col in self.columns:
+            _col.close()
+
+class VectorCache(object):
+    """The columns of the observation types of an archive that have been read
+    through the cache, in a directory of their own."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._types = {}
+        # Guards against other threads in this process:
+        self._lock = threading.Lock()
+        # Guards against other processes, such as wee_reports:
+        self._lock_file = open(os.path.join(cache_dir, 'lock'), 'a')
+
+    def getVectors(self, archive, obs_type, startstamp, stopstamp, include_start=False):
+        """Return the data of an observation type within an interval, as
+        vectors.
+
+        startstamp: Exclusive start of the interval, unless include_start is
+        True.
+
+        stopstamp: Inclusive end of the interval.
+
+        returns: A 3-way tuple (time_vec, value_vec, unit_vec), or None if the
+        type cannot be cached."""
+        _vecs = self._getVectors(archive, [obs_type], startstamp, stopstamp, include_start)
+        return tuple(_vecs) if _vecs is not None else None
+
+    def getColumns(self, archive, sql_columns, startstamp, stopstamp, include_start=False):
+        """Return the rows with timestamps within an interval.
+
+        sql_columns: The observation types, as a string separated by commas
+        (e.g., 'windSpeed, windDir').
+
+        returns: A list of rows, in time order, that look like (dateTime,
+        <sql_columns>, usUnits), or None if the types cannot be cached."""
+        _names = [_name.strip() for _name in sql_columns.split(',')]
+        _vecs = self._getVectors(archive, _names, startstamp, stopstamp, include_start)
+        return zip(*_vecs) if _vecs is not None else None
+
+    def _getVectors(self, archive, obs_types, startstamp, stopstamp, include_start):
+        """Return a list holding the time vector, a value vector for each
+        observation type, and the unit vector, or None."""
+        for _obs_type in obs_types:
+            if _obs_type not in archive.sqlkeys or _obs_type in ('dateTime', 'usUnits'):
+                return None
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    _type_columns = [self._getType(_obs_type) for _obs_type in obs_types]
+                    for _columns in _type_columns:
+                        _columns.sync(archive)
+                except (IOError, OSError, TypeError, ValueError), e:
+                    syslog.syslog(syslog.LOG_ERR, "vectorcache: unable to cache %s in %s: %s" %
+                                  (', '.join(obs_types), self.cache_dir, e))
+                    self._dropAll(obs_types)
+                    return None
+                # Every column holds all the records up to its last timestamp,
+                # so the shortest one says how many records they all share:
+                _n = min(len(_columns) for _columns in _type_columns)
+                _head = max(_columns.head for _columns in _type_columns)
+                _times = _type_columns[0].times
+                if include_start:
+                    _start = bisect.bisect_left(_times, startstamp, _head, _n)
+                else:
+                    _start = bisect.bisect_right(_times, startstamp, _head, _n)
+                _stop = bisect.bisect_right(_times, stopstamp, _start, _n)
+                _vecs = [[int(_ts) for _ts in _times.slice(_start, _stop)]]
+                for _columns in _type_columns:
+                    _vecs.append([None if _v != _v else _v for _v in _columns.values.slice(_start, _stop)])
+                _vecs.append([int(_u) for _u in _type_columns[0].units.slice(_start, _stop)])
+                return _vecs
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def drop(self, obs_type):
+        """Throw away the cached values of an observation type. They will be
+        fetched again from the database when next needed."""
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                self._dropAll([obs_type])
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def close(self):
+        with self._lock:
+            for _columns in self._types.itervalues():
+                _columns.close()
+            self._types.clear()
+
+    def _getType(self, obs_type):
+        if obs_type not in self._types:
+            self._types[obs_type] = TypeColumns(self.cache_dir, obs_type)
+        return self._types[obs_type]
+
+    def _dropAll(self, obs_types):
+        for _obs_type in obs_types:
+            try:
+                self._getType(_obs_type).truncate(0)
+            except (IOError, OSError):
+                pass
+
+_nan = float('nan')
+
+# The caches in use by this process. Key is a 2-way tuple (archive key, cache
+# root directory):
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(archive, cache_root):
+    """Return the vector cache of an archive. The cache is shared by all the
+    Archive objects in this process that use the same database and table.
+
+    archive: An instance of weewx.archive.Archive.
+
+    cache_root: The directory under which the caches of all archives are
+    kept. Each archive gets its own subdirectory."""
+    _key = (archive.write_key, cache_root)
+    with _caches_lock:
+        if _key not in _caches:
+            _dir_name = re.sub(r'\W+', '_', '%s_%s' % archive.write_key).strip('_')
+            _caches[_key] = VectorCache(os.path.join(cache_root, _dir_name))
+        return _caches[_key]
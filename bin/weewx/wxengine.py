@@ -26,8 +26,11 @@ import daemon
 
 # weewx imports:
 import weedb
+import weedb.pool
 import weewx.accum
 import weewx.archive
+import weewx.archivewriter
+import weewx.dispatchprofile
 import weewx.stats
 import weewx.station
 import weewx.restful
@@ -61,8 +64,28 @@ class StdEngine(object):
         # Default garbage collection is every 3 hours:
         self.gc_interval = int(config_dict.get('gc_interval', 3*3600))
 
+        # Set the limits of the pool of database connections used by the
+        # reports and the RESTful threads:
+        db_options = config_dict.get('Databases', {})
+        weedb.pool.default_pool.configure(max_size=db_options.get('pool_max_size'),
+                                          max_idle=db_options.get('pool_max_idle'))
+
         # Set up the callback dictionary:
         self.callbacks = dict()
+        # The table used to dispatch events. It is compiled from the callback
+        # dictionary once the services have loaded:
+        self.dispatch_table = None
+
+        # If asked, time the callbacks:
+        if weeutil.weeutil.tobool(config_dict.get('profile_dispatch', False)):
+            _log_interval = int(config_dict.get('profile_log_interval', 3600))
+            self.profiler = weewx.dispatchprofile.DispatchProfiler(int(config_dict.get('profile_window', 1000)),
+                                                                   _log_interval or None)
+            syslog.syslog(syslog.LOG_INFO, "wxengine: Profiling the callbacks. Summary every %d seconds, "
+                          "or on signal USR1" % _log_interval)
+        else:
+            self.profiler = None
+        weewx.dispatchprofile.active_profiler = self.profiler
 
         # Set up the weather station hardware:
         self.setupStation(config_dict)
@@ -75,6 +98,9 @@ class StdEngine(object):
 
         # Another hook for after the services load.
         self.postLoadServices(config_dict)
+
+        # Now that the services have bound their callbacks, compile them:
+        self.compileDispatchTable()
         
     def setupStation(self, config_dict):
         """Set up the weather station hardware."""
@@ -166,6 +192,10 @@ class StdEngine(object):
 
                 # First, let any interested services know the packet LOOP is about to start
                 self.dispatchEvent(weewx.Event(weewx.PRE_LOOP))
+
+                # The callbacks for each LOOP packet:
+                loop_callbacks  = self.dispatch_table.get(weewx.NEW_LOOP_PACKET, ())
+                check_callbacks = self.dispatch_table.get(weewx.CHECK_LOOP, ())
     
                 # Get ready to enter the main packet loop. An exception of type
                 # BreakLoop will get thrown when a service wants to break the loop and
@@ -177,11 +207,15 @@ class StdEngine(object):
                     # an exception (usually when an archive period has passed).
                     for packet in self.console.genLoopPackets():
                         
-                        # Package the packet as an event, then dispatch it.            
-                        self.dispatchEvent(weewx.Event(weewx.NEW_LOOP_PACKET, packet=packet))
+                        # Package the packet as an event, then dispatch it.
+                        loop_event = weewx.Event(weewx.NEW_LOOP_PACKET, packet=packet)
+                        for callback in loop_callbacks:
+                            callback(loop_event)
 
                         # Allow services to break the loop by throwing an exception:
-                        self.dispatchEvent(weewx.Event(weewx.CHECK_LOOP, packet=packet))
+                        check_event = weewx.Event(weewx.CHECK_LOOP, packet=packet)
+                        for callback in check_callbacks:
+                            callback(check_event)
     
                 except BreakLoop:
                     
@@ -200,14 +234,43 @@ class StdEngine(object):
         # otherwise append to the existing list:
         self.callbacks.setdefault(event_type, []).append(callback)
 
+        # If the dispatch table has already been compiled, bring it up to date:
+        if self.dispatch_table is not None:
+            self.dispatch_table[event_type] = self._compileCallbacks(event_type)
+
+    def compileDispatchTable(self):
+        """Compile the callback dictionary into the dispatch table, which
+        holds a tuple of the functions to call for each event type."""
+        self.dispatch_table = dict((event_type, self._compileCallbacks(event_type))
+                                   for event_type in self.callbacks)
+
+    def _compileCallbacks(self, event_type):
+        if self.profiler is None:
+            return tuple(self.callbacks[event_type])
+        return tuple(self._profiled(event_type, callback) for callback in self.callbacks[event_type])
+
+    def _profiled(self, event_type, callback):
+        """Return a function that calls a callback, and times it."""
+        profiler = self.profiler
+        def profiled_callback(event):
+            t0 = time.time()
+            try:
+                callback(event)
+            finally:
+                # Services break the loop with an exception, so time those
+                # calls too:
+                profiler.record(event_type, callback, time.time() - t0)
+                profiler.checkLog()
+        return profiled_callback
+
     def dispatchEvent(self, event):
         """Call all registered callbacks for an event."""
-        # See if any callbacks have been registered for this event type:
-        if event.event_type in self.callbacks:
-            # Yes, at least one has been registered. Call them in order:
-            for callback in self.callbacks[event.event_type]:
-                # Call the function with the event as an argument:
-                callback(event)
+        if self.dispatch_table is None:
+            self.compileDispatchTable()
+        # Call the callbacks for this event type, if any, in order:
+        for callback in self.dispatch_table.get(event.event_type, ()):
+            # Call the function with the event as an argument:
+            callback(event)
 
     def shutDown(self):
         """Run when an engine shutdown is requested."""
@@ -225,12 +288,21 @@ class StdEngine(object):
                 del self.service_obj[-1]
 
             del self.service_obj
+
+        # Close any database connections left in the pool:
+        weedb.pool.default_pool.closeAll()
             
         try:
             del self.callbacks
+            self.dispatch_table = {}
         except:
             pass
 
+        if getattr(self, 'profiler', None) is not None:
+            self.profiler.logSummary()
+            if weewx.dispatchprofile.active_profiler is self.profiler:
+                weewx.dispatchprofile.active_profiler = None
+
         try:
             # Close the console:
             self.console.closePort()
@@ -342,15 +414,7 @@ class StdCalibrate(StdService):
         # Get the list of calibration corrections to apply. If a section
         # is missing, a KeyError exception will get thrown:
         try:
-            correction_dict = config_dict['StdCalibrate']['Corrections']
-            self.corrections = {}
-
-            # For each correction, compile it, then save in a dictionary of
-            # corrections to be applied:
-            for obs_type in correction_dict.scalars:
-                self.corrections[obs_type] = compile(correction_dict[obs_type], 
-                                                     'StdCalibrate', 'eval')
-            
+            self.corrections = _getCorrections(config_dict)
             self.bind(weewx.NEW_LOOP_PACKET, self.new_loop_packet)
             self.bind(weewx.NEW_ARCHIVE_RECORD, self.new_archive_record)
         except KeyError:
@@ -385,27 +449,10 @@ class StdQC(StdService):
         # dictionary, then an exception will get thrown and nothing will be
         # done.
         try:
-            mm_dict = config_dict['StdQC']['MinMax']
+            self.min_max_dict = _getMinMax(config_dict)
         except KeyError:
             syslog.syslog(syslog.LOG_NOTICE, "wxengine: No QC information in config file.")
             return
-
-        self.min_max_dict = {}
-
-        target_unit_name = config_dict['StdConvert']['target_unit']
-        target_unit = weewx.units.unit_constants[target_unit_name.upper()]
-        converter = weewx.units.StdUnitConverters[target_unit]
-
-        for obs_type in mm_dict.scalars:
-            minval = float(mm_dict[obs_type][0])
-            maxval = float(mm_dict[obs_type][1])
-            if len(mm_dict[obs_type]) == 3:
-                group = weewx.units._getUnitGroup(obs_type)
-                vt = (minval, mm_dict[obs_type][2], group)
-                minval = converter.convert(vt)[0]
-                vt = (maxval, mm_dict[obs_type][2], group)
-                maxval = converter.convert(vt)[0]
-            self.min_max_dict[obs_type] = (minval, maxval)
         
         self.bind(weewx.NEW_LOOP_PACKET, self.new_loop_packet)
         self.bind(weewx.NEW_ARCHIVE_RECORD, self.new_archive_record)
@@ -430,6 +477,151 @@ class StdQC(StdService):
                                    self.min_max_dict[obs_type][0], self.min_max_dict[obs_type][1]))
                     event.record[obs_type] = None
 
+def _getCorrections(config_dict):
+    """Return a dictionary of the compiled calibration expressions, keyed by
+    observation type. Raises KeyError if there are none."""
+    correction_dict = config_dict['StdCalibrate']['Corrections']
+    corrections = {}
+    # For each correction, compile it, then save in a dictionary of
+    # corrections to be applied:
+    for obs_type in correction_dict.scalars:
+        corrections[obs_type] = compile(correction_dict[obs_type], 'StdCalibrate', 'eval')
+    return corrections
+
+def _getMinMax(config_dict):
+    """Return a dictionary of 2-way tuples (min, max) of the QC bounds, in the
+    target unit system of StdConvert, keyed by observation type. Raises
+    KeyError if there are none."""
+    mm_dict = config_dict['StdQC']['MinMax']
+
+    min_max_dict = {}
+
+    target_unit_name = config_dict['StdConvert']['target_unit']
+    target_unit = weewx.units.unit_constants[target_unit_name.upper()]
+    converter = weewx.units.StdUnitConverters[target_unit]
+
+    for obs_type in mm_dict.scalars:
+        minval = float(mm_dict[obs_type][0])
+        maxval = float(mm_dict[obs_type][1])
+        if len(mm_dict[obs_type]) == 3:
+            group = weewx.units._getUnitGroup(obs_type)
+            vt = (minval, mm_dict[obs_type][2], group)
+            minval = converter.convert(vt)[0]
+            vt = (maxval, mm_dict[obs_type][2], group)
+            maxval = converter.convert(vt)[0]
+        min_max_dict[obs_type] = (minval, maxval)
+    return min_max_dict
+
+#===============================================================================
+#                    Class StdFilter
+#===============================================================================
+
+class StdFilter(StdService):
+    """Does the work of StdConvert, StdCalibrate, and StdQC, in that order,
+    as a single service. It takes the same options, and gives the same
+    results, but each packet and record is handled in one call.
+
+    The conversion of each observation type from each unit system is looked
+    up once, the first time it is seen, rather than for every value. The
+    calibration expressions and QC bounds are held in lists, in the order the
+    separate services would apply them."""
+
+    def __init__(self, engine, config_dict):
+        super(StdFilter, self).__init__(engine, config_dict)
+
+        target_unit_nickname = config_dict['StdConvert']['target_unit']
+        self.target_unit = weewx.units.unit_constants[target_unit_nickname.upper()]
+        self.converter = weewx.units.StdUnitConverters[self.target_unit]
+        # Key is a unit system. Value is a dictionary, holding the conversion
+        # of each observation type from it. See _getConversion():
+        self.conversions = {}
+
+        try:
+            self.corrections = _getCorrections(config_dict).items()
+        except KeyError:
+            syslog.syslog(syslog.LOG_NOTICE, "wxengine: No calibration information in config file. Ignored.")
+            self.corrections = []
+
+        try:
+            self.min_max = [(obs_type, minval, maxval)
+                            for (obs_type, (minval, maxval)) in _getMinMax(config_dict).items()]
+        except KeyError:
+            syslog.syslog(syslog.LOG_NOTICE, "wxengine: No QC information in config file.")
+            self.min_max = []
+
+        self.bind(weewx.NEW_LOOP_PACKET, self.new_loop_packet)
+        self.bind(weewx.NEW_ARCHIVE_RECORD, self.new_archive_record)
+
+        syslog.syslog(syslog.LOG_INFO, "wxengine: StdFilter target unit is 0x%x" % self.target_unit)
+
+    def new_loop_packet(self, event):
+        """Convert, calibrate, and check a LOOP packet"""
+        event.packet = self.filter(event.packet, True)
+
+    def new_archive_record(self, event):
+        """Convert, calibrate, and check an archive record"""
+        # If the record was software generated, then any corrections have
+        # already been applied in the LOOP packet.
+        event.record = self.filter(event.record, bool(self.corrections) and event.origin != 'software')
+
+    def filter(self, obs_dict, calibrate):
+        """Return the observation dictionary converted to the target unit
+        system, calibrated if calibrate is True, then checked. As with
+        StdConvert, a dictionary that has to be converted is replaced with a
+        new one, while one already in the target unit system is changed in
+        place."""
+        if obs_dict['usUnits'] != self.target_unit:
+            obs_dict = self._convert(obs_dict)
+        if calibrate:
+            for (obs_type, correction) in self.corrections:
+                if obs_type in obs_dict and obs_dict[obs_type] is not None:
+                    obs_dict[obs_type] = eval(correction, None, obs_dict)
+        for (obs_type, minval, maxval) in self.min_max:
+            val = obs_dict.get(obs_type)
+            if val is not None and not minval <= val <= maxval:
+                syslog.syslog(syslog.LOG_NOTICE, "wxengine: ignoring %s value of %s, limits are (%s, %s)" % 
+                              (obs_type, val, minval, maxval))
+                obs_dict[obs_type] = None
+        return obs_dict
+
+    def _convert(self, obs_dict):
+        unit_system = obs_dict['usUnits']
+        try:
+            conversions = self.conversions[unit_system]
+        except KeyError:
+            conversions = self.conversions[unit_system] = {}
+        converted_dict = {}
+        for (obs_type, val) in obs_dict.iteritems():
+            try:
+                conversion = conversions[obs_type]
+            except KeyError:
+                conversion = conversions[obs_type] = self._getConversion(unit_system, obs_type)
+            if conversion is None or val is None:
+                converted_dict[obs_type] = val
+            elif type(val) is float or type(val) is int:
+                converted_dict[obs_type] = conversion[0](val)
+            else:
+                # A sequence, or something unusual. Let weewx.units sort it out:
+                converted_dict[obs_type] = weewx.units.convert((val, conversion[1], None), conversion[2])[0]
+        # Add the new unit system
+        converted_dict['usUnits'] = self.target_unit
+        return converted_dict
+
+    def _getConversion(self, unit_system, obs_type):
+        """Return a 3-way tuple (conversion function, unit, target unit) to
+        convert an observation type from a unit system, or None if it is not
+        converted. Raises KeyError if it cannot be converted, as
+        Converter.convertDict() does."""
+        if obs_type == 'usUnits':
+            return None
+        (unit, group) = weewx.units.StdUnitConverters[unit_system].getTargetUnit(obs_type)
+        if unit is None and group is None:
+            return None
+        target_unit = self.converter.group_unit_dict.get(group, weewx.units.USUnits[group])
+        if unit == target_unit:
+            return None
+        return (weewx.units.conversionDict[unit][target_unit], unit, target_unit)
+
 #===============================================================================
 #                    Class StdArchive
 #===============================================================================
@@ -479,9 +671,34 @@ class StdArchive(StdService):
         syslog.syslog(syslog.LOG_DEBUG, "wxengine: Use LOOP data in hi/low calculations: %d" % 
                       (self.loop_hilo,))
         
+        # Whether to roll old archive records up into hourly and daily tables,
+        # and how many days of records to keep at full resolution:
+        self.rollup = weeutil.weeutil.tobool(config_dict['StdArchive'].get('rollup', False))
+        self.retention_days = int(config_dict['StdArchive'].get('retention_days', 0))
+
+        # Whether to write archive records to the databases from a thread of
+        # their own, how many can wait to be written, and where they are kept
+        # until they are:
+        self.async_write = weeutil.weeutil.tobool(config_dict['StdArchive'].get('async_write', False))
+        self.write_queue_size = int(config_dict['StdArchive'].get('write_queue_size', 50))
+        self.write_journal = os.path.join(config_dict['WEEWX_ROOT'],
+                                          config_dict['StdArchive'].get('write_journal', 'archive/write_queue.journal'))
+        self.writer = None
+
         self.setupArchiveDatabase(config_dict)
         self.setupStatsDatabase(config_dict)
         
+        # Now that the stats database has caught up with the archive, records
+        # can be rolled up, and old ones deleted:
+        if self.rollup:
+            self.archive.rollUp(self.retention_days)
+        
+        if self.async_write:
+            self.writer = weewx.archivewriter.ArchiveWriter(self._openDatabases, self._writeRecord,
+                                                            self.write_queue_size, self.write_journal)
+            self.writer.start()
+            syslog.syslog(syslog.LOG_INFO, "wxengine: Archive records will be written by a separate thread")
+        
         self.bind(weewx.STARTUP,            self.startup)
         self.bind(weewx.PRE_LOOP,           self.pre_loop)
         self.bind(weewx.POST_LOOP,          self.post_loop)
@@ -547,7 +764,7 @@ class StdArchive(StdService):
         # there will be no old accumulator and an exception will be thrown. Be
         # prepared to catch it.
         try:
-            self.statsDb.updateHiLo(self.old_accumulator)
+            self._updateHiLo(self.old_accumulator)
         except AttributeError:
             pass
         else:
@@ -570,9 +787,40 @@ class StdArchive(StdService):
         
     def new_archive_record(self, event):
         """Called when a new archive record has arrived. 
-        Put it in the archive database."""
-        self.archive.addRecord(event.record)
-        self.statsDb.addRecord(event.record)
+        Put it in the archive database, or in the queue of the writer thread."""
+        if self.writer is not None:
+            self.writer.addRecord(event.record)
+        else:
+            self._writeRecord((self.archive, self.statsDb), event.record)
+
+    def _writeRecord(self, databases, record):
+        """Add a record to the archive and stats databases, given as a 2-way
+        tuple (archive, statsDb)."""
+        (archive, statsDb) = databases
+        # If the database stays locked through all the retries, the
+        # weedb.OperationalError is not caught. Weewx restarts, then the
+        # catch up recovers the record from the station, and the stats database
+        # is backfilled from the archive.
+        archive.addRecord(record)
+        statsDb.addRecord(record)
+        if self.rollup:
+            archive.rollUp(self.retention_days)
+
+    def _updateHiLo(self, accumulator):
+        """Update the high/lows of the stats database from the LOOP packets in
+        an accumulator. With a writer thread, this waits its turn behind the
+        records already queued."""
+        if self.writer is not None:
+            self.writer.addJob(_updateHiLo, accumulator)
+        else:
+            self.statsDb.updateHiLo(accumulator)
+
+    def _openDatabases(self):
+        """Open the databases used by the writer thread."""
+        archive = weewx.archive.Archive.open(self.archive_db_dict)
+        statsDb = weewx.stats.StatsDb.open(self.stats_db_dict)
+        statsDb.setDegreeDayBases(*self.degree_day_bases)
+        return (archive, statsDb)
 
     def setupArchiveDatabase(self, config_dict):
         """Setup the main database archive"""
@@ -580,11 +828,17 @@ class StdArchive(StdService):
         archive_schema_str = config_dict['StdArchive'].get('archive_schema', 'user.schemas.defaultArchiveSchema')
         archive_schema = weeutil.weeutil._get_object(archive_schema_str)
         archive_db = config_dict['StdArchive']['archive_database']
+        self.archive_db_dict = config_dict['Databases'][archive_db]
         # This will create the database if it doesn't exist, then return an
         # opened instance of Archive. It also attaches a reference to the engine, so other
         # services can use it.
         self.archive = self.engine.archive = \
-            weewx.archive.Archive.open_with_create(config_dict['Databases'][archive_db], archive_schema)
+            weewx.archive.Archive.open_with_create(self.archive_db_dict, archive_schema)
+        # Add any records the writer thread did not get to the last time:
+        weewx.archivewriter.replay_journal(self.write_journal, self.archive)
+        # Keep the most recent records in memory, for the reports and
+        # RESTful services:
+        self.archive.cacheRecentRecords(int(config_dict['StdArchive'].get('record_cache_size', 300)))
         syslog.syslog(syslog.LOG_INFO, "wxengine: Using archive database: %s" % (archive_db,))
 
     def setupStatsDatabase(self, config_dict):
@@ -593,17 +847,29 @@ class StdArchive(StdService):
         stats_schema_str = config_dict['StdArchive'].get('stats_schema', 'user.schemas.defaultStatsSchema')
         stats_schema = weeutil.weeutil._get_object(stats_schema_str)
         stats_db = config_dict['StdArchive']['stats_database']
+        self.stats_db_dict = config_dict['Databases'][stats_db]
         # This will create the database if it doesn't exist, then return an
         # opened stats database object:
-        self.statsDb = weewx.stats.StatsDb.open_with_create(config_dict['Databases'][stats_db], stats_schema)
+        self.statsDb = weewx.stats.StatsDb.open_with_create(self.stats_db_dict, stats_schema)
+        # Set the bases of the heating and cooling degree days kept in the
+        # stats database:
+        self.degree_day_bases = weewx.stats.get_degree_day_bases(config_dict['StdArchive'])
+        self.statsDb.setDegreeDayBases(*self.degree_day_bases)
+        # Add or drop the monthly and yearly rollups:
+        self.statsDb.setRollups(weeutil.weeutil.tobool(config_dict['StdArchive'].get('stats_rollups', False)))
         # Backfill it with data from the archive. This will do nothing if the
         # stats database is already up-to-date.
-        self.statsDb.backfillFrom(self.archive)
+        backfill_processes = int(config_dict['StdArchive'].get('backfill_processes', 1))
+        self.statsDb.backfillFrom(self.archive, processes=backfill_processes)
 
         syslog.syslog(syslog.LOG_INFO, "wxengine: Using stats database: %s" % 
                       (config_dict['StdArchive']['stats_database'],))
         
     def shutDown(self):
+        # Write out whatever is still queued, before closing up:
+        if self.writer is not None:
+            self.writer.shutDown()
+            self.writer = None
         self.archive.close()
         self.statsDb.close()
 
@@ -613,8 +879,13 @@ class StdArchive(StdService):
         If the hardware does not support hardware archives, an exception of
         type NotImplementedError will be thrown.""" 
 
-        # Find out when the archive was last updated.
+        # Find out when the archive was last updated, counting the records
+        # still waiting to be written:
         lastgood_ts = self.archive.lastGoodStamp()
+        if self.writer is not None:
+            queued_ts = self.writer.lastQueuedStamp()
+            if queued_ts is not None and (lastgood_ts is None or queued_ts > lastgood_ts):
+                lastgood_ts = queued_ts
 
         try:
             # Now ask the console for any new records since then.
@@ -642,6 +913,10 @@ class StdArchive(StdService):
         
         new_accumulator =  weewx.accum.WXAccum(weeutil.weeutil.TimeSpan(start_archive_ts, end_archive_ts))
         return new_accumulator
+
+def _updateHiLo(databases, accumulator):
+    """Job for the writer thread of StdArchive."""
+    databases[1].updateHiLo(accumulator)
     
 #===============================================================================
 #                    Class StdTimeSynch
@@ -903,6 +1178,10 @@ def sigTERMhandler(dummy_signum, dummy_frame):
     syslog.syslog(syslog.LOG_DEBUG, "wxengine: Received signal TERM.")
     raise Terminate
 
+def sigUSR1handler(dummy_signum, dummy_frame):
+    syslog.syslog(syslog.LOG_DEBUG, "wxengine: Received signal USR1. Logging callback times.")
+    weewx.dispatchprofile.log_summary()
+
 #===============================================================================
 #                    Function main
 #===============================================================================
@@ -919,6 +1198,7 @@ def main(options, args, EngineClass=StdEngine) :
     # Set up the signal handlers.
     signal.signal(signal.SIGHUP, sigHUPhandler)
     signal.signal(signal.SIGTERM, sigTERMhandler)
+    signal.signal(signal.SIGUSR1, sigUSR1handler)
 
     syslog.syslog(syslog.LOG_INFO, "wxengine: Initializing weewx version %s" % weewx.__version__)
     syslog.syslog(syslog.LOG_INFO, "wxengine: Using Python %s" % sys.version)
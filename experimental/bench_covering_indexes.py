@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""Benchmark of plot vectors read from whole archive records versus from
+covering indexes.
+
+Builds an archive of five minute records using the full default schema, then
+times the calls to Archive.getSqlVectors() made by the standard skin's day,
+week, month, and year plots of outTemp and wind, and the database scans
+under them, before and after Archive.createIndexes(). The results are
+checked to be the same.
+
+The scans read less with the indexes. The plots gain less, as they spend most
+of their time in Python, and more on a station whose database is not already
+in the page cache, as it is here.
+
+Run from the bin directory:
+
+    PYTHONPATH=. python ../experimental/bench_covering_indexes.py [ndays]
+"""
+from __future__ import with_statement
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import weedb
+import weewx.archive
+import user.schemas
+
+interval = 300
+
+# (type, time length, aggregate interval, aggregate type) of the standard
+# plots:
+plots = [('outTemp', 86400,       None,  None),
+         ('outTemp', 7 * 86400,   3600,  'avg'),
+         ('outTemp', 30 * 86400,  10800, 'avg'),
+         ('outTemp', 365 * 86400, 86400, 'avg'),
+         ('windvec', 86400,       None,  None),
+         ('windvec', 365 * 86400, 86400, 'avg')]
+
+def time_plots(archive, stop_ts, nrounds):
+    results = []
+    t0 = time.time()
+    for _ in xrange(nrounds):
+        results = [archive.getSqlVectorsExtended(obs_type, stop_ts - length, stop_ts, agg_interval, agg_type)
+                   for (obs_type, length, agg_interval, agg_type) in plots]
+    return ((time.time() - t0) / nrounds, results)
+
+def time_scans(archive, stop_ts, nrounds):
+    t0 = time.time()
+    for _ in xrange(nrounds):
+        results = [list(archive._genColumns(sql_columns, stop_ts - 365 * 86400, stop_ts))
+                   for sql_columns in ('outTemp', 'windSpeed, windDir')]
+    return ((time.time() - t0) / nrounds, results)
+
+def main():
+    ndays = int(sys.argv[1]) if len(sys.argv) > 1 else 365
+    nrounds = 5
+    random.seed(42)
+    tmp_dir = tempfile.mkdtemp()
+    archive_db_dict = {'driver' : 'weedb.sqlite', 'root' : tmp_dir, 'database' : 'bench_archive.sdb'}
+    start_ts = int(time.mktime((2013, 1, 1, 0, 0, 0, 0, 0, -1)))
+    nrecs = ndays * 86400 // interval
+    # Fill every column, as a station with many sensors would:
+    obs_types = [_name for (_name, _sql_type) in user.schemas.defaultArchiveSchema if _sql_type == 'REAL']
+    def gen_records():
+        for irec in xrange(1, nrecs + 1):
+            _record = dict((_obs_type, random.uniform(0, 100)) for _obs_type in obs_types)
+            _record.update({'dateTime' : start_ts + irec * interval, 'usUnits' : weewx.US,
+                            'interval' : interval // 60, 'windDir' : random.uniform(0, 360)})
+            yield _record
+    try:
+        with weewx.archive.Archive.open_with_create(archive_db_dict, user.schemas.defaultArchiveSchema) as archive:
+            archive.addRecord(gen_records())
+        stop_ts = start_ts + nrecs * interval
+        # Each round opens the archive again, as a report does, so neither
+        # run starts with the pages it needs already cached by sqlite:
+        with weewx.archive.Archive.open(archive_db_dict) as archive:
+            (t_rows, row_results) = time_plots(archive, stop_ts, nrounds)
+            (t_row_scans, row_scans) = time_scans(archive, stop_ts, nrounds)
+            archive.createIndexes(['outTemp', 'windvec'])
+        with weewx.archive.Archive.open(archive_db_dict) as archive:
+            (t_index, index_results) = time_plots(archive, stop_ts, nrounds)
+            (t_index_scans, index_scans) = time_scans(archive, stop_ts, nrounds)
+        assert row_results == index_results
+        assert row_scans == index_scans
+        print "Year long scans of outTemp and wind over %d days:" % (ndays,)
+        print "  whole records:    %.3f seconds/round" % (t_row_scans,)
+        print "  covering indexes: %.3f seconds/round (%.2fx)" % (t_index_scans, t_row_scans / t_index_scans)
+        print "Day, week, month, and year plots:"
+        print "  whole records:    %.3f seconds/round" % (t_rows,)
+        print "  covering indexes: %.3f seconds/round (%.2fx)" % (t_index, t_rows / t_index)
+    finally:
+        weedb.drop(archive_db_dict)
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""Benchmark of the engine's per-packet overhead.
+
+Makes LOOP packets with the simulator driver in generator mode, then plays
+them back to the engine as fast as it can take them. Times the main loop with
+the compiled dispatch table, against the same loop with a lookup of the
+callbacks on every dispatch, as it was done before. The packets are made ahead
+of time, because the simulator takes longer to make a packet than the engine
+takes to dispatch it.
+
+Three sets of services are timed: ten services that do nothing, which shows
+the overhead of the dispatch itself, StdConvert, StdCalibrate and StdQC, and
+StdFilter, which does the work of those three.
+
+Run from the bin directory:
+
+    PYTHONPATH=. python ../experimental/bench_dispatch.py [npackets]
+"""
+import itertools
+import sys
+import syslog
+import time
+
+import configobj
+
+import weewx
+import weewx.abstractstation
+import weewx.drivers.simulator
+import weewx.wxengine
+
+class PlayBack(weewx.abstractstation.AbstractStation):
+    """A console that plays back a list of LOOP packets."""
+
+    def __init__(self, packets):
+        self.packets = packets
+
+    def genLoopPackets(self):
+        for packet in self.packets:
+            # The services may change the packet:
+            yield dict(packet)
+
+    def closePort(self):
+        pass
+
+class BenchEngine(weewx.wxengine.StdEngine):
+
+    def setupStation(self, config_dict):
+        self.console = PlayBack(packets)
+
+class LegacyEngine(BenchEngine):
+    """The engine's main loop and dispatch, as they were."""
+
+    def run(self):
+        try:
+            self.dispatchEvent(weewx.Event(weewx.STARTUP))
+            while True:
+                self.dispatchEvent(weewx.Event(weewx.PRE_LOOP))
+                try:
+                    for packet in self.console.genLoopPackets():
+                        self.dispatchEvent(weewx.Event(weewx.NEW_LOOP_PACKET, packet=packet))
+                        self.dispatchEvent(weewx.Event(weewx.CHECK_LOOP, packet=packet))
+                except weewx.wxengine.BreakLoop:
+                    self.dispatchEvent(weewx.Event(weewx.POST_LOOP))
+        finally:
+            self.shutDown()
+
+    def dispatchEvent(self, event):
+        if event.event_type in self.callbacks:
+            for callback in self.callbacks[event.event_type]:
+                callback(event)
+
+class Nothing(weewx.wxengine.StdService):
+    """A service that looks at each LOOP packet, and does nothing."""
+
+    def __init__(self, engine, config_dict):
+        super(Nothing, self).__init__(engine, config_dict)
+        self.bind(weewx.NEW_LOOP_PACKET, self.new_loop_packet)
+
+    def new_loop_packet(self, event):
+        pass
+
+class Stopper(weewx.wxengine.StdService):
+    """Stops the engine after a number of packets."""
+
+    def __init__(self, engine, config_dict):
+        super(Stopper, self).__init__(engine, config_dict)
+        self.npackets = int(config_dict['Bench']['npackets'])
+        self.count = 0
+        self.bind(weewx.CHECK_LOOP, self.check_loop)
+
+    def check_loop(self, event):
+        self.count += 1
+        if self.count >= self.npackets:
+            raise weewx.StopNow
+
+def make_config(npackets, services):
+    return configobj.ConfigObj({
+        'Station'      : {'station_type' : 'Simulator', 'latitude' : '45.686', 'longitude' : '-121.566',
+                          'altitude' : ['100', 'meter']},
+        'StdConvert'   : {'target_unit' : 'METRICWX'},
+        'StdCalibrate' : {'Corrections' : {'outTemp' : 'outTemp - 0.2', 'outHumidity' : 'outHumidity * 1.02'}},
+        'StdQC'        : {'MinMax' : {'outTemp' : ['-40', '120', 'degree_F'], 'barometer' : ['26', '32.5', 'inHg'],
+                                      'outHumidity' : ['0', '100'], 'windSpeed' : ['0', '120', 'mile_per_hour']}},
+        'Bench'        : {'npackets' : str(npackets)},
+        'Engines'      : {'WxEngine' : {'process_services' : services + ['__main__.Stopper']}}})
+
+def time_engine(engine_class, config_dict):
+    engine = engine_class(config_dict)
+    t0 = time.time()
+    try:
+        engine.run()
+    except weewx.StopNow:
+        pass
+    return time.time() - t0
+
+def time_loop(console):
+    t0 = time.time()
+    for _packet in console.genLoopPackets():
+        pass
+    return time.time() - t0
+
+# The packets played back to the engine:
+packets = []
+
+def main():
+    npackets = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    nrounds = 3
+    syslog.setlogmask(syslog.LOG_UPTO(syslog.LOG_WARNING))
+
+    global packets
+    station = weewx.drivers.simulator.Simulator(mode='generator', loop_interval=2.5)
+    packets = list(itertools.islice(station.genLoopPackets(), npackets))
+
+    # The time it takes to play back the packets, which is subtracted:
+    t_play = min(time_loop(PlayBack(packets)) for _ in range(nrounds))
+
+    service_sets = [('10 services that do nothing', ['__main__.Nothing'] * 10),
+                    ('StdConvert, StdCalibrate, StdQC', ['weewx.wxengine.StdConvert', 'weewx.wxengine.StdCalibrate',
+                                                         'weewx.wxengine.StdQC']),
+                    ('StdFilter', ['weewx.wxengine.StdFilter'])]
+    print "%d LOOP packets. Playback: %.2f us/packet" % (npackets, t_play / npackets * 1e6)
+    for (name, services) in service_sets:
+        config_dict = make_config(npackets, services)
+        t_legacy   = min(time_engine(LegacyEngine, config_dict) for _ in range(nrounds)) - t_play
+        t_compiled = min(time_engine(BenchEngine, config_dict) for _ in range(nrounds)) - t_play
+        print "%s:" % (name,)
+        print "  per-dispatch lookup:     %.2f us/packet" % (t_legacy / npackets * 1e6,)
+        print "  compiled dispatch table: %.2f us/packet (%.2fx)" % (t_compiled / npackets * 1e6,
+                                                                    t_legacy / t_compiled)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""Benchmark of Archive.getRecord() with a max_delta.
+
+Builds a large archive of one minute records, then times the old nearest
+record query, which sorted every record in the window by its distance from
+the target time, against the two index probes used now, for several window
+sizes. The results of the two are checked to be the same.
+
+Run from the bin directory:
+
+    PYTHONPATH=. python ../experimental/bench_nearest_record.py [nrecs]
+"""
+from __future__ import with_statement
+import os
+import random
+import sys
+import syslog
+import tempfile
+import time
+
+import weedb
+import weewx.archive
+import user.schemas
+
+interval = 60
+
+def make_archive(archive_db_dict, nrecs):
+    """Fill a new archive with nrecs one minute records, with a few gaps."""
+    start_ts = int(time.mktime((2000, 1, 1, 0, 0, 0, 0, 0, -1)))
+    def gen_records():
+        for irec in xrange(nrecs):
+            if irec % 10000 < 50:
+                continue
+            yield {'dateTime' : start_ts + irec * interval, 'usUnits' : weewx.US, 'interval' : 1,
+                   'outTemp' : random.uniform(0, 90), 'barometer' : random.uniform(29, 31)}
+    with weewx.archive.Archive.open_with_create(archive_db_dict, user.schemas.defaultArchiveSchema) as archive:
+        archive.addRecord(gen_records(), log_level=syslog.LOG_DEBUG)
+    return (start_ts, start_ts + nrecs * interval)
+
+def nearest_by_sorting(archive, timestamp, max_delta):
+    """The old way of finding the nearest record."""
+    _row = archive.getSql("SELECT * FROM %s WHERE dateTime>=? AND dateTime<=? "\
+                          "ORDER BY ABS(dateTime-?) ASC LIMIT 1" % (archive.table,),
+                          (timestamp - max_delta, timestamp + max_delta, timestamp))
+    return dict(zip(archive.sqlkeys, _row)) if _row else None
+
+def main():
+    nrecs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    nqueries = 2000
+    random.seed(42)
+    tmp_dir = tempfile.mkdtemp()
+    archive_db_dict = {'driver' : 'weedb.sqlite', 'root' : tmp_dir, 'database' : 'bench_archive.sdb'}
+    try:
+        t0 = time.time()
+        (start_ts, stop_ts) = make_archive(archive_db_dict, nrecs)
+        print "Built an archive of %d records in %.1f seconds" % (nrecs, time.time() - t0)
+        with weewx.archive.Archive.open(archive_db_dict) as archive:
+            for max_delta in (300, 3600, 86400, 7 * 86400):
+                targets = [random.randint(start_ts, stop_ts) for _ in xrange(nqueries)]
+                t0 = time.time()
+                old_results = [nearest_by_sorting(archive, ts, max_delta) for ts in targets]
+                t_old = time.time() - t0
+                t0 = time.time()
+                new_results = [archive.getRecord(ts, max_delta) for ts in targets]
+                t_new = time.time() - t0
+                # Ties can be broken either way by the old query:
+                nsame = sum(1 for (_old, _new, ts) in zip(old_results, new_results, targets)
+                            if _old == _new or abs(_old['dateTime'] - ts) == abs(_new['dateTime'] - ts))
+                print "max_delta %7d: sorting %8.1f usec/query; index probes %6.1f usec/query; "\
+                    "speedup %6.1fx; %d of %d the same" % \
+                    (max_delta, t_old / nqueries * 1e6, t_new / nqueries * 1e6, t_old / t_new, nsame, nqueries)
+    finally:
+        weedb.drop(archive_db_dict)
+        os.rmdir(tmp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""Benchmark of streaming archive records as dictionaries versus as views.
+
+Builds an archive with the default schema, then times streaming alone, a stats
+backfill, and a reconfig (copy to a new archive) with records streamed from
+Archive.genBatchRecords(), which builds a dictionary for each row, against
+Archive.genBatchViews(), which wraps each row in a RecordView. Each timing is
+the best of three runs.
+
+Run from the bin directory:
+
+    PYTHONPATH=. python ../experimental/bench_record_streaming.py [ndays]
+"""
+from __future__ import with_statement
+import os
+import random
+import sys
+import tempfile
+import time
+
+import weedb
+import weewx.archive
+import weewx.stats
+import weewx.units
+import user.schemas
+
+interval = 300
+
+def make_archive(archive_db_dict, ndays):
+    """Fill a new archive with ndays of five minute records."""
+    start_ts = int(time.mktime((2013, 1, 1, 0, 0, 0, 0, 0, -1)))
+    def gen_records():
+        for irec in xrange(ndays * 86400 // interval):
+            yield {'dateTime' : start_ts + irec * interval, 'usUnits' : weewx.US, 'interval' : interval // 60,
+                   'outTemp' : random.uniform(0, 90), 'barometer' : random.uniform(29, 31),
+                   'inTemp' : random.uniform(60, 75), 'outHumidity' : random.uniform(20, 100),
+                   'windSpeed' : random.uniform(0, 20), 'windDir' : random.uniform(0, 360),
+                   'windGust' : random.uniform(0, 30), 'windGustDir' : random.uniform(0, 360),
+                   'rain' : random.choice([0.0, 0.0, 0.0, 0.01])}
+    with weewx.archive.Archive.open_with_create(archive_db_dict, user.schemas.defaultArchiveSchema) as archive:
+        archive.addRecord(gen_records())
+
+def drop(db_dict):
+    try:
+        weedb.drop(db_dict)
+    except weedb.NoDatabase:
+        pass
+
+def time_stream(archive_db_dict, use_views):
+    with weewx.archive.Archive.open(archive_db_dict) as archive:
+        t0 = time.time()
+        gen = archive.genBatchViews() if use_views else archive.genBatchRecords()
+        for _rec in gen:
+            _rec['outTemp']
+        return time.time() - t0
+
+def time_backfill(archive_db_dict, stats_db_dict, use_views):
+    drop(stats_db_dict)
+    with weewx.archive.Archive.open(archive_db_dict) as archive:
+        if not use_views:
+            # Stream the old way:
+            archive.genBatchViews = archive.genBatchRecords
+        with weewx.stats.StatsDb.open_with_create(stats_db_dict, user.schemas.defaultStatsSchema) as stats:
+            t0 = time.time()
+            stats.backfillFrom(archive)
+            return time.time() - t0
+
+def time_reconfig(archive_db_dict, new_db_dict, unit_system, use_views):
+    drop(new_db_dict)
+    with weewx.archive.Archive.open(archive_db_dict) as old_archive:
+        with weewx.archive.Archive.open_with_create(new_db_dict, user.schemas.defaultArchiveSchema) as new_archive:
+            t0 = time.time()
+            gen = old_archive.genBatchViews() if use_views else old_archive.genBatchRecords()
+            new_archive.addRecord(weewx.units.GenWithConvert(gen, unit_system))
+            return time.time() - t0
+
+def main():
+    ndays = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    random.seed(42)
+    tmp_dir = tempfile.mkdtemp()
+    archive_db_dict = {'driver' : 'weedb.sqlite', 'root' : tmp_dir, 'database' : 'bench_archive.sdb'}
+    stats_db_dict   = {'driver' : 'weedb.sqlite', 'root' : tmp_dir, 'database' : 'bench_stats.sdb'}
+    new_db_dict     = {'driver' : 'weedb.sqlite', 'root' : tmp_dir, 'database' : 'bench_new.sdb'}
+    try:
+        make_archive(archive_db_dict, ndays)
+        with weewx.archive.Archive.open(archive_db_dict) as archive:
+            nrecs = archive.getSql("SELECT COUNT(*) FROM archive")[0]
+        print "Streaming %d days (%d records) of archive records:" % (ndays, nrecs)
+        def report(label, func, *args):
+            t_dict = min(func(*(args + (False,))) for _ in range(3))
+            t_view = min(func(*(args + (True,))) for _ in range(3))
+            print "  %-22s dicts: %8.0f records/second" % (label, nrecs / t_dict)
+            print "  %-22s views: %8.0f records/second (%.2fx)" % ('', nrecs / t_view, t_dict / t_view)
+        report('stream only', time_stream, archive_db_dict)
+        report('backfill', time_backfill, archive_db_dict, stats_db_dict)
+        report('reconfig, same units', time_reconfig, archive_db_dict, new_db_dict, None)
+        report('reconfig, to metric', time_reconfig, archive_db_dict, new_db_dict, weewx.METRIC)
+    finally:
+        for db_dict in (archive_db_dict, stats_db_dict, new_db_dict):
+            drop(db_dict)
+        os.rmdir(tmp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""Benchmark of aggregated plot vectors from the archive versus from the
+hourly and daily tier tables.
+
+Builds an archive of five minute records, rolls it up with
+Archive.rollUp(), then times the aggregated calls to
+Archive.getSqlVectors() and getSqlVectorsExtended() made by the standard
+skin's week, month, and year plots, against the same calls before the tier
+tables existed. The results are checked to agree to within rounding.
+
+Run from the bin directory:
+
+    PYTHONPATH=. python ../experimental/bench_rollup_tiers.py [ndays]
+"""
+from __future__ import with_statement
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import weedb
+import weewx.archive
+import user.schemas
+
+interval = 300
+
+# (type, time length, aggregate interval, aggregate type) of the standard
+# plots that aggregate:
+plots = [('outTemp',  7 * 86400,   3600,  'avg'),
+         ('rain',     7 * 86400,   86400, 'sum'),
+         ('windvec',  7 * 86400,   3600,  'avg'),
+         ('outTemp',  30 * 86400,  10800, 'avg'),
+         ('windvec',  30 * 86400,  10800, 'avg'),
+         ('outTemp',  365 * 86400, 86400, 'avg'),
+         ('outTemp',  365 * 86400, 86400, 'max'),
+         ('windSpeed', 365 * 86400, 86400, 'max'),
+         ('windvec',  365 * 86400, 86400, 'avg')]
+
+def time_plots(archive, stop_ts, nrounds):
+    results = []
+    t0 = time.time()
+    for _ in xrange(nrounds):
+        results = [archive.getSqlVectorsExtended(obs_type, stop_ts - length, stop_ts, agg_interval, agg_type)
+                   for (obs_type, length, agg_interval, agg_type) in plots]
+    return ((time.time() - t0) / nrounds, results)
+
+def main():
+    ndays = int(sys.argv[1]) if len(sys.argv) > 1 else 365
+    nrounds = 3
+    random.seed(42)
+    tmp_dir = tempfile.mkdtemp()
+    archive_db_dict = {'driver' : 'weedb.sqlite', 'root' : tmp_dir, 'database' : 'bench_archive.sdb'}
+    start_ts = int(time.mktime((2013, 1, 1, 0, 0, 0, 0, 0, -1)))
+    nrecs = ndays * 86400 // interval
+    def gen_records():
+        for irec in xrange(1, nrecs + 1):
+            yield {'dateTime' : start_ts + irec * interval, 'usUnits' : weewx.US, 'interval' : interval // 60,
+                   'outTemp' : random.uniform(0, 90), 'windSpeed' : random.uniform(0, 20),
+                   'windDir' : random.uniform(0, 360), 'rain' : random.choice([0.0, 0.0, 0.0, 0.01])}
+    try:
+        with weewx.archive.Archive.open_with_create(archive_db_dict, user.schemas.defaultArchiveSchema) as archive:
+            archive.addRecord(gen_records())
+            stop_ts = start_ts + nrecs * interval
+            (t_raw, raw_results) = time_plots(archive, stop_ts, nrounds)
+            t0 = time.time()
+            archive.rollUp()
+            print "Rolled up %d records in %.1f seconds" % (nrecs, time.time() - t0)
+            (t_tier, tier_results) = time_plots(archive, stop_ts, nrounds)
+            for (raw, tier) in zip(raw_results, tier_results):
+                assert raw[0] == tier[0]
+                assert all(abs(_raw - _tier) < 1e-6 for (_raw, _tier) in zip(raw[1][0], tier[1][0]))
+            print "Aggregated week, month, and year plots over %d days:" % (ndays,)
+            print "  archive: %.3f seconds/round" % (t_raw,)
+            print "  tiers:   %.3f seconds/round (%.1fx)" % (t_tier, t_raw / t_tier)
+    finally:
+        weedb.drop(archive_db_dict)
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()
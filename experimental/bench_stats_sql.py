@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""Micro-benchmark of the SQL used by StatsDb.getAggregate().
+
+Builds a stats database with several years of daily statistics, then times
+the old style of query, where the values were interpolated into the SQL
+string, against the bound parameters used now. The aggregate cache is
+bypassed, so only the cost of the queries is measured.
+
+Run from the bin directory:
+
+    PYTHONPATH=. python ../experimental/bench_stats_sql.py [nyears]
+"""
+from __future__ import with_statement
+import os
+import random
+import sys
+import tempfile
+import time
+
+import weedb
+import weewx.stats
+
+stats_schema = [('outTemp', 'REAL'), ('barometer', 'REAL'), ('rain', 'REAL'), ('wind', 'VECTOR')]
+aggregate_types = ['min', 'max', 'mintime', 'maxtime', 'sum', 'count', 'avg', 'max_ge']
+
+def make_database(stats_db_dict, nyears):
+    """Fill a new stats database with nyears of daily statistics."""
+    start_ts = int(time.mktime((2014 - nyears, 1, 1, 0, 0, 0, 0, 0, -1)))
+    with weewx.stats.StatsDb.open_with_create(stats_db_dict, stats_schema) as stats:
+        with weedb.Transaction(stats.connection) as cursor:
+            for iday in xrange(nyears * 365):
+                sod_ts = start_ts + iday * 86400
+                for (stats_type, kind) in stats_schema:
+                    lo = random.uniform(-20, 20)
+                    hi = lo + random.uniform(0, 20)
+                    row = (sod_ts, lo, sod_ts + 3600, hi, sod_ts + 7200, (lo + hi) * 144, 288)
+                    if kind == 'VECTOR':
+                        row += (random.uniform(0, 360), 1.0, 1.0, hi * hi * 288, 288)
+                    cursor.execute(weewx.stats._sql_replace_string_factory(stats.schema, stats_type), row)
+            cursor.execute(weewx.stats.meta_replace_str, ('unit_system', str(weewx.US)))
+            cursor.execute(weewx.stats.meta_replace_str, ('lastUpdate', str(sod_ts)))
+    return (start_ts, sod_ts)
+
+def gen_queries(start_ts, stop_ts, nqueries):
+    """Generate (stats_type, aggregateType, start, stop, val) for random day spans."""
+    ndays = (stop_ts - start_ts) // 86400
+    for _ in xrange(nqueries):
+        stats_type = random.choice(stats_schema)[0]
+        aggregate_type = random.choice(aggregate_types)
+        start = start_ts + random.randint(0, ndays - 31) * 86400
+        stop = start + random.choice([1, 7, 31]) * 86400
+        val = random.uniform(-20, 40) if aggregate_type == 'max_ge' else None
+        yield (stats_type, aggregate_type, start, stop, val)
+
+def time_interpolated(stats, queries):
+    t0 = time.time()
+    for (stats_type, aggregate_type, start, stop, val) in queries:
+        stats.xeqSql(weewx.stats.sqlDict[aggregate_type],
+                     {'stats_type' : stats_type, 'start' : start, 'stop' : stop, 'val' : val})
+    return time.time() - t0
+
+def time_bound(stats, queries):
+    t0 = time.time()
+    for (stats_type, aggregate_type, start, stop, val) in queries:
+        params = {'start' : start, 'stop' : stop, 'val' : val}
+        (sql_stmt, param_names) = stats._getAggregateSql(aggregate_type, stats_type)
+        stats._fetchone(sql_stmt, tuple(params[name] for name in param_names))
+    return time.time() - t0
+
+def main():
+    nyears = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    nqueries = 20000
+    random.seed(42)
+    tmp_dir = tempfile.mkdtemp()
+    stats_db_dict = {'driver' : 'weedb.sqlite', 'root' : tmp_dir, 'database' : 'bench_stats.sdb'}
+    try:
+        (start_ts, stop_ts) = make_database(stats_db_dict, nyears)
+        queries = list(gen_queries(start_ts, stop_ts, nqueries))
+        with weewx.stats.StatsDb.open(stats_db_dict) as stats:
+            # Warm up the page cache, then time each style:
+            time_interpolated(stats, queries[:1000])
+            t_old = time_interpolated(stats, queries)
+            t_new = time_bound(stats, queries)
+        print "%d queries on %d years of statistics:" % (nqueries, nyears)
+        print "  interpolated SQL:  %6.1f usec/query" % (t_old / nqueries * 1e6,)
+        print "  bound parameters:  %6.1f usec/query" % (t_new / nqueries * 1e6,)
+        print "  speedup:           %6.2fx" % (t_old / t_new,)
+    finally:
+        weedb.drop(stats_db_dict)
+        os.rmdir(tmp_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""Benchmark of the conversion of plot vectors to the units of a skin.
+
+Times Converter.convert() on a year of five minute values, as the image
+generator calls it on the vectors from getSqlVectors(), against the same
+conversion done the way it was before, with a call of the conversion
+function for each value. Also times weewx.units.convert_vector() on an
+array of doubles and a NumPy array, if NumPy is installed. The results are
+checked to be the same.
+
+Run from the bin directory:
+
+    PYTHONPATH=. python ../experimental/bench_unit_conversion.py [nvalues]
+"""
+import array
+import random
+import sys
+import time
+
+import weewx.units
+
+def old_convert(val_t, target_unit_type):
+    """weewx.units.convert(), as it was."""
+    conversion_func = weewx.units.conversionDict[val_t[1]][target_unit_type]
+    new_val = map(lambda x : conversion_func(x) if x is not None else None, val_t[0])
+    return weewx.units.ValueTuple(new_val, target_unit_type, val_t[2])
+
+def best_time(func, nrounds=5):
+    t_best = None
+    for _ in range(nrounds):
+        t0 = time.time()
+        result = func()
+        t = time.time() - t0
+        t_best = min(t_best, t) if t_best is not None else t
+    return (t_best, result)
+
+def main():
+    nvalues = int(sys.argv[1]) if len(sys.argv) > 1 else 365 * 288
+    random.seed(42)
+    converter = weewx.units.Converter(weewx.units.MetricUnits)
+    print "Converting %d values to metric:" % (nvalues,)
+    for (unit, group, low, high) in [('degree_F', 'group_temperature', -20.0, 100.0),
+                                     ('inHg', 'group_pressure', 29.0, 31.0),
+                                     ('mile_per_hour', 'group_speed', 0.0, 30.0)]:
+        vec = [random.uniform(low, high) if random.random() > 0.02 else None for _ in xrange(nvalues)]
+        target_unit = converter.group_unit_dict[group]
+        (t_old, old_vt) = best_time(lambda : old_convert((vec, unit, group), target_unit))
+        (t_new, new_vt) = best_time(lambda : converter.convert((vec, unit, group)))
+        assert old_vt == new_vt
+        print "  %s to %s:" % (unit, target_unit)
+        print "    per value function: %.2f ms" % (t_old * 1000.0,)
+        print "    compiled list:      %.2f ms (%.1fx)" % (t_new * 1000.0, t_old / t_new)
+        doubles = array.array('d', [x if x is not None else float('nan') for x in vec])
+        (t_doubles, _) = best_time(lambda : weewx.units.convert_vector(doubles, unit, target_unit))
+        print "    array of doubles:   %.2f ms (%.1fx)" % (t_doubles * 1000.0, t_old / t_doubles)
+        if weewx.units.numpy is not None:
+            ndarray = weewx.units.numpy.array(doubles)
+            (t_numpy, _) = best_time(lambda : weewx.units.convert_vector(ndarray, unit, target_unit))
+            print "    NumPy array:        %.2f ms (%.1fx)" % (t_numpy * 1000.0, t_old / t_numpy)
+
+if __name__ == '__main__':
+    main()
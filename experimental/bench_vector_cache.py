@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+#    Copyright (c) 2014 Tom Keffer <tkeffer@gmail.com>
+#
+#    See the file LICENSE.txt for your full rights.
+#
+#    $Revision$
+#    $Author$
+#    $Date$
+#
+"""Benchmark of fetching plot vectors from the database versus from the
+vector cache.
+
+Builds an archive of five minute records, then times the calls to
+Archive.getSqlVectors() made by the standard skin's day, week, month, and year
+plots of outTemp, with and without a weewx.vectorcache.VectorCache. Between
+rounds, one new record is added, as happens each archive interval. The
+results of the two are checked to be the same.
+
+Run from the bin directory:
+
+    PYTHONPATH=. python ../experimental/bench_vector_cache.py [ndays]
+"""
+from __future__ import with_statement
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import weedb
+import weewx.archive
+import weewx.vectorcache
+import user.schemas
+
+interval = 300
+
+# (time length, aggregate interval, aggregate type) of the standard plots:
+plots = [(     86400, None,  None),
+         ( 7 * 86400, 3600,  'avg'),
+         (30 * 86400, 10800, 'avg'),
+         (365 * 86400, 86400, 'avg')]
+
+def main():
+    ndays = int(sys.argv[1]) if len(sys.argv) > 1 else 365
+    nrounds = 10
+    random.seed(42)
+    tmp_dir = tempfile.mkdtemp()
+    archive_db_dict = {'driver' : 'weedb.sqlite', 'root' : tmp_dir, 'database' : 'bench_archive.sdb'}
+    start_ts = int(time.mktime((2013, 1, 1, 0, 0, 0, 0, 0, -1)))
+    def make_record(irec):
+        return {'dateTime' : start_ts + irec * interval, 'usUnits' : weewx.US, 'interval' : interval // 60,
+                'outTemp' : random.uniform(0, 90), 'barometer' : random.uniform(29, 31)}
+    try:
+        nrecs = ndays * 86400 // interval
+        with weewx.archive.Archive.open_with_create(archive_db_dict, user.schemas.defaultArchiveSchema) as archive:
+            archive.addRecord(make_record(irec) for irec in xrange(nrecs))
+            vector_cache = weewx.vectorcache.get_cache(archive, os.path.join(tmp_dir, 'vectors'))
+            t0 = time.time()
+            archive.vector_cache = vector_cache
+            archive.getSqlVectors('outTemp', start_ts, start_ts)
+            print "Built the cache of %d records in %.2f seconds" % (nrecs, time.time() - t0)
+            t_sql = t_cache = 0.0
+            for iround in xrange(nrounds):
+                archive.addRecord(make_record(nrecs + iround))
+                stop_ts = start_ts + (nrecs + iround) * interval
+                for (length, agg_interval, agg_type) in plots:
+                    archive.vector_cache = None
+                    t0 = time.time()
+                    sql_result = archive.getSqlVectors('outTemp', stop_ts - length, stop_ts, agg_interval, agg_type)
+                    t_sql += time.time() - t0
+                    archive.vector_cache = vector_cache
+                    t0 = time.time()
+                    cache_result = archive.getSqlVectors('outTemp', stop_ts - length, stop_ts, agg_interval, agg_type)
+                    t_cache += time.time() - t0
+                    assert sql_result == cache_result
+            print "%d rounds of day, week, month, and year plots over %d days:" % (nrounds, ndays)
+            print "  database: %.3f seconds/round" % (t_sql / nrounds)
+            print "  cache:    %.3f seconds/round (%.2fx)" % (t_cache / nrounds, t_sql / t_cache)
+            vector_cache.close()
+    finally:
+        weedb.drop(archive_db_dict)
+        shutil.rmtree(tmp_dir)
+
+if __name__ == '__main__':
+    main()